@@ -0,0 +1,131 @@
+'''
+    Benchmark of serializing bulk bodies.
+
+    Compares building the body of a Bulk API request by repeated string
+    concatenation of :func:`json.dumps` output, as
+    :meth:`BulkOperation.execute` used to, with
+    :meth:`BulkOperation._bulk_body` which serializes the actions a chunk
+    at a time, without keeping them, and joins every chunk into the body.
+    The join is measured both with actions that still have to be serialized
+    and with actions that were serialized when they were recorded, i.e. with
+    ``compact=True``. Reports the best time of a few runs and, where
+    :mod:`tracemalloc` is available, peak memory of building the body and
+    memory held by the recorded actions.
+
+    Note that CPython resizes a string in place when it is concatenated to
+    while nothing else references it, which keeps the concatenation linear on
+    CPython only; other interpreters copy the body on every concatenation.
+
+    Usage::
+
+        python benchmarks/bench_bulk_body.py --actions 100000
+'''
+
+import argparse
+import gc
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from superelasticsearch import BulkOperation
+from superelasticsearch import json
+
+
+def concat_body(bulk):
+    bulk_body = ''
+    for action in bulk._actions:
+        op = json.dumps({action.type: action.params})
+        if action.type != 'delete':
+            op += '\n' + json.dumps(action.body)
+        bulk_body += op + '\n'
+    return bulk_body
+
+
+def join_body(bulk):
+    return bulk._bulk_body(bulk._actions)
+
+
+def uncache(bulk):
+    for action in bulk._actions:
+        action._op = None
+
+
+def make_bulk(actions, compact=False):
+    bulk = BulkOperation(None, compact=compact, index='bench',
+                         doc_type='docs')
+    for i in range(actions):
+        bulk.index(id=i, body=dict(title='document %s' % i, count=i,
+                                   tags=['a', 'b', 'c'], flag=i % 2 == 0))
+    return bulk
+
+
+def traced(func, *args):
+    '''
+    Returns result of the function, and peak and retained memory allocated
+    while it ran.
+    '''
+
+    if tracemalloc is None:
+        return func(*args), None, None
+
+    gc.collect()
+    tracemalloc.start()
+    result = func(*args)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, peak, retained
+
+
+def measure(func, bulk, repeat, setup=None):
+    best = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup(bulk)
+        gc.collect()
+        start = time.time()
+        func(bulk)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    if setup is not None:
+        setup(bulk)
+    peak = traced(func, bulk)[1]
+    return best, peak
+
+
+def mb(size):
+    return size / 1024.0 / 1024.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--actions', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    bulk, _, bulk_memory = traced(make_bulk, args.actions)
+    compact_bulk, _, compact_memory = traced(make_bulk, args.actions, True)
+    body_size = len(join_body(compact_bulk))
+    print('%d actions, %d bytes of body' % (args.actions, body_size))
+
+    for name, func, bench_bulk, setup in (
+            ('concat', concat_body, bulk, None),
+            ('join', join_body, bulk, uncache),
+            ('compact', join_body, compact_bulk, None)):
+        best, peak = measure(func, bench_bulk, args.repeat, setup)
+        line = '%-8s %8.3fs' % (name, best)
+        if peak is not None:
+            line += '  peak %6.1f MB (%.2fx body)' % (
+                mb(peak), float(peak) / body_size)
+        print(line)
+
+    if bulk_memory is not None:
+        print('recorded actions: %.1f MB, compact: %.1f MB' % (
+            mb(bulk_memory), mb(compact_memory)))
+
+
+if __name__ == '__main__':
+    main()
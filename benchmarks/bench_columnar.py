@@ -0,0 +1,132 @@
+'''
+    Benchmark of columnar output of iterated search.
+
+    Compares building NumPy arrays of a few fields from the documents
+    returned by :meth:`SuperElasticsearch.itersearch`, one dict at a time,
+    with :meth:`SuperElasticsearch.itercolumns`, per page and concatenated.
+    Scroll pages are served from memory, so only the work on the client is
+    measured. Reports the best time of a few runs and, where
+    :mod:`tracemalloc` is available, peak memory of a run.
+
+    Usage::
+
+        python benchmarks/bench_columnar.py --docs 200000 --size 5000
+'''
+
+import argparse
+import gc
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import numpy
+
+from superelasticsearch import SuperElasticsearch
+
+FIELDS = ['price', 'quantity', 'user.age', 'country']
+
+
+def make_pages(docs, size):
+    hits = [dict(_index='bench', _type='docs', _id=str(i), _score=None,
+                 _source=dict(price=i * 0.5, quantity=i % 7,
+                              user=dict(age=18 + i % 60, name='user %s' % i),
+                              country='c%s' % (i % 30),
+                              title='document %s' % i))
+            for i in range(docs)]
+    # every 10th document misses a field
+    for hit in hits[::10]:
+        hit['_source'].pop('quantity')
+    return [hits[i:i + size] for i in range(0, docs, size)]
+
+
+def fake_client(pages):
+    '''
+    Returns client whose scroll serves the pages from memory.
+    '''
+
+    total = sum(len(page) for page in pages)
+
+    def response(page):
+        hits = pages[page] if page < len(pages) else []
+        return dict(_scroll_id=str(page), hits=dict(total=total, hits=hits))
+
+    es = SuperElasticsearch(hosts=['localhost:9200'])
+    es.search = lambda **kwargs: response(0)
+    es.scroll = lambda scroll_id, **kwargs: response(int(scroll_id) + 1)
+    es.clear_scroll = lambda **kwargs: None
+    return es
+
+
+def dicts(es):
+    '''
+    Builds masked arrays of the fields from documents one at a time.
+    '''
+
+    values = dict((field, []) for field in FIELDS)
+    for doc in es.itersearch('1m', chunked=False):
+        source = doc['_source']
+        values['price'].append(source.get('price'))
+        values['quantity'].append(source.get('quantity'))
+        values['user.age'].append(source.get('user', {}).get('age'))
+        values['country'].append(source.get('country'))
+
+    columns = {}
+    for field, column in values.items():
+        mask = numpy.array([value is None for value in column])
+        data = numpy.array([0 if value is None else value
+                            for value in column])
+        columns[field] = numpy.ma.MaskedArray(data, mask=mask)
+    return columns
+
+
+def pages(es):
+    return list(es.itercolumns('1m', FIELDS))
+
+
+def concatenated(es):
+    return list(es.itercolumns('1m', FIELDS, concatenate=True))
+
+
+def measure(func, es, repeat):
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.time()
+        func(es)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    peak = None
+    if tracemalloc is not None:
+        gc.collect()
+        tracemalloc.start()
+        func(es)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return best, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--docs', type=int, default=200000)
+    parser.add_argument('--size', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    es = fake_client(make_pages(args.docs, args.size))
+    print('%d docs, %d per page, %d fields' % (args.docs, args.size,
+                                               len(FIELDS)))
+    for name, func in (('dicts', dicts), ('columns', pages),
+                       ('concatenated', concatenated)):
+        best, peak = measure(func, es, args.repeat)
+        line = '%-14s %8.3fs %10.0f docs/s' % (name, best, args.docs / best)
+        if peak is not None:
+            line += '  peak %6.1f MB' % (peak / 1024.0 / 1024.0)
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+'''
+    Benchmark of compressing bulk bodies and scroll pages.
+
+    Compresses the body of a Bulk API request, as built by
+    :class:`BulkOperation`, and a scroll page of the same documents, with
+    every content encoding and a few compression levels, and reports the CPU
+    time taken per MB against the bytes saved. Compression pays off when
+    the time it takes is shorter than the time it saves on the wire, i.e.
+    when the bytes saved take longer to send than the compression takes.
+
+    Usage::
+
+        python benchmarks/bench_compression.py --actions 20000 --bandwidth 12.5
+'''
+
+import argparse
+import json
+import time
+
+from superelasticsearch import BulkOperation
+from superelasticsearch.compression import compress, decompress
+
+LEVELS = (1, 3, 6, 9)
+
+
+def make_body(actions):
+    bulk = BulkOperation(None, index='bench', doc_type='docs')
+    for i in range(actions):
+        bulk.index(id=i, body=dict(title='document %s' % i, count=i,
+                                   tags=['tag%s' % (i % 50), 'b'],
+                                   user=dict(id=i % 1000,
+                                             name='user %s' % (i % 1000)),
+                                   flag=i % 2 == 0))
+    return bulk._bulk_body(bulk._actions).encode('utf-8')
+
+
+def make_page(docs):
+    hits = [dict(_index='bench', _type='docs', _id=str(i), _score=None,
+                 _source=dict(title='document %s' % i, count=i,
+                              tags=['tag%s' % (i % 50), 'b'],
+                              user=dict(id=i % 1000,
+                                        name='user %s' % (i % 1000)),
+                              flag=i % 2 == 0))
+            for i in range(docs)]
+    return json.dumps(dict(_scroll_id='c2Nhbjsx', took=5, hits=dict(
+        total=docs, max_score=None, hits=hits))).encode('utf-8')
+
+
+# CPU time of the process, time.clock on Python 2
+process_time = getattr(time, 'process_time', None) or time.clock
+
+
+def cpu_time(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = process_time()
+        result = func()
+        elapsed = process_time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def report(name, data, args):
+    size = len(data)
+    mb = size / 1048576.0
+    wire = mb / args.bandwidth
+    print('%s: %.1f MB, %.3fs to send at %.1f MB/s' % (
+        name, mb, wire, args.bandwidth))
+    print('%-8s %5s %9s %7s %12s %12s %9s' % (
+        'encoding', 'level', 'size', 'saved', 'compress/MB',
+        'decompr./MB', 'net gain'))
+    for encoding in ('gzip', 'deflate'):
+        for level in LEVELS:
+            seconds, compressed = cpu_time(
+                lambda: compress(data, encoding, level), args.repeat)
+            decompress_seconds, _ = cpu_time(
+                lambda: decompress(compressed, encoding), args.repeat)
+            saved = 1 - len(compressed) / float(size)
+            # time saved on the wire less time spent compressing
+            gain = wire * saved - seconds
+            print('%-8s %5d %8.1fM %6.1f%% %11.1fms %11.1fms %8.3fs' % (
+                encoding, level, len(compressed) / 1048576.0, saved * 100,
+                seconds / mb * 1000, decompress_seconds / mb * 1000, gain))
+    print('')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--actions', type=int, default=20000,
+                        help='number of actions of the bulk body')
+    parser.add_argument('--docs', type=int, default=5000,
+                        help='number of documents of the scroll page')
+    parser.add_argument('--bandwidth', type=float, default=12.5,
+                        help='MB per second of the link, for the net gain')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    report('bulk body of %d actions' % args.actions,
+           make_body(args.actions), args)
+    report('scroll page of %d docs' % args.docs, make_page(args.docs), args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+'''
+    Benchmark of serializing bulk bodies in worker processes.
+
+    Compares building the body of a Bulk API request of large nested
+    documents in process, as :meth:`BulkOperation._bulk_body` does, with
+    serializing the actions in a :class:`SerializerPool` of a few worker
+    processes, and reports the time of every pool size relative to the time
+    in process. Any gain is bounded by the number of free CPUs, and reduced
+    by the time taken to pickle the actions to the workers; on a single CPU
+    the pool only adds that time.
+
+    Usage::
+
+        python benchmarks/bench_serializer_pool.py --actions 20000 --width 40
+'''
+
+import argparse
+import gc
+import multiprocessing
+import time
+
+from superelasticsearch import BulkOperation
+from superelasticsearch import SerializerPool
+
+
+def make_doc(i, width):
+    return dict(
+        title='document %s' % i,
+        count=i,
+        user=dict(id=i % 1000, name='user %s' % (i % 1000),
+                  tags=['tag%s' % (j % 50) for j in range(10)]),
+        events=[dict(type='event %s' % j, at='2015-10-06T10:%02d:00' % j,
+                     values=[j * 0.5, j * 1.5, j * 2.5],
+                     meta=dict(source='bench', index=j))
+                for j in range(width)])
+
+
+def make_bulk(docs, pool=None):
+    bulk = BulkOperation(None, index='bench', doc_type='docs',
+                         serializer_pool=pool)
+    for i, doc in enumerate(docs):
+        bulk.index(id=i, body=doc)
+    return bulk
+
+
+def measure(bulk, repeat):
+    best = None
+    for _ in range(repeat):
+        for action in bulk._actions:
+            action._op = None
+        gc.collect()
+        start = time.time()
+        bulk._bulk_body(bulk._actions)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--actions', type=int, default=20000)
+    parser.add_argument('--width', type=int, default=40,
+                        help='number of nested events of every document')
+    parser.add_argument('--processes', type=int, action='append',
+                        help='pool size to measure, can be repeated')
+    parser.add_argument('--chunk-size', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    docs = [make_doc(i, args.width) for i in range(args.actions)]
+    bulk = make_bulk(docs)
+    size = len(bulk._bulk_body(bulk._actions))
+    print('%d actions, %.1f MB of body, %d CPUs' % (
+        args.actions, size / 1048576.0, multiprocessing.cpu_count()))
+
+    baseline = measure(bulk, args.repeat)
+    print('%-14s %8.3fs' % ('in process', baseline))
+
+    for processes in args.processes or [2, 4]:
+        with SerializerPool(processes=processes, min_actions=1,
+                            chunk_size=args.chunk_size) as pool:
+            pooled = make_bulk(docs, pool)
+            # start the workers before measuring
+            measure(pooled, 1)
+            seconds = measure(pooled, args.repeat)
+        print('%-14s %8.3fs  %5.2fx' % ('%d processes' % processes, seconds,
+                                        baseline / seconds))
+
+
+if __name__ == '__main__':
+    main()
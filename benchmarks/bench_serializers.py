@@ -0,0 +1,85 @@
+'''
+    Benchmark of JSON serializers.
+
+    Compares :class:`elasticsearch.serializer.JSONSerializer` with
+    :class:`FastJSONSerializer` using every JSON library that is installed,
+    on the bulk and scroll paths: encoding a bulk body of the given number of
+    actions and decoding a scroll response with the same number of hits.
+    Reports the best time of a few runs.
+
+    Usage::
+
+        python benchmarks/bench_serializers.py --docs 10000
+'''
+
+import argparse
+import time
+
+from datetime import datetime
+from decimal import Decimal
+
+from elasticsearch.exceptions import ImproperlyConfigured
+from elasticsearch.serializer import JSONSerializer
+
+from superelasticsearch import BulkOperation
+from superelasticsearch import FastJSONSerializer
+
+
+def make_doc(i):
+    return dict(title='document %s' % i, count=i, price=Decimal('9.99'),
+                created=datetime(2015, 10, 6, 10, 30), flag=i % 2 == 0,
+                tags=['tag%s' % j for j in range(5)],
+                nested=dict(key='value %s' % i, values=list(range(10))))
+
+
+def encode_bulk(serializer, docs):
+    bulk = BulkOperation(None, serializer=serializer, index='bench',
+                         doc_type='docs')
+    for i, doc in enumerate(docs):
+        bulk.index(id=i, body=doc)
+    return bulk._bulk_body(bulk._actions)
+
+
+def best_of(repeat, func, *args):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        func(*args)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--docs', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    docs = [make_doc(i) for i in range(args.docs)]
+    serializers = [('default', JSONSerializer())]
+    for name, _ in FastJSONSerializer.BACKENDS:
+        try:
+            serializers.append(('Fast (%s)' % name,
+                                FastJSONSerializer(backend=name)))
+        except ImproperlyConfigured:
+            print('%s is not installed, skipping' % name)
+
+    scroll_page = JSONSerializer().dumps(dict(
+        _scroll_id='c2Nhbjs2OzM0NDg1ODpzRlBLc0FXNlNyNm5JWUc1',
+        hits=dict(total=args.docs, max_score=None, hits=[
+            dict(_index='bench', _type='docs', _id=str(i), _score=None,
+                 _source=doc)
+            for i, doc in enumerate(docs)])))
+
+    print('%d docs, scroll page of %d bytes' % (args.docs, len(scroll_page)))
+    print('%-20s %10s %10s' % ('serializer', 'bulk', 'scroll'))
+    for name, serializer in serializers:
+        print('%-20s %9.4fs %9.4fs' % (
+            name,
+            best_of(args.repeat, encode_bulk, serializer, docs),
+            best_of(args.repeat, serializer.loads, scroll_page)))
+
+
+if __name__ == '__main__':
+    main()
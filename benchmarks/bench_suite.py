@@ -0,0 +1,258 @@
+'''
+    Benchmark suite of iterated search and bulk operations.
+
+    Runs :meth:`SuperElasticsearch.itersearch` and :class:`BulkOperation`
+    against the in-process :class:`fake_transport.FakeConnection`, with
+    configurable latency and document sizes, and measures:
+
+    ``itersearch_chunked`` / ``itersearch_docs``
+        documents per second of a scroll returning pages or documents
+    ``bulk_serialize``
+        actions per second of recording actions and serializing them to a
+        Bulk API body
+    ``bulk_execute``
+        actions per second of recording actions and executing them in Bulk
+        API requests of ``--chunk-size`` actions
+
+    along with the peak memory of every benchmark: the peak of memory
+    allocated by Python, traced with :mod:`tracemalloc` on Python 3, or on
+    Python 2 the growth of the maximum resident set size of a forked process
+    running the benchmark, which also counts memory that is not allocated by
+    Python and is rounded to pages. The way memory was measured is reported
+    as ``memory``. Results are written as JSON, and can be compared with the
+    results of an earlier run, e.g. of another commit, measured the same way.
+
+    Usage::
+
+        python benchmarks/bench_suite.py --output before.json
+        python benchmarks/bench_suite.py --compare before.json
+'''
+
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from fake_transport import fake_client
+
+
+def itersearch_chunked(es, args):
+    count = 0
+    for docs in es.itersearch(index='bench', scroll='1m',
+                              size=args.page_size):
+        count += len(docs)
+    return count
+
+
+def itersearch_docs(es, args):
+    count = 0
+    for _ in es.itersearch(index='bench', scroll='1m', size=args.page_size,
+                           chunked=False):
+        count += 1
+    return count
+
+
+def make_bulk(es, args):
+    bulk = es.bulk_operation(index='bench', doc_type='docs')
+    for i in range(args.actions):
+        bulk.index(id=i, body=dict(title='document %s' % i, count=i,
+                                   tags=['a', 'b', 'c'], flag=i % 2 == 0))
+    return bulk
+
+
+def bulk_serialize(es, args):
+    bulk = make_bulk(es, args)
+    bulk._bulk_body(bulk._actions)
+    return args.actions
+
+
+def bulk_execute(es, args):
+    bulk = es.bulk_operation(index='bench', doc_type='docs',
+                             max_actions=args.chunk_size)
+    with bulk:
+        for i in range(args.actions):
+            bulk.index(id=i, body=dict(title='document %s' % i, count=i,
+                                       tags=['a', 'b', 'c'],
+                                       flag=i % 2 == 0))
+    return args.actions
+
+
+BENCHMARKS = (
+    ('itersearch_chunked', itersearch_chunked, 'docs'),
+    ('itersearch_docs', itersearch_docs, 'docs'),
+    ('bulk_serialize', bulk_serialize, 'actions'),
+    ('bulk_execute', bulk_execute, 'actions'),
+)
+
+
+def run(func, es, args):
+    '''
+    Returns the best time of the runs, the number of items processed and the
+    peak memory of a traced run.
+    '''
+
+    best = None
+    for _ in range(args.repeat):
+        gc.collect()
+        start = time.time()
+        count = func(es, args)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    peak = None
+    if tracemalloc is not None:
+        gc.collect()
+        tracemalloc.start()
+        func(es, args)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    elif memory_method() == 'max_rss':
+        peak = max_rss_growth(func, es, args)
+    return best, count, peak
+
+
+def memory_method():
+    '''
+    Returns how peak memory is measured on this interpreter, or None if it
+    can't be.
+    '''
+
+    if tracemalloc is not None:
+        return 'tracemalloc'
+    if resource is not None and hasattr(os, 'fork'):
+        return 'max_rss'
+    return None
+
+
+def max_rss_growth(func, es, args):
+    '''
+    Returns the growth in bytes of the maximum resident set size of a forked
+    process that runs the benchmark. The forked process starts with the
+    resident set size of this process as its maximum, so the benchmarks run
+    before don't hide the memory used by this one.
+    '''
+
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        try:
+            gc.collect()
+            before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            func(es, args)
+            after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            os.write(write, ('%d' % (after - before)).encode('ascii'))
+        finally:
+            os._exit(0)
+
+    os.close(write)
+    with os.fdopen(read, 'rb') as f:
+        data = f.read()
+    os.waitpid(pid, 0)
+    if not data:
+        return None
+    # kilobytes on Linux, bytes on macOS
+    unit = 1 if sys.platform == 'darwin' else 1024
+    return int(data) * unit
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.STDOUT).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--docs', type=int, default=50000,
+                        help='number of documents to scroll over')
+    parser.add_argument('--doc-size', type=int, default=300,
+                        help='approximate size of documents in bytes')
+    parser.add_argument('--page-size', type=int, default=1000,
+                        help='documents per scroll page')
+    parser.add_argument('--actions', type=int, default=50000,
+                        help='number of bulk actions')
+    parser.add_argument('--chunk-size', type=int, default=1000,
+                        help='actions per Bulk API request')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='seconds to answer every request after')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', action='append',
+                        help='name of a benchmark to run, can be repeated')
+    parser.add_argument('--output', help='file to write JSON results to')
+    parser.add_argument('--compare',
+                        help='JSON results of an earlier run to compare with')
+    args = parser.parse_args()
+
+    es = fake_client(docs=args.docs, doc_size=args.doc_size,
+                     latency=args.latency)
+
+    results = {}
+    for name, func, unit in BENCHMARKS:
+        if args.only and name not in args.only:
+            continue
+        seconds, count, peak = run(func, es, args)
+        results[name] = {
+            'seconds': seconds,
+            '%s_per_sec' % unit: count / seconds,
+            'peak_bytes': peak,
+        }
+
+    report = {
+        'commit': git_commit(),
+        'python': '%s %s' % (platform.python_implementation(),
+                             platform.python_version()),
+        'memory': memory_method(),
+        'options': dict((key, value) for key, value in vars(args).items()
+                        if key not in ('output', 'compare', 'only')),
+        'results': results,
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    for name in sorted(results):
+        result = results[name]
+        rate_key = [key for key in result if key.endswith('_per_sec')][0]
+        line = '%-20s %12.0f %s' % (name, result[rate_key],
+                                    rate_key.replace('_', ' '))
+        if result['peak_bytes'] is not None:
+            line += '  peak %7.1f MB' % (result['peak_bytes'] / 1048576.0)
+        old = baseline and baseline['results'].get(name)
+        if old:
+            line += '  %5.2fx speed' % (result[rate_key] / old[rate_key])
+            if old['peak_bytes'] and result['peak_bytes']:
+                line += '  %5.2fx memory' % (float(result['peak_bytes']) /
+                                             old['peak_bytes'])
+        sys.stderr.write(line + '\n')
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
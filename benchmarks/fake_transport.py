@@ -0,0 +1,122 @@
+'''
+    In-process stand-in for an Elasticsearch node.
+
+    :class:`FakeConnection` replaces the HTTP connection of a client, so that
+    requests go through the real transport, i.e. bodies are serialized and
+    responses deserialized as usual, but are answered from memory after a
+    configurable latency. It serves scrolled searches over ``docs``
+    generated documents of about ``doc_size`` bytes each, and Bulk API
+    requests.
+
+    Usage::
+
+        from fake_transport import fake_client
+        es = fake_client(docs=100000, doc_size=500, latency=0.002)
+'''
+
+import json
+import time
+
+from elasticsearch.connection import Connection
+
+from superelasticsearch import SuperElasticsearch
+
+_HEADERS = {'content-type': 'application/json'}
+
+# serialized hits, by number of documents and document size
+_hits = {}
+
+
+def make_hits(docs, doc_size):
+    '''
+    Returns list of serialized hits of generated documents, each with a
+    ``_source`` of about ``doc_size`` bytes.
+    '''
+
+    key = (docs, doc_size)
+    if key not in _hits:
+        padding = 'x' * max(doc_size - 100, 0)
+        _hits[key] = [
+            json.dumps(dict(
+                _index='bench', _type='docs', _id=str(i), _score=None,
+                _source=dict(title='document %s' % i, count=i,
+                             flag=i % 2 == 0, tags=['a', 'b', 'c'],
+                             text=padding)))
+            for i in range(docs)]
+    return _hits[key]
+
+
+class FakeConnection(Connection):
+    '''
+    Connection that answers requests from memory.
+
+    :arg docs: Number of documents that searches match
+    :arg doc_size: Approximate size in bytes of the source of a document
+    :arg latency: Seconds to wait before answering every request
+    :arg bulk_latency: Seconds to wait before answering Bulk API requests,
+        in addition to ``latency``
+    '''
+
+    def __init__(self, host='localhost', port=9200, docs=10000,
+                 doc_size=200, latency=0, bulk_latency=0, **kwargs):
+        super(FakeConnection, self).__init__(host=host, port=port, **kwargs)
+        self.hits = make_hits(docs, doc_size)
+        self.latency = latency
+        self.bulk_latency = bulk_latency
+
+    def perform_request(self, method, url, params=None, body=None,
+                        timeout=None, ignore=()):
+        if self.latency:
+            time.sleep(self.latency)
+
+        path = url.split('?')[0].strip('/').split('/')
+        if path[-1] == '_bulk':
+            return 200, _HEADERS, self.bulk(body)
+        if path[:2] == ['_search', 'scroll']:
+            if method == 'DELETE':
+                return 200, _HEADERS, '{}'
+            scroll_id = path[2] if len(path) > 2 else body.decode('utf-8')
+            offset, size = [int(part) for part in scroll_id.split('-')]
+            return 200, _HEADERS, self.page(offset, size)
+        if path[-1] == '_search':
+            size = int((params or {}).get('size', 10))
+            if (params or {}).get('search_type') == 'scan':
+                return 200, _HEADERS, self.page(0, size, hits=False)
+            return 200, _HEADERS, self.page(0, size)
+        if path[-1] == '_search_shards':
+            return 200, _HEADERS, json.dumps(dict(shards=[[dict(
+                shard=0, index='bench', primary=True, node='fake')]]))
+        return 404, _HEADERS, '{"error": "not found"}'
+
+    def page(self, offset, size, hits=True):
+        page_hits = self.hits[offset:offset + size] if hits else []
+        next_offset = offset + size if hits else 0
+        return ('{"_scroll_id": "%s-%s", "took": 1, "timed_out": false, '
+                '"hits": {"total": %s, "max_score": null, "hits": [%s]}}' % (
+                    next_offset, size, len(self.hits),
+                    ', '.join(page_hits)))
+
+    def bulk(self, body):
+        if self.bulk_latency:
+            time.sleep(self.bulk_latency)
+
+        items = []
+        lines = iter(body.decode('utf-8').splitlines())
+        for line in lines:
+            action = json.loads(line)
+            op_type = list(action)[0]
+            if op_type != 'delete':
+                next(lines)
+            result = dict(action[op_type], status=200)
+            items.append({op_type: result})
+        return json.dumps(dict(took=1, errors=False, items=items))
+
+
+def fake_client(**kwargs):
+    '''
+    Returns :class:`SuperElasticsearch` client whose requests are answered by
+    :class:`FakeConnection`, created with the given arguments.
+    '''
+
+    return SuperElasticsearch(hosts=['fake:9200'],
+                              connection_class=FakeConnection, **kwargs)
@@ -36,6 +36,9 @@ setup(
     install_requires = [
         'elasticsearch',
     ],
+    extras_require = {
+        'numpy': ['numpy'],
+    },
     include_package_data = True,
     zip_safe = False,
     classifiers = [
@@ -18,29 +18,308 @@
     of the official client.
 '''
 
-__all__ = ['SuperElasticsearch']
+__all__ = ['SuperElasticsearch', 'FastJSONSerializer', 'SearchCache',
+           'Metrics', 'HistogramSink', 'CallbackSink', 'AdaptiveBatchSize',
+           'CompressedHttpConnection', 'RoutingTable', 'SerializerPool']
+
+import json as _json
+import os
+import random
+import threading
+import time
+import weakref
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from json import JSONEncoder
 
 from elasticsearch import Elasticsearch
 from elasticsearch import ElasticsearchException
+from elasticsearch.client.utils import _make_path
 from elasticsearch.client.utils import query_params
+from elasticsearch.compat import PY2
+from elasticsearch.compat import string_types
+from elasticsearch.exceptions import ConnectionError
+from elasticsearch.exceptions import ConnectionTimeout
+from elasticsearch.exceptions import ImproperlyConfigured
+from elasticsearch.exceptions import SerializationError
+from elasticsearch.exceptions import TransportError
 from elasticsearch.serializer import JSONSerializer
 
+from .adaptive import AdaptiveBatchSize
+from .batching import SearchBatcher
+from .cache import MISSING
+from .cache import SearchCache
+from .columnar import Columns
+from .columnar import META_FIELDS
+from .compression import CompressedHttpConnection
+from .loader import DocumentLoader
+from .metrics import CallbackSink
+from .metrics import HistogramSink
+from .metrics import Metrics
+from .pool import SerializerPool
+from .routing import RoutingTable
+from .serializer import FastJSONSerializer
+from .spill import SpillFile
+
 # Use elasticsearch library's implementation of JSON serializer
 json = JSONSerializer()
 
+# json.dumps creates a new encoder on every call when it is given a default,
+# so bulk lines are serialized with a single encoder instead
+_encoder = JSONEncoder(default=json.default)
+
+
+def _dumps(data):
+    '''
+    Serializes data exactly like :meth:`JSONSerializer.dumps` does, reusing
+    one encoder.
+    '''
+
+    # don't serialize strings
+    if isinstance(data, string_types):
+        return data
+
+    try:
+        return _encoder.encode(data)
+    except (ValueError, TypeError) as e:
+        raise SerializationError(data, e)
+
+
+def _byte_size(op):
+    '''
+    Returns the size in bytes of serialized lines in the body of a request,
+    i.e. encoded in UTF-8.
+    '''
+
+    if isinstance(op, bytes):
+        # already encoded, e.g. pre-serialized bodies on Python 2
+        return len(op)
+    return len(op.encode('utf-8'))
+
+
+def _decoded(params):
+    '''
+    Returns the parameters with the values that :func:`query_params` encoded
+    to bytes, as elasticsearch-py does on Python 3, decoded back to strings,
+    so that they can be serialized in bulk actions and escaped again.
+    '''
+
+    if PY2 or not any(isinstance(value, bytes) for value in params.values()):
+        return params
+    return dict((name, value.decode('utf-8') if isinstance(value, bytes)
+                 else value) for name, value in params.items())
+
+
+def _check_scroll_count(total, counter, scroll_id=None, last_scroll_id=None):
+    '''
+    Raises :class:`elasticsearch.ElasticsearchException` when the number of
+    documents retrieved while scrolling does not match the total number of
+    documents that matched the query.
+    '''
+
+    if counter == total:
+        return
+
+    message = ('Failed to get all the documents while scrolling. Total '
+               'documents that matched the query: %s\n'
+               'Total documents that were retrieved while scrolling: %s' % (
+                   total, counter))
+    if scroll_id is not None or last_scroll_id is not None:
+        message += ('\nLast scroll_id with documents: %s.\n'
+                    'Last scroll_id: %s ' % (scroll_id, last_scroll_id))
+    raise ElasticsearchException(message)
+
+
+def _read_checkpoint(path):
+    '''
+    Returns the checkpoint saved in the file, or None if it does not exist.
+    '''
+
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return _json.load(f)
+
+
+def _write_checkpoint(path, state):
+    '''
+    Saves the checkpoint to the file, replacing it atomically so that a crash
+    never leaves a partially written checkpoint behind.
+    '''
+
+    tmp_path = '%s.tmp' % path
+    with open(tmp_path, 'w') as f:
+        _json.dump(state, f)
+    if os.name == 'nt' and os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp_path, path)
+
+
+def _page_results(resp, chunked, with_meta):
+    '''
+    Returns the results that iterated search returns for a page of scroll
+    results: the page of documents if chunked else every document, each with
+    meta data of the Scroll API request if requested.
+    '''
+
+    docs = resp['hits']['hits']
+    if not with_meta:
+        return [docs] if chunked else docs
+
+    # prepare meta
+    meta = resp.copy()
+    meta['hits'] = resp['hits'].copy()
+    meta['hits'].pop('hits')
+
+    if chunked:
+        return [(docs, meta)]
+    return [(doc, meta) for doc in docs]
+
+
+def _offer(results, item, stop):
+    '''
+    Puts item in the bounded results queue, waiting for a free slot until the
+    stop event is set. Returns False if the item could not be put.
+    '''
+
+    while not stop.is_set():
+        try:
+            results.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _take(items, stop):
+    '''
+    Gets an item from the queue, waiting for one until the stop event is set.
+    Returns None if no item could be got.
+    '''
+
+    while not stop.is_set():
+        try:
+            return items.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return None
+
+
+def _prefetched(pages, depth):
+    '''
+    Iterates over the pages generator in a background thread, reading ahead
+    at most ``depth`` pages while the caller works on the current one.
+    Exceptions raised by the generator are raised to the caller.
+    '''
+
+    results = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def producer():
+        try:
+            for page in pages:
+                if not _offer(results, ('page', page), stop):
+                    pages.close()
+                    return
+            _offer(results, ('done', None), stop)
+        except Exception as err:
+            _offer(results, ('error', err), stop)
+
+    thread = threading.Thread(target=producer)
+    thread.daemon = True
+    thread.start()
+
+    try:
+        while True:
+            kind, payload = results.get()
+            if kind == 'page':
+                yield payload
+            elif kind == 'done':
+                break
+            else:
+                raise payload
+    finally:
+        stop.set()
+
 
 class SuperElasticsearch(Elasticsearch):
     '''
     Subclass of :class:`elasticsearch.Elasticsearch` to provide some useful
     utilities.
+
+    Pass ``serializer=FastJSONSerializer()`` to encode requests, including
+    bulk operations, and decode responses, including scroll pages, with the
+    fastest JSON library that is installed.
+
+    Pass ``search_cache=SearchCache()`` to cache responses of searches, see
+    :meth:`search`.
+
+    Pass ``metrics=Metrics(HistogramSink())`` to record latencies, sizes
+    and counts of scroll and bulk requests, see
+    :mod:`superelasticsearch.metrics`.
+
+    Pass ``compression='gzip'`` or ``compression='deflate'``, and optionally
+    ``compression_level``, to compress bodies of Bulk API requests, and
+    ``compress_responses=True`` to get compressed responses of scroll
+    requests, see :class:`CompressedHttpConnection`.
     '''
 
     def __init__(self, *args, **kwargs):
+        self.search_cache = kwargs.pop('search_cache', None)
+        self.metrics = kwargs.pop('metrics', None)
+        compressed = (kwargs.get('compression') or
+                      kwargs.get('compress_responses'))
+        if compressed and 'connection_class' not in kwargs:
+            kwargs['connection_class'] = CompressedHttpConnection
         super(SuperElasticsearch, self).__init__(*args, **kwargs)
+        if self.metrics is not None:
+            self.transport.deserializer = self.metrics.deserializer(
+                self.transport.deserializer)
 
         # presevery arguments and keyword arguments for bulk clients
         self._args = args
         self._kwargs = kwargs
+        self._bulk_client_pool = []
+        self._bulk_client_lock = threading.Lock()
+        self._routing_table = None
+        # caches to invalidate when bulk operations of this client write
+        self._caches = weakref.WeakSet()
+
+        if self.search_cache is not None:
+            if self.search_cache.serializer is None:
+                self.search_cache.serializer = self.transport.serializer
+            self._caches.add(self.search_cache)
+
+    def search(self, index=None, doc_type=None, body=None, **kwargs):
+        '''
+        Executes a search query like :meth:`Elasticsearch.search`, and
+        returns the cached response of the same search when this client was
+        created with a :class:`SearchCache`.
+
+        Searches are the same when they are on the same indices and document
+        types and have the same body and arguments. Scrolled searches are
+        never cached. Cached responses of searches on an index are forgotten
+        when a bulk operation of this client writes to the index.
+        '''
+
+        cache = self.search_cache
+        if (cache is None or 'scroll' in kwargs or
+                kwargs.get('search_type') == 'scan'):
+            return super(SuperElasticsearch, self).search(
+                index=index, doc_type=doc_type, body=body, **kwargs)
+
+        key = cache.key(index, doc_type, body, kwargs)
+        resp = cache.get(key)
+        if resp is MISSING:
+            generation = cache.generation
+            resp = super(SuperElasticsearch, self).search(
+                index=index, doc_type=doc_type, body=body, **kwargs)
+            cache.set(key, resp, generation)
+        return resp
 
     def itersearch(self, scroll, **kwargs):
         '''
@@ -60,6 +339,18 @@ class SuperElasticsearch(Elasticsearch):
             Defaults to False.
         :arg with_meta: True to return meta data of Scroll API requests with
                         every iteration. Defaults to False.
+        :arg parallel: Number of worker threads to scroll with. When given,
+            one scroll is opened for every shard and the shards are scrolled
+            concurrently. Documents are then returned in no particular order
+            and ``preference`` can not be used. Defaults to None i.e. a single
+            scroll.
+        :arg scan: True to use ``search_type=scan``, which skips scoring and
+            sorting and is the fastest way to export all the matching
+            documents. ``size`` is divided among the shards, as it applies to
+            every shard in a scan. Defaults to False.
+        :arg prefetch: Number of scroll pages to fetch ahead in a background
+            thread while the current page is being consumed. Defaults to None
+            i.e. the next page is fetched only when it is needed.
         :arg _source: True or false to return the _source field or not, or a
             list of fields to return
         :arg _source_exclude: A list of fields to exclude from the returned
@@ -127,54 +418,620 @@ class SuperElasticsearch(Elasticsearch):
         else:
             with_meta = False
 
-        resp = self.search(**kwargs)
+        parallel = kwargs.pop('parallel', None)
+        prefetch = kwargs.pop('prefetch', None)
+
+        if kwargs.pop('scan', False):
+            kwargs['search_type'] = 'scan'
+            # every scroll of a parallel scan is pinned to one shard
+            if kwargs.get('size') is not None and not parallel:
+                shards = self._shard_count(index=kwargs.get('index'),
+                                           doc_type=kwargs.get('doc_type'))
+                kwargs['size'] = max(1, -(-int(kwargs['size']) // shards))
+
+        if parallel:
+            pages = self._parallel_scroll_pages(kwargs, parallel)
+        else:
+            pages = self._scroll_pages(kwargs)
+
+        if prefetch:
+            pages = _prefetched(pages, prefetch)
+
+        for resp in pages:
+            for result in _page_results(resp, chunked, with_meta):
+                yield result
+
+    def itersort(self, sort_field, order='asc', **kwargs):
+        '''
+        Iterated search that pages through the results ordered by a field,
+        without the Scroll API.
+
+        Every page is fetched with a new search that filters out the
+        documents before the value of the field in the last document of the
+        previous page. Unlike :meth:`itersearch`, no search context is kept
+        open on the cluster between pages, so many iterations can run at once
+        without holding heap and segment files on every shard.
+
+        Documents which share the last value of the field are excluded by
+        their ids, so ties are handled correctly, but a field with few
+        distinct values makes the pages expensive. The field must be present
+        in all the documents, or they will not be returned; the number of
+        documents returned is validated against the total number of matches
+        of the first page like :meth:`itersearch` does.
+
+        :arg sort_field: Field to order the documents by, e.g. a timestamp or
+            a ``not_analyzed`` id field
+        :arg order: ``asc`` or ``desc``. Defaults to ``asc``.
+        :arg index: A comma-separated list of index names to search
+        :arg doc_type: A comma-separated list of document types to search
+        :arg body: The search definition using the Query DSL; only its query
+            is used for filtering
+        :arg chunked: Same as for :meth:`itersearch`. Defaults to True.
+        :arg with_meta: Same as for :meth:`itersearch`. Defaults to False.
+        :arg size: Number of hits to return per page (default: 10)
+        :arg checkpoint: Path of a file to write checkpoints of the iteration
+            to, or a function that is called with every checkpoint. A
+            checkpoint is a dict of the last value of the field, the
+            documents with that value and the number of documents returned,
+            and it is taken once all the documents of a page have been
+            consumed. The file is removed once all the documents have been
+            returned, so that resuming from it starts a new iteration.
+        :arg checkpoint_every: Number of pages after which to take a
+            checkpoint. Defaults to 1.
+        :arg resume: Checkpoint, or path of a checkpoint file, to continue an
+            earlier iteration from. The iteration starts from the beginning if
+            the file does not exist. Documents returned before the checkpoint
+            are not returned again and are included in the document count
+            check.
+
+        Any other argument of :meth:`search` is passed on to every search.
+
+        .. Usage::
+        for doc in es.itersort('created_at', index='tweets', chunked=False,
+                               size=1000):
+            print doc['_id']
+
+        # continues where the previous run stopped, if it did not finish
+        for docs in es.itersort('created_at', index='tweets', size=1000,
+                                checkpoint='tweets.checkpoint',
+                                resume='tweets.checkpoint'):
+            export(docs)
+        '''
+
+        chunked = kwargs.pop('chunked', True)
+        with_meta = kwargs.pop('with_meta', False)
+        checkpoint = kwargs.pop('checkpoint', None)
+        checkpoint_every = kwargs.pop('checkpoint_every', 1)
+        resume = kwargs.pop('resume', None)
+        body = kwargs.pop('body', None) or {}
+        query = body.get('query', {'match_all': {}})
+        bound = 'gte' if order == 'asc' else 'lte'
+
+        last = None
+        # (type, id) of the documents with the last value of the field
+        tied = []
+        total = None
+        counter = 0
+        pages = 0
+
+        if isinstance(resume, string_types):
+            resume = _read_checkpoint(resume)
+        if resume:
+            last = resume['last']
+            tied = [tuple(doc) for doc in resume['tied']]
+            total = resume['total']
+            counter = resume['counter']
+
+        while True:
+            filters = {}
+            if last is not None:
+                filters['must'] = [{'range': {sort_field: {bound: last}}}]
+                tied_ids = {}
+                for doc_type, doc_id in tied:
+                    tied_ids.setdefault(doc_type, []).append(doc_id)
+                filters['must_not'] = [
+                    {'ids': {'type': doc_type, 'values': doc_ids}}
+                    for doc_type, doc_ids in tied_ids.items()]
+
+            page_body = dict(body, sort=[{sort_field: order}])
+            page_body['query'] = query
+            if filters:
+                page_body['query'] = {'filtered': {
+                    'query': query,
+                    'filter': {'bool': filters},
+                }}
+
+            # pages are not cached, like the pages of scrolled searches
+            resp = super(SuperElasticsearch, self).search(body=page_body,
+                                                          **kwargs)
+            if total is None:
+                total = resp['hits']['total']
+
+            docs = resp['hits']['hits']
+            if not docs:
+                break
+
+            for result in _page_results(resp, chunked, with_meta):
+                yield result
+            counter += len(docs)
+
+            value = docs[-1]['sort'][0]
+            if value != last:
+                tied = []
+                last = value
+            tied.extend((doc['_type'], doc['_id']) for doc in docs
+                        if doc['sort'][0] == value)
+
+            pages += 1
+            if checkpoint is not None and pages % checkpoint_every == 0:
+                state = dict(last=last, tied=list(tied), total=total,
+                             counter=counter)
+                if callable(checkpoint):
+                    checkpoint(state)
+                else:
+                    _write_checkpoint(checkpoint, state)
+
+        # check if all the documents were returned or not
+        _check_scroll_count(total, counter)
+
+        if (checkpoint is not None and not callable(checkpoint) and
+                os.path.exists(checkpoint)):
+            os.remove(checkpoint)
+
+    def itercolumns(self, scroll, fields, **kwargs):
+        '''
+        Iterated search like :meth:`itersearch` that returns the values of
+        the given fields of the documents of every scroll page as columns,
+        instead of the documents.
+
+        Every iteration returns a dict of field path and its column, which is
+        a :class:`numpy.ma.MaskedArray` whose mask is set for documents that
+        don't have the field or have it as null. Unless ``_source`` or
+        ``_source_include`` is given, only the fields are fetched from
+        ``_source``.
+
+        :arg scroll: Specify how long a consistent view of the index should
+            be maintained for scrolled search
+        :arg fields: List of field paths. Dots separate keys of objects, and
+            meta fields like ``_id`` are read from the hits.
+        :arg concatenate: True to return a single dict of columns of all the
+            documents after scrolling through all of them. Defaults to False.
+        :arg arrays: False to get lists, with None for missing values,
+            instead of NumPy arrays, which require NumPy. Defaults to True.
+        :arg dtypes: Dict of field path and NumPy dtype of its column. The
+            dtype of other columns is inferred from their values.
+
+        Any other argument of :meth:`itersearch` is passed on to it.
+
+        .. Usage::
+        for columns in es.itercolumns('1m', ['price', 'user.age'],
+                                      index='orders', size=5000):
+            print columns['price'].mean()
+        '''
+
+        concatenate = kwargs.pop('concatenate', False)
+        columns = Columns(fields, arrays=kwargs.pop('arrays', True),
+                          dtypes=kwargs.pop('dtypes', None))
+        if '_source' not in kwargs and '_source_include' not in kwargs:
+            kwargs['_source_include'] = [field for field in fields
+                                         if field not in META_FIELDS]
+        kwargs.update(chunked=True, with_meta=False)
+
+        for docs in self.itersearch(scroll, **kwargs):
+            columns.add(docs)
+            if not concatenate:
+                yield columns.pop()
+
+        if concatenate:
+            yield columns.pop()
+
+    def reindex(self, source, target, transform=None, **kwargs):
+        '''
+        Copies the documents of the source index to the target index,
+        optionally transforming them on the way.
+
+        Runs as a pipeline of three stages connected by bounded queues, so
+        that reading, transforming and writing overlap while a slow stage
+        holds back the stages before it: a scroll over the source, a
+        transform stage that batches documents in chunks, and concurrent
+        writers that index the chunks with Bulk API requests, retrying
+        rejected actions like :meth:`BulkOperation.execute_with_retry`. Every
+        writer uses its own client built from the arguments the target client
+        was created with.
+
+        :arg source: A comma-separated list of index names to copy
+        :arg target: The name of the index to write to
+        :arg transform: Function that is called with every hit, i.e. a dict
+            with ``_type``, ``_id`` and ``_source``, and returns the hit to
+            write, or None to skip it. Defaults to copying hits as they are.
+        :arg doc_type: A comma-separated list of document types to copy
+        :arg body: The search definition selecting the documents to copy
+        :arg scroll: Specify how long a consistent view of the index should
+            be maintained for scrolled search. Defaults to 5m.
+        :arg size: Number of hits to read per scroll request. Defaults to
+            500.
+        :arg parallel: Number of threads to scroll the shards of the source
+            with, see :meth:`itersearch`. Defaults to None.
+        :arg scan: False to scroll without ``search_type=scan``. Defaults to
+            True.
+        :arg writers: Number of concurrent Bulk API requests. Defaults to 2.
+        :arg chunk_size: Number of documents per Bulk API request. Defaults
+            to 500.
+        :arg queue_size: Number of scroll pages and of chunks that can wait
+            for the next stage. Defaults to 4.
+        :arg max_retries: Maximum number of times a rejected action is
+            retried. Defaults to 3.
+        :arg target_client: Client to write with, e.g. of another cluster.
+            Defaults to this client.
+        :arg target_hosts: Hosts of another cluster to write to, with a
+            client built from the other arguments this client was created
+            with.
+        :returns: dict of stats: number of documents ``read``, ``skipped`` by
+            the transform, ``written``, ``failed`` and ``retried``, the number
+            of Bulk API ``requests``, ``elapsed`` seconds and documents
+            written per second as ``rate``
+
+        .. Usage::
+        def transform(hit):
+            hit['_source']['name'] = hit['_source']['name'].lower()
+            return hit
+
+        stats = es.reindex('tweets_v1', 'tweets_v2', transform, writers=4)
+        print '%(written)s docs at %(rate).0f docs/s' % stats
+        '''
+
+        writers = kwargs.pop('writers', 2)
+        chunk_size = kwargs.pop('chunk_size', 500)
+        queue_size = kwargs.pop('queue_size', 4)
+        max_retries = kwargs.pop('max_retries', 3)
+        target_client = kwargs.pop('target_client', None)
+        target_hosts = kwargs.pop('target_hosts', None)
+        if target_client is not None and target_hosts is not None:
+            raise ValueError('Only one of target_client and target_hosts can '
+                             'be given.')
+        if target_hosts is not None:
+            target_kwargs = dict(self._kwargs, hosts=target_hosts)
+            target_client = SuperElasticsearch(*self._args[1:],
+                                               **target_kwargs)
+        elif target_client is None:
+            target_client = self
+        if hasattr(target_client, '_bulk_clients'):
+            clients = target_client._bulk_clients(writers)
+        else:
+            clients = [target_client] * writers
+
+        search_kwargs = dict(index=source, chunked=True, with_meta=False,
+                             scan=kwargs.pop('scan', True),
+                             size=kwargs.pop('size', 500))
+        search_kwargs.update(kwargs)
+        scroll = search_kwargs.pop('scroll', '5m')
+
+        pages = queue.Queue(maxsize=queue_size)
+        chunks = queue.Queue(maxsize=queue_size)
+        stop = threading.Event()
+        errors = []
+        stats = dict(read=0, skipped=0, written=0, failed=0, retried=0,
+                     requests=0)
+        stats_lock = threading.Lock()
+
+        def stage(func):
+            def run(*args):
+                try:
+                    func(*args)
+                except Exception as err:
+                    errors.append(err)
+                    stop.set()
+            return run
+
+        @stage
+        def read():
+            docs = self.itersearch(scroll, **search_kwargs)
+            for page in docs:
+                if not _offer(pages, page, stop):
+                    docs.close()
+                    return
+            _offer(pages, None, stop)
+
+        @stage
+        def batch():
+            chunk = []
+            while True:
+                page = _take(pages, stop)
+                if page is None:
+                    break
+                stats['read'] += len(page)
+                for hit in page:
+                    if transform is not None:
+                        hit = transform(hit)
+                        if hit is None:
+                            stats['skipped'] += 1
+                            continue
+                    chunk.append(hit)
+                    if len(chunk) == chunk_size:
+                        if not _offer(chunks, chunk, stop):
+                            return
+                        chunk = []
+            if chunk:
+                _offer(chunks, chunk, stop)
+            for _ in range(writers):
+                _offer(chunks, None, stop)
+
+        @stage
+        def write(client):
+            while True:
+                chunk = _take(chunks, stop)
+                if chunk is None:
+                    return
+                bulk = BulkOperation(client, index=target)
+                for hit in chunk:
+                    params = {}
+                    if '_routing' in hit:
+                        params['routing'] = hit['_routing']
+                    if '_parent' in hit:
+                        params['parent'] = hit['_parent']
+                    bulk.index(body=hit['_source'], id=hit.get('_id'),
+                               doc_type=hit['_type'], **params)
+                actions = bulk._actions
+                try:
+                    resp = bulk.execute_with_retry(max_retries=max_retries)
+                finally:
+                    if target_client is self:
+                        # the clients of the writers don't know the caches
+                        # of this client
+                        self._bulk_written(actions, target)
+                with stats_lock:
+                    stats['written'] += resp['succeeded']
+                    stats['failed'] += resp['failed']
+                    stats['retried'] += resp['retried']
+                    stats['requests'] += 1
+
+        start = time.time()
+        threads = [threading.Thread(target=read),
+                   threading.Thread(target=batch)]
+        threads.extend(threading.Thread(target=write, args=(client,))
+                       for client in clients)
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if errors:
+            raise errors[0]
+
+        stats['elapsed'] = time.time() - start
+        stats['rate'] = stats['written'] / max(stats['elapsed'], 1e-9)
+        return stats
+
+    def _scroll_pages(self, search_kwargs, progress=None):
+        '''
+        Generator over the raw responses of a scrolled search. Every response
+        that has hits is yielded, the number of retrieved documents is
+        validated against the total number of matches and the scroll is
+        cleared once it is exhausted.
+
+        :arg search_kwargs: keyword arguments for :meth:`search`; must contain
+            ``scroll``
+        :arg progress: optional dict which is kept updated with ``total``,
+            ``counter`` and ``scroll_id`` of the scroll while it is iterated
+        '''
+
+        if progress is None:
+            progress = {}
+
+        resp = self._scroll_request(self.search, search_kwargs)
         total = resp['hits']['total']
         scroll_id = resp['_scroll_id']
         counter = 0
 
+        if search_kwargs.get('search_type') == 'scan':
+            # the first response of a scan has no hits, just the scroll id
+            resp = self._scroll_request(self.scroll, dict(
+                scroll_id=scroll_id, scroll=search_kwargs['scroll']))
+        progress.update(total=total, counter=counter,
+                        scroll_id=resp['_scroll_id'])
+
         while len(resp['hits']['hits']) > 0:
-            # prepare meta
-            meta = resp.copy()
-            meta['hits'] = resp['hits'].copy()
-            meta['hits'].pop('hits')
-
-            # if expected chunked, then return chunks else return
-            # every doc per iteration
-            if chunked:
-                if with_meta:
-                    yield resp['hits']['hits'], meta
-                else:
-                    yield resp['hits']['hits']
-            else:
-                for doc in resp['hits']['hits']:
-                    if with_meta:
-                        yield doc, meta
-                    else:
-                        yield doc
+            if self.metrics is not None:
+                self.metrics.record('scroll.hits', len(resp['hits']['hits']))
+            yield resp
 
             # increment the counter
             counter += len(resp['hits']['hits'])
+            progress['counter'] = counter
 
             # get the next set of results
             scroll_id = resp['_scroll_id']
-            resp = self.scroll(scroll_id=scroll_id, scroll=kwargs['scroll'])
-
-        # check if all the documents were scrolled or not
-        if counter != total:
-            raise ElasticsearchException(
-                'Failed to get all the documents while scrolling. Total '
-                'documents that matched the query: %s\n'
-                'Total documents that were retrieved while scrolling: %s\n'
-                'Last scroll_id with documents: %s.\n'
-                'Last scroll_id: %s ' % (
-                    total,
-                    counter,
-                    scroll_id,
-                    resp['_scroll_id']))
+            resp = self._scroll_request(self.scroll, dict(
+                scroll_id=scroll_id, scroll=search_kwargs['scroll']))
+            progress['scroll_id'] = resp['_scroll_id']
 
         # clear scroll
         self.clear_scroll(scroll_id=scroll_id)
 
+        # check if all the documents were scrolled or not
+        _check_scroll_count(total, counter, scroll_id, resp['_scroll_id'])
+
+    def _scroll_request(self, request, kwargs):
+        '''
+        Sends a search or scroll request of a scroll, and records its latency
+        and response size if metrics are enabled.
+        '''
+
+        metrics = self.metrics
+        if metrics is None:
+            return request(**kwargs)
+
+        start = time.time()
+        resp = request(**kwargs)
+        metrics.record('scroll.latency', time.time() - start)
+        metrics.record('scroll.response_bytes', metrics.response_bytes())
+        return resp
+
+    def _parallel_scroll_pages(self, search_kwargs, parallel):
+        '''
+        Generator over the raw responses of one scroll per shard. Scrolls are
+        pinned to a shard with ``preference=_shards:K`` and are driven by a
+        pool of ``parallel`` worker threads. Pages are yielded in the order in
+        which they arrive.
+
+        Document counts are validated for every shard by
+        :meth:`_scroll_pages` and once more for all the shards together.
+        '''
+
+        if 'preference' in search_kwargs:
+            raise ValueError('preference can not be used with a parallel '
+                             'itersearch as it is used to pin every scroll '
+                             'to a shard.')
+
+        shards = self._shard_numbers(index=search_kwargs.get('index'),
+                                     doc_type=search_kwargs.get('doc_type'))
+        tasks = queue.Queue()
+        for shard in shards:
+            tasks.put(shard)
+
+        # bounded, so that workers can't run far ahead of the consumer
+        results = queue.Queue(maxsize=parallel * 2)
+        stop = threading.Event()
+
+        def worker():
+            while not stop.is_set():
+                try:
+                    shard = tasks.get_nowait()
+                except queue.Empty:
+                    return
+
+                shard_kwargs = dict(search_kwargs,
+                                    preference='_shards:%s' % shard)
+                progress = {}
+                pages = self._scroll_pages(shard_kwargs, progress)
+                try:
+                    for resp in pages:
+                        if not _offer(results, ('page', resp), stop):
+                            pages.close()
+                            # consumer went away, free the search context
+                            if progress.get('scroll_id') is not None:
+                                self.clear_scroll(
+                                    scroll_id=progress['scroll_id'],
+                                    ignore=404)
+                            return
+                    _offer(results, ('done', progress), stop)
+                except Exception as err:
+                    _offer(results, ('error', err), stop)
+                    return
+
+        workers = []
+        for _ in range(min(parallel, len(shards))):
+            thread = threading.Thread(target=worker)
+            thread.daemon = True
+            thread.start()
+            workers.append(thread)
+
+        total = 0
+        counter = 0
+        remaining = len(shards)
+        try:
+            while remaining:
+                kind, payload = results.get()
+                if kind == 'page':
+                    yield payload
+                elif kind == 'done':
+                    total += payload['total']
+                    counter += payload['counter']
+                    remaining -= 1
+                else:
+                    raise payload
+        finally:
+            stop.set()
+
+        # check if all the documents of all the shards were scrolled or not
+        _check_scroll_count(total, counter)
+
+    def _shard_numbers(self, index=None, doc_type=None):
+        '''
+        Returns sorted list of shard numbers that a search on the given
+        indices would be executed against.
+        '''
+
+        resp = self.search_shards(index=index, doc_type=doc_type)
+        return sorted(set(copy['shard'] for group in resp['shards']
+                          for copy in group))
+
+    def _shard_count(self, index=None, doc_type=None):
+        '''
+        Returns number of shards that a search on the given indices would be
+        executed against.
+        '''
+
+        resp = self.search_shards(index=index, doc_type=doc_type)
+        return len(resp['shards'])
+
+    def batched_search(self, **kwargs):
+        '''
+        Creates a front end for searches that coalesces the searches of
+        concurrent callers into Multi Search API requests. Every caller gets
+        its own response or error back.
+
+        .. Usage::
+        batcher = es.batched_search(window=0.002, max_batch_size=50)
+
+        # in every request handler
+        resp = batcher.search(index='tweets', body={'query': query})
+
+        :arg window: Maximum number of seconds a search waits for others to
+            be sent with. Defaults to 0.005.
+        :arg max_batch_size: Maximum number of searches per Multi Search API
+            request. Defaults to 100.
+        :arg concurrency: Number of Multi Search API requests that can be
+            sent at the same time. Defaults to 1.
+        :returns: an instance of :class:`SearchBatcher`
+        '''
+
+        return SearchBatcher(self, **kwargs)
+
+    def loader(self, **kwargs):
+        '''
+        Creates a loader that looks documents up by id with batched Multi Get
+        API requests, and optionally caches them. Cached documents are
+        forgotten when bulk operations of this client write to them.
+
+        .. Usage::
+        loader = es.loader(index='users', doc_type='user', cache_size=10000)
+        users = loader.get_many(user_ids)
+
+        :arg index: Default index of the documents
+        :arg doc_type: Default type of the documents
+        :arg chunk_size: Maximum number of ids per Multi Get API request.
+            Defaults to 1000.
+        :arg cache_size: Maximum number of documents to cache. Defaults to
+            None i.e. documents are not cached.
+        :arg ttl: Number of seconds after which cached documents expire.
+            Defaults to None i.e. they don't expire.
+        :returns: an instance of :class:`DocumentLoader`
+        '''
+
+        loader = DocumentLoader(self, **kwargs)
+        self._caches.add(loader)
+        return loader
+
+    def get_many(self, ids, index=None, doc_type=None, **kwargs):
+        '''
+        Looks up documents by id with as few Multi Get API requests as
+        possible, and returns them in the order of the ids, with None for
+        every document that does not exist.
+
+        :arg ids: List of document ids, or of ``(index, doc_type, id)``
+            tuples
+        :arg index: Index of the documents
+        :arg doc_type: Type of the documents
+        :arg chunk_size: Maximum number of ids per Multi Get API request.
+            Defaults to 1000.
+
+        Any other argument is passed on to every Multi Get API request.
+        '''
+
+        return DocumentLoader(self, index, doc_type, **kwargs).get_many(ids)
+
     def bulk_operation(self, **kwargs):
         '''
         Creates a new native client like instance for performing bulk
@@ -192,6 +1049,10 @@ class SuperElasticsearch(Elasticsearch):
 
         bulk.execute()
 
+        with es.bulk_operation(index='bulk_index', max_actions=1000) as bulk:
+            for doc in docs:
+                bulk.index(doc_type='docs', body=doc)
+
         :arg index: Default index for items which don't provide one
         :arg doc_type: Default document type for items which don't provide one
         :arg consistency: Explicit write consistency setting for the operation
@@ -199,6 +1060,26 @@ class SuperElasticsearch(Elasticsearch):
         :arg routing: Specific routing value
         :arg replication: Explicitly set the replication type (default: sync)
         :arg timeout: Explicit operation timeout
+        :arg max_actions: Flush automatically once these many actions have
+            been recorded
+        :arg max_bytes: Flush automatically before the serialized size of the
+            recorded actions would exceed these many bytes
+        :arg flush_interval: Flush automatically when an action is recorded
+            these many seconds after the last flush
+        :arg compact: Serialize every action as soon as it is recorded and
+            free its params and body
+        :arg serializer: Serializer to encode actions with. Defaults to the
+            serializer this client was created with.
+        :arg adaptive: True, or an :class:`AdaptiveBatchSize`, to flush
+            automatically in batches whose size adapts to the latency of the
+            requests and the rate of rejected actions
+        :arg coalesce: Coalesce the recorded actions on the same document,
+            e.g. an ``index`` replaces the actions recorded before it
+        :arg merge_updates: Function to coalesce scripted updates with
+        :arg shard_aware: Send the actions on every document straight to the
+            node that holds the primary of its shard
+        :arg serializer_pool: :class:`SerializerPool` to serialize large
+            numbers of actions with in worker processes
         :returns: an instance of :class:`BulkOperation`
 
         .. Note:: all the arguments passed at the time create a new bulk
@@ -208,9 +1089,121 @@ class SuperElasticsearch(Elasticsearch):
 
         return BulkOperation(self, **kwargs)
 
+    def routing_table(self, **kwargs):
+        '''
+        Returns the cached routing table of the cluster, which shard aware
+        bulk operations find the nodes that hold the primaries of documents
+        with. It is created by the first call, with the given arguments;
+        later calls raise :class:`ImproperlyConfigured` if they give other
+        arguments.
+
+        :arg hash_function: Hash function the cluster routes documents with,
+            **djb** or **murmur3**. Defaults to **djb**, the default of
+            Elasticsearch 1.x.
+        :arg refresh_interval: Number of seconds after which the version of
+            the cluster state is checked before the table is used. Defaults
+            to 30.
+        :arg es_version: Major version of Elasticsearch the cluster runs,
+            which changed how documents are routed to shards in 2.0.
+            Defaults to 1.
+        :returns: an instance of :class:`RoutingTable`
+        '''
+
+        with self._bulk_client_lock:
+            if self._routing_table is None:
+                self._routing_table = RoutingTable(self, **kwargs)
+            for name, value in sorted(kwargs.items()):
+                current = getattr(self._routing_table, name)
+                if current != value:
+                    raise ImproperlyConfigured(
+                        'The routing table was created with %s=%r, not %r.' %
+                        (name, current, value))
+            return self._routing_table
+
+    def _bulk_written(self, actions, index=None, doc_type=None):
+        '''
+        Invalidates cached documents that bulk actions of this client were
+        sent to write to.
+        '''
+
+        for cache in list(self._caches):
+            cache._bulk_written(actions, index, doc_type)
+
+    def _bulk_clients(self, count):
+        '''
+        Returns ``count`` clients, each with its own connection pool, built
+        from the arguments this client was created with. Clients are created
+        when first needed and are reused by later calls.
+        '''
+
+        with self._bulk_client_lock:
+            while len(self._bulk_client_pool) < count:
+                self._bulk_client_pool.append(self._client_like())
+            return self._bulk_client_pool[:count]
+
+    def _client_like(self, **kwargs):
+        '''
+        Returns new client built from the arguments this client was created
+        with, overridden by the given keyword arguments.
+        '''
+
+        args = self._args
+        if 'hosts' in kwargs:
+            args = args[1:]
+        client = Elasticsearch(*args, **dict(self._kwargs, **kwargs))
+        if self.metrics is not None:
+            client.transport.deserializer = self.metrics.deserializer(
+                client.transport.deserializer)
+        return client
+
+
+def _item_result(item):
+    '''
+    Returns the result of an action from an item of a Bulk API response,
+    which is keyed by the type of the action.
+    '''
+
+    return next(iter(item.values()))
+
+
+def _item_failed(item):
+    return 'error' in _item_result(item)
+
+
+# keys of the body of an update that only merges a partial document
+_PARTIAL_UPDATE_KEYS = frozenset(['doc', 'doc_as_upsert', 'detect_noop'])
+
+
+def _partial_update(action):
+    '''
+    Returns True if the action is an update with a partial document, which
+    is merged into the document the way Elasticsearch merges it.
+    '''
+
+    body = action.body
+    return (action.type == 'update' and isinstance(body, dict) and
+            'doc' in body and _PARTIAL_UPDATE_KEYS.issuperset(body))
+
+
+def _merge_doc(doc, partial):
+    '''
+    Returns a copy of the document with the partial document merged into it,
+    objects being merged recursively like Elasticsearch does.
+    '''
+
+    merged = dict(doc)
+    for key, value in partial.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge_doc(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
 
 class _BulkAction(object):
 
+    __slots__ = ('type', '_params', '_body', '_op')
+
     def __init__(self, type, params, body=None):
         if type not in BulkOperation.BULK_ACTIONS:
             raise Exception('%s action type is not a valid Elasticsearch bulk '
@@ -221,18 +1214,99 @@ class _BulkAction(object):
                             'valid bulk operation.' % type)
 
         self.type = type
-        self.params = params
-        self.body = body
+        self._params = params
+        self._body = body
+        self._op = None
+
+    @classmethod
+    def from_op(cls, type, op):
+        '''
+        Returns the compacted action of the given type serialized as ``op``.
+        '''
+
+        action = cls.__new__(cls)
+        action.type = type
+        action._params = None
+        action._body = None
+        action._op = op
+        return action
+
+    @property
+    def params(self):
+        if self._params is None:
+            # compacted, decode from the serialized action
+            header = self._op[:self._op.index('\n')]
+            return json.loads(header)[self.type]
+        return self._params
+
+    @property
+    def body(self):
+        if self._body is None and self._params is None:
+            # compacted, decode from the serialized action
+            body = self._op[self._op.index('\n') + 1:-1]
+            if body:
+                return json.loads(body)
+        return self._body
+
+    def doc_key(self, index=None, doc_type=None):
+        '''
+        Returns the ``(_index, _type, _id)`` of the document that the action
+        applies to, using the given defaults for missing index and type, or
+        None if the document id is generated by Elasticsearch.
+        '''
+
+        if self.params.get('_id') is None:
+            return None
+        return (self.params.get('_index', index),
+                self.params.get('_type', doc_type),
+                '%s' % self.params['_id'])
 
     @property
     def es_op(self):
-        retval = ''
+        return self.op[:-1]
+
+    @property
+    def op(self):
+        '''
+        Lines of the action in the Bulk API format, each terminated by a
+        newline.
+        '''
+
+        return self.encode()
 
-        retval += json.dumps({self.type: self.params})
+    def encode(self, dumps=_dumps):
+        '''
+        Returns :attr:`op`, serialized using the given function to encode
+        JSON unless the action was serialized already, without keeping it.
+        '''
+
+        if self._op is not None:
+            return self._op
+        lines = [dumps({self.type: self._params})]
         if BulkOperation.BULK_ACTIONS.get(self.type):
-            retval += '\n' + json.dumps(self.body)
+            lines.append(dumps(self._body))
+        lines.append('')
+        return '\n'.join(lines)
 
-        return retval
+    def serialize(self, dumps=_dumps):
+        '''
+        Serializes the action, unless it was serialized already, using the
+        given function to encode JSON, keeps it and returns :attr:`op`.
+        '''
+
+        if self._op is None:
+            self._op = self.encode(dumps)
+        return self._op
+
+    def compact(self, dumps=_dumps):
+        '''
+        Serializes the action and frees its params and body, which are
+        decoded from the serialized action whenever they are accessed later.
+        '''
+
+        self.serialize(dumps)
+        self._params = None
+        self._body = None
 
 
 class BulkOperation(object):
@@ -254,9 +1328,21 @@ class BulkOperation(object):
         'delete': False,
     }
 
+    # HTTP statuses of items, or of whole Bulk API requests, that are worth
+    # retrying as the cluster was only temporarily unable to process them
+    RETRY_STATUSES = (429, 503)
+
+    # Number of actions serialized at a time when the body of a request is
+    # built
+    BODY_CHUNK_SIZE = 1000
+
     @query_params('index', 'doc_type', 'consistency', 'refresh', 'routing',
                   'replication', 'timeout')
-    def __init__(self, client, params=None, **kwargs):
+    def __init__(self, client, max_actions=None, max_bytes=None,
+                 flush_interval=None, compact=False, serializer=None,
+                 adaptive=None, coalesce=False, merge_updates=None,
+                 shard_aware=False, serializer_pool=None, memory_budget=None,
+                 spill_dir=None, params=None, **kwargs):
         '''
         API for performing easy bulk operations in Elasticsearch.
 
@@ -268,15 +1354,372 @@ class BulkOperation(object):
         :arg routing: Specific routing value
         :arg replication: Explicitly set the replication type (default: sync)
         :arg timeout: Explicit operation timeout
+        :arg max_actions: Flush automatically once these many actions have
+            been recorded
+        :arg max_bytes: Flush automatically before the serialized size of the
+            recorded actions would exceed these many bytes, e.g. to stay under
+            ``http.max_content_length``
+        :arg flush_interval: Flush automatically when an action is recorded
+            these many seconds after the last flush
+        :arg compact: Serialize every action as soon as it is recorded and
+            free its params and body, to keep large numbers of recorded
+            actions in as little memory as possible. Defaults to False i.e.
+            actions are serialized when they are executed.
+        :arg serializer: Serializer to encode actions with, e.g.
+            :class:`FastJSONSerializer`. Defaults to the serializer of the
+            client if it was created with a custom one.
+        :arg adaptive: True, or an :class:`AdaptiveBatchSize`, to flush
+            automatically in batches whose number of actions, and bytes if
+            ``max_bytes`` is given, adapt to the latency of the requests and
+            the rate of rejected actions. ``max_actions`` is the initial
+            number of actions and ``max_bytes`` the largest size of a
+            request. The current limits are :attr:`batch_size` and
+            :attr:`batch_bytes`.
+        :arg coalesce: Coalesce the recorded actions on the same document:
+            an ``index`` or ``delete`` replaces all the actions recorded
+            before it, and a partial document ``update`` is merged into the
+            ``index`` or partial document ``update`` recorded before it.
+            Versioned actions are never coalesced. The number of actions
+            eliminated is counted in :attr:`coalesced`. Defaults to False.
+        :arg merge_updates: Function to coalesce scripted updates with when
+            ``coalesce`` is True. It is called with the bodies of an update
+            and of the update recorded before it on the same document, and
+            returns the body of a single equivalent update or None to send
+            both. Defaults to None i.e. scripted updates are sent in order.
+        :arg shard_aware: Send the actions on every document straight to the
+            node that holds the primary of its shard when executed, instead
+            of to a node that forwards them. Nodes are found with the
+            routing table of the client, see
+            :meth:`SuperElasticsearch.routing_table`. Defaults to False.
+        :arg serializer_pool: :class:`SerializerPool` to serialize large
+            numbers of actions with in worker processes when they are
+            executed. Actions that are serialized when they are recorded,
+            i.e. with ``compact`` or ``max_bytes``, are not sent to the pool.
+        :arg memory_budget: Spill the recorded actions to a temporary NDJSON
+            file once their serialized size exceeds these many bytes, and
+            stream the body of the request from the file when executed, to
+            build requests larger than the memory available. Actions are
+            serialized when they are recorded. Spilled actions are only sent
+            by :meth:`execute`, as a single request, and are not coalesced
+            with the actions recorded after them. Defaults to None i.e. all
+            the actions are kept in memory.
+        :arg spill_dir: Directory to create spill files in. Defaults to the
+            default temporary directory.
 
         .. Note:: all the arguments passed at the time create a new bulk
                   operation can be overridden when
                   :meth:`BulkOperation.execute`: is called.
+
+        .. Note:: responses of all the flushes are collected in
+                  :attr:`responses`. When used as a context manager, the
+                  remaining actions are flushed on a clean exit.
         '''
 
         self._client = client
-        self._params = params
+        self._params = _decoded(params)
+        self._actions = []
+
+        self._max_actions = max_actions
+        self._max_bytes = max_bytes
+        self._flush_interval = flush_interval
+        self._compact = compact
+        self._size = 0
+        # number of recorded actions counted in _size, when they are not
+        # serialized as they are recorded
+        self._measured = 0
+        self._memory_budget = memory_budget
+        self._spill_dir = spill_dir
+        self._spill_file = None
+
+        if adaptive is True:
+            adaptive = AdaptiveBatchSize(initial_actions=max_actions or 500,
+                                         max_bytes=max_bytes)
+        self.adaptive = adaptive or None
+        if self.adaptive is not None and self._max_bytes is None:
+            self._max_bytes = self.adaptive.max_bytes
+
+        self._coalesce = coalesce
+        self._merge_updates = merge_updates
+        if shard_aware and not hasattr(client, 'routing_table'):
+            raise ValueError('Shard aware bulk operations need a '
+                             'SuperElasticsearch client.')
+        self._shard_aware = shard_aware
+        self._serializer_pool = serializer_pool
+        # positions of the recorded actions, by document, when coalescing
+        self._positions = {}
+        self.coalesced = 0
+
+        if serializer is None:
+            serializer = getattr(getattr(client, 'transport', None),
+                                 'serializer', None)
+            if type(serializer) is JSONSerializer:
+                # same output, but with a reused encoder
+                serializer = None
+        self._serializer = serializer
+        self._dumps = serializer.dumps if serializer is not None else _dumps
+        self._last_flush = time.time()
+        self.responses = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+        else:
+            self._discard_spilled()
+
+    @property
+    def batch_size(self):
+        '''
+        Number of actions after which the recorded actions are flushed, or
+        None if they are not flushed by number.
+        '''
+
+        if self.adaptive is not None:
+            return self.adaptive.actions
+        return self._max_actions
+
+    @property
+    def batch_bytes(self):
+        '''
+        Serialized size in bytes before which the recorded actions are
+        flushed, or None if they are not flushed by size.
+        '''
+
+        if self.adaptive is not None and self.adaptive.bytes is not None:
+            return self.adaptive.bytes
+        return self._max_bytes
+
+    @property
+    def size(self):
+        '''
+        Serialized size in bytes of the recorded actions.
+        '''
+
+        if not self._sized:
+            # serialized without being kept, so only the actions recorded
+            # since the size was last asked for are measured
+            self._size += sum(_byte_size(action.encode(self._dumps))
+                              for action in self._actions[self._measured:])
+            self._measured = len(self._actions)
+        return self._size + self.spilled_bytes
+
+    @property
+    def spilled(self):
+        '''
+        Number of the recorded actions that were spilled to disk.
+        '''
+
+        return self._spill_file.actions if self._spill_file else 0
+
+    @property
+    def spilled_bytes(self):
+        '''
+        Serialized size in bytes of the recorded actions that were spilled to
+        disk.
+        '''
+
+        return self._spill_file.size if self._spill_file else 0
+
+    @property
+    def _sized(self):
+        '''
+        Whether actions are serialized when they are recorded, to keep track
+        of their size.
+        '''
+
+        return (self._compact or self._max_bytes is not None or
+                self._memory_budget is not None)
+
+    def flush(self, **kwargs):
+        '''
+        Executes the recorded actions, if any, and collects the response in
+        :attr:`responses`. Accepts the same arguments as :meth:`execute`.
+
+        :returns: the response of the Bulk API request or None if there were
+            no actions to execute
+        '''
+
+        if not self._actions and not self.spilled:
+            return None
+
+        resp = self.execute(**kwargs)
+        self.responses.append(resp)
+        return resp
+
+    def _add_action(self, action):
+        '''
+        Records an action and flushes the recorded actions when any of the
+        configured limits is hit.
+        '''
+
+        action._params = _decoded(action._params)
+        if self._coalesce and self._coalesce_action(action):
+            return
+
+        size = 0
+        if self._compact:
+            action.compact(self._dumps)
+        if self._sized:
+            size = _byte_size(action.serialize(self._dumps))
+
+        max_actions = self.batch_size
+        max_bytes = self.batch_bytes
+
+        # flush before going over the limit; an action larger than the limit
+        # is sent on its own
+        if (max_bytes is not None and self._actions and
+                self._size + size > max_bytes):
+            self.flush()
+
+        self._actions.append(action)
+        self._size += size
+        if self._coalesce:
+            self._remember_position(action)
+
+        if max_actions is not None and len(self._actions) >= max_actions:
+            self.flush()
+        elif max_bytes is not None and self._size >= max_bytes:
+            self.flush()
+        elif (self._flush_interval is not None and
+                time.time() - self._last_flush >= self._flush_interval):
+            self.flush()
+        elif (self._memory_budget is not None and
+                self._size > self._memory_budget):
+            self._spill()
+
+    def _spill(self):
+        '''
+        Moves the recorded actions kept in memory to the spill file.
+        '''
+
+        if self._spill_file is None:
+            self._spill_file = SpillFile(self._spill_dir)
+        self._spill_file.write([action.encode(self._dumps)
+                                for action in self._actions])
         self._actions = []
+        self._positions = {}
+        self._size = 0
+        self._measured = 0
+
+    def _discard_spilled(self):
+        '''
+        Closes, and so removes, the spill file, if any.
+        '''
+
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
+
+    def _coalesce_key(self, action):
+        '''
+        Returns the key of the document the action applies to, or None if
+        its id is generated by Elasticsearch.
+        '''
+
+        defaults = self._params or {}
+        key = action.doc_key(defaults.get('index'), defaults.get('doc_type'))
+        if key is None:
+            return None
+        # the same id with other routing can be another document
+        params = action.params
+        return key + (params.get('routing'), params.get('parent'))
+
+    def _coalesce_action(self, action):
+        '''
+        Coalesces the action with the recorded actions on the same document,
+        if possible.
+
+        :returns: True if the action was coalesced, or False if it has to be
+            recorded
+        '''
+
+        key = self._coalesce_key(action)
+        positions = self._positions.get(key) if key is not None else None
+        if not positions:
+            return False
+
+        # versioned actions can fail depending on the ones before them
+        recorded = [self._actions[position] for position in positions]
+        if any('version' in each.params for each in recorded + [action]):
+            return False
+
+        last = recorded[-1]
+        if action.type in ('index', 'delete'):
+            # replaces whatever was recorded before it
+            merged = action
+        elif action.type != 'update' or last.type not in ('index', 'update'):
+            merged = None
+        elif (_partial_update(action) and last.type == 'index' and
+              isinstance(last.body, dict)):
+            merged = _BulkAction('index', params=last.params,
+                                 body=_merge_doc(last.body,
+                                                 action.body['doc']))
+        elif _partial_update(action) and _partial_update(last):
+            # on a missing document, the earlier update would have failed
+            if (action.body.get('doc_as_upsert') and
+                    not last.body.get('doc_as_upsert')):
+                merged = None
+            else:
+                body = dict(last.body)
+                body['doc'] = _merge_doc(last.body['doc'], action.body['doc'])
+                merged = _BulkAction('update', params=action.params,
+                                     body=body)
+        elif self._merge_updates is not None and last.type == 'update':
+            body = self._merge_updates(last.body, action.body)
+            merged = None
+            if body is not None:
+                merged = _BulkAction('update', params=action.params,
+                                     body=body)
+        else:
+            merged = None
+
+        if merged is None:
+            return False
+
+        replaced = recorded if merged is action else [last]
+        if self._compact:
+            merged.compact(self._dumps)
+        if self._sized:
+            self._size += _byte_size(merged.serialize(self._dumps)) - sum(
+                _byte_size(old.serialize(self._dumps)) for old in replaced)
+        elif positions[0] < self._measured:
+            # keeps the size of the actions measured so far in step
+            for position in positions[-len(replaced):]:
+                if position < self._measured:
+                    self._size -= _byte_size(
+                        self._actions[position].encode(self._dumps))
+            if positions[-1] < self._measured:
+                self._size += _byte_size(merged.encode(self._dumps))
+            if len(replaced) > 1:
+                self._measured -= len([position
+                                       for position in positions[:-1]
+                                       if position < self._measured])
+
+        self._actions[positions[-1]] = merged
+        if len(replaced) > 1:
+            # only left by scripted updates, rare enough to reindex them all
+            for position in reversed(positions[:-1]):
+                del self._actions[position]
+            self._positions = {}
+            for position, recorded in enumerate(self._actions):
+                recorded_key = self._coalesce_key(recorded)
+                if recorded_key is not None:
+                    self._positions.setdefault(recorded_key, []).append(
+                        position)
+        self.coalesced += len(replaced) if merged is action else 1
+        return True
+
+    def _remember_position(self, action):
+        '''
+        Remembers the position of the last recorded action, to coalesce
+        later actions on the same document with it.
+        '''
+
+        key = self._coalesce_key(action)
+        if key is not None:
+            self._positions.setdefault(key, []).append(len(self._actions) - 1)
 
     @query_params('index', 'doc_type', 'consistency', 'refresh', 'routing',
                   'replication', 'timeout')
@@ -294,22 +1737,467 @@ class BulkOperation(object):
         :arg routing: Specific routing value
         :arg replication: Explicitly set the replication type (default: sync)
         :arg timeout: Explicit operation timeout
+
+        .. Note:: If actions were spilled to disk, all the recorded actions
+                  are streamed from the spill file with a single request,
+                  straight to a node even in shard aware mode, and the
+                  spill file is removed whether the request succeeds or
+                  fails, i.e. the recorded actions are not kept on failure.
         '''
 
         # TO DO: check if percolate, timeout and replication parameters are
         #        allowed for bulk index operation
 
-        bulk_body = ''
-        for action in self._actions:
-            bulk_body += action.es_op + '\n'
+        bulk_kwargs = {}
+        bulk_kwargs.update(self._params)
+        bulk_kwargs.update(_decoded(params))
+
+        if self.spilled:
+            try:
+                resp = self._send_spilled(bulk_kwargs)
+            finally:
+                self._reset()
+            return resp
+
+        if self._shard_aware:
+            resp = self._execute_lanes(self._node_lanes(bulk_kwargs),
+                                       bulk_kwargs)
+        else:
+            resp = self._send(self._client, self._actions, bulk_kwargs)
+        self._reset()
+        return resp
+
+    @query_params('index', 'doc_type', 'consistency', 'refresh', 'routing',
+                  'replication', 'timeout')
+    def execute_parallel(self, workers=4, chunk_size=500, params=None,
+                         **kwargs):
+        '''
+        Executes all recorded actions in chunks of ``chunk_size`` actions over
+        ``workers`` concurrent Bulk API requests. Every worker thread uses its
+        own client built from the arguments the
+        :class:`SuperElasticsearch` client was created with.
+
+        Actions on the same document, i.e. with the same ``_index``,
+        ``_type`` and ``_id``, are always sent by the same worker in the order
+        in which they were recorded. Every worker has at most one request in
+        flight.
+
+        .. Note:: If any of the requests fails, the exception is raised once
+                  all the workers have stopped and the recorded actions are
+                  kept, including those that were already sent.
+
+        :arg workers: Number of concurrent Bulk API requests. Defaults to 4.
+        :arg chunk_size: Number of actions per Bulk API request. Defaults to
+            500.
+        :arg index: Default index for items which don't provide one
+        :arg doc_type: Default document type for items which don't provide one
+        :arg consistency: Explicit write consistency setting for the operation
+        :arg refresh: Refresh the index after performing the operation
+        :arg routing: Specific routing value
+        :arg replication: Explicitly set the replication type (default: sync)
+        :arg timeout: Explicit operation timeout
+        :returns: the responses of all the requests merged into one, with
+            ``items`` in the order in which the actions were recorded and
+            ``took`` of the slowest request
+        '''
+
+        self._check_not_spilled()
+
+        bulk_kwargs = {}
+        bulk_kwargs.update(self._params)
+        bulk_kwargs.update(_decoded(params))
+
+        lanes = self._lanes(workers, bulk_kwargs.get('index'),
+                            bulk_kwargs.get('doc_type'))
+
+        create_clients = getattr(self._client, '_bulk_clients', None)
+        if create_clients is not None:
+            clients = create_clients(workers)
+        else:
+            clients = [self._client] * workers
+
+        result = self._execute_lanes(zip(clients, lanes), bulk_kwargs,
+                                     chunk_size)
+        self._reset()
+        return result
+
+    def _execute_lanes(self, lanes, bulk_kwargs, chunk_size=None):
+        '''
+        Sends the recorded actions of every lane with the client of the lane,
+        in chunks of ``chunk_size`` actions or all at once if it is None, all
+        the lanes concurrently.
+
+        :arg lanes: list of tuples of a client and the positions of the
+            actions of the lane
+        :returns: the responses of all the requests merged into one, with
+            ``items`` in the order in which the actions were recorded
+        '''
+
+        actions = self._actions
+        items = [None] * len(actions)
+        result = dict(took=0, errors=False)
+        failures = []
+        lock = threading.Lock()
+
+        def send(client, positions):
+            size = chunk_size or len(positions)
+            try:
+                for start in range(0, len(positions), size):
+                    if failures:
+                        return
+                    chunk = positions[start:start + size]
+                    resp = self._send(client, [actions[i] for i in chunk],
+                                      bulk_kwargs)
+                    with lock:
+                        result['took'] = max(result['took'],
+                                             resp.get('took', 0))
+                        result['errors'] = (result['errors'] or
+                                            resp.get('errors', False))
+                    for position, item in zip(chunk, resp['items']):
+                        items[position] = item
+            except Exception as err:
+                failures.append(err)
+
+        threads = []
+        for client, positions in lanes:
+            if not positions:
+                continue
+            thread = threading.Thread(target=send, args=(client, positions))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+        if failures:
+            raise failures[0]
+
+        result['items'] = items
+        return result
+
+    @query_params('index', 'doc_type', 'consistency', 'refresh', 'routing',
+                  'replication', 'timeout')
+    def execute_with_retry(self, max_retries=3, backoff=0.5, max_backoff=30,
+                           params=None, **kwargs):
+        '''
+        Executes all recorded actions like :meth:`execute`, and retries the
+        actions that the cluster rejected, e.g. with
+        ``EsRejectedExecutionException`` when it is overloaded, instead of the
+        whole request. Retries wait for an exponentially growing, randomly
+        jittered delay.
+
+        :arg max_retries: Maximum number of times an action is retried.
+            Defaults to 3.
+        :arg backoff: Maximum delay in seconds before the first retry, which
+            doubles for every retry after it. Defaults to 0.5.
+        :arg max_backoff: Maximum delay in seconds before any retry. Defaults
+            to 30.
+        :arg index: Default index for items which don't provide one
+        :arg doc_type: Default document type for items which don't provide one
+        :arg consistency: Explicit write consistency setting for the operation
+        :arg refresh: Refresh the index after performing the operation
+        :arg routing: Specific routing value
+        :arg replication: Explicitly set the replication type (default: sync)
+        :arg timeout: Explicit operation timeout
+        :returns: dict with the final ``items`` in the order in which the
+            actions were recorded, ``errors``, total ``took``, and the number
+            of actions that ``succeeded``, ``failed`` permanently and were
+            ``retried``; every retry of an action is counted
+        '''
+
+        self._check_not_spilled()
 
         bulk_kwargs = {}
         bulk_kwargs.update(self._params)
-        bulk_kwargs.update(params)
+        bulk_kwargs.update(_decoded(params))
+
+        actions = self._actions
+        items = [None] * len(actions)
+        pending = list(range(len(actions)))
+        took = 0
+        retried = 0
+        # positions of the items that failed, only looked for in responses
+        # with errors
+        failed = set()
+
+        for attempt in range(max_retries + 1):
+            if attempt:
+                delay = min(max_backoff, backoff * 2 ** (attempt - 1))
+                time.sleep(random.uniform(0, delay))
+
+            try:
+                resp = self._send(self._client,
+                                  [actions[i] for i in pending], bulk_kwargs)
+            except TransportError as err:
+                if (err.status_code not in self.RETRY_STATUSES or
+                        attempt == max_retries):
+                    raise
+                retried += len(pending)
+                continue
+
+            took += resp.get('took', 0)
+            if not resp.get('errors'):
+                for position, item in zip(pending, resp['items']):
+                    items[position] = item
+                failed.difference_update(pending)
+                break
+
+            retry = []
+            for position, item in zip(pending, resp['items']):
+                items[position] = item
+                if _item_failed(item):
+                    failed.add(position)
+                else:
+                    failed.discard(position)
+                if (attempt < max_retries and
+                        _item_result(item).get('status') in
+                        self.RETRY_STATUSES):
+                    retry.append(position)
+            retried += len(retry)
+            pending = retry
+            if not pending:
+                break
+
+        self._reset()
+        return dict(took=took, errors=bool(failed), items=items,
+                    succeeded=len(items) - len(failed), failed=len(failed),
+                    retried=retried)
+
+    def _check_not_spilled(self):
+        if self.spilled:
+            raise ValueError('Actions spilled to disk can only be sent with '
+                             'BulkOperation.execute.')
+
+    def _lanes(self, count, index=None, doc_type=None):
+        '''
+        Splits positions of the recorded actions into ``count`` lanes, such
+        that all the actions on the same document are in the same lane, in
+        the order in which they were recorded.
+        '''
+
+        lanes = [[] for _ in range(count)]
+        for position, action in enumerate(self._actions):
+            key = action.doc_key(index, doc_type)
+            if key is None:
+                # documents with generated ids can go to any of the lanes
+                lanes[position % count].append(position)
+            else:
+                lanes[hash(key) % count].append(position)
+        return lanes
+
+    def _node_lanes(self, bulk_kwargs):
+        '''
+        Splits positions of the recorded actions into lanes by the node that
+        holds the primary of the shard of their document, and returns tuples
+        of the client to send every lane with and its positions. Actions
+        whose node is not known are sent with the client of this bulk
+        operation.
+        '''
+
+        table = self._client.routing_table()
+        index = bulk_kwargs.get('index')
+        doc_type = bulk_kwargs.get('doc_type')
+        nodes = {}
+        for position, action in enumerate(self._actions):
+            params = action.params
+            node = None
+            if params.get('_id') is not None:
+                # documents are routed by their parent if they have one
+                routing = params.get('routing', params.get('parent'))
+                if routing is None:
+                    routing = bulk_kwargs.get('routing')
+                node = table.node(params.get('_index', index),
+                                  params.get('_type', doc_type),
+                                  params['_id'], routing)
+            nodes.setdefault(node, []).append(position)
+
+        return [(table.bulk_client(node, self._client), positions)
+                for node, positions in nodes.items()]
+
+    def _send(self, client, actions, params):
+        '''
+        Sends the actions with a Bulk API request of the client, records
+        metrics of the request if the client of this bulk operation has
+        metrics enabled, adapts the batch size to the request in adaptive
+        mode, and lets the client invalidate what it cached of the documents
+        that were written to.
+        '''
+
+        metrics = getattr(self._client, 'metrics', None)
+        adaptive = self.adaptive
+        try:
+            if metrics is None and adaptive is None:
+                return client.bulk(body=self._bulk_body(actions), **params)
+
+            start = time.time()
+            bulk_body, size = self._build_body(actions, measure=True)
+            if metrics is not None:
+                metrics.record('bulk.serialize_time', time.time() - start)
+                metrics.record('bulk.actions', len(actions))
+                metrics.record('bulk.request_bytes', size)
+
+            start = time.time()
+            try:
+                resp = client.bulk(body=bulk_body, **params)
+            except TransportError as err:
+                if adaptive is not None and err.status_code == 429:
+                    # the whole request was rejected
+                    self._adapt(len(actions), size, time.time() - start,
+                                len(actions))
+                raise
+            latency = time.time() - start
+
+            errors = rejected = 0
+            if resp.get('errors'):
+                for item in resp['items']:
+                    if _item_failed(item):
+                        errors += 1
+                        if _item_result(item).get('status') == 429:
+                            rejected += 1
+            if metrics is not None:
+                metrics.record('bulk.latency', latency)
+                metrics.record('bulk.response_bytes',
+                               metrics.response_bytes())
+                metrics.record('bulk.item_errors', errors)
+            if adaptive is not None:
+                self._adapt(len(actions), size, latency, rejected)
+            return resp
+        finally:
+            self._written(actions, params)
+
+    def _send_spilled(self, params):
+        '''
+        Spills the rest of the recorded actions and streams the spill file as
+        the body of a Bulk API request, straight with a connection of the
+        transport of the client, as the transport only sends bodies that
+        are in memory. Records metrics of the request if the client has
+        metrics enabled, and lets the client invalidate what it cached of
+        the documents that were written to.
+        '''
+
+        self._spill()
+        spill = self._spill_file
+        transport = self._client.transport
+        path = _make_path(params.get('index'), params.get('doc_type'),
+                          '_bulk')
+        query = dict((key, value) for key, value in params.items()
+                     if key not in ('index', 'doc_type'))
+        metrics = getattr(self._client, 'metrics', None)
+        if metrics is not None:
+            metrics.record('bulk.actions', spill.actions)
+            metrics.record('bulk.request_bytes', spill.size)
+
+        try:
+            start = time.time()
+            for attempt in range(transport.max_retries + 1):
+                connection = transport.get_connection()
+                try:
+                    status, headers, data = connection.perform_request(
+                        'POST', path, query, body=spill.body())
+                except ConnectionTimeout:
+                    # the node may have applied the actions, so they are
+                    # only sent again if the transport retries on timeouts
+                    if (not transport.retry_on_timeout or
+                            attempt == transport.max_retries):
+                        raise
+                    transport.mark_dead(connection)
+                except ConnectionError:
+                    transport.mark_dead(connection)
+                    if attempt == transport.max_retries:
+                        raise
+                else:
+                    transport.connection_pool.mark_live(connection)
+                    break
+            resp = transport.deserializer.loads(
+                data, headers.get('content-type'))
+            latency = time.time() - start
+
+            if metrics is not None:
+                errors = 0
+                if resp.get('errors'):
+                    errors = len([item for item in resp['items']
+                                  if _item_failed(item)])
+                metrics.record('bulk.latency', latency)
+                metrics.record('bulk.response_bytes',
+                               metrics.response_bytes())
+                metrics.record('bulk.item_errors', errors)
+            return resp
+        finally:
+            # the spill file is only read back if there are caches to
+            # invalidate
+            if getattr(self._client, '_caches', None):
+                for ops in spill.read_ops(self.BULK_ACTIONS.get):
+                    self._written([_BulkAction.from_op(type, op)
+                                   for type, op in ops], params)
+
+    def _adapt(self, actions, size, latency, rejected):
+        '''
+        Lets the controller of the adaptive mode adapt the batch size to the
+        outcome of a request.
+        '''
+
+        self.adaptive.update(actions, size, latency, rejected)
+        metrics = getattr(self._client, 'metrics', None)
+        if metrics is not None:
+            metrics.record('bulk.batch_size', self.adaptive.actions)
+
+    def _written(self, actions, params):
+        '''
+        Lets the client invalidate what it cached of the documents that the
+        actions were sent to write to.
+        '''
+
+        bulk_written = getattr(self._client, '_bulk_written', None)
+        if bulk_written is not None:
+            bulk_written(actions, params.get('index'), params.get('doc_type'))
+
+    def _bulk_body(self, actions):
+        '''
+        Serializes actions to the body of a Bulk API request. Actions that
+        were not serialized when they were recorded are serialized a chunk at
+        a time without being kept, so that the body is the only full copy of
+        the serialized actions at any time.
+        '''
+
+        return self._build_body(actions)[0]
+
+    def _build_body(self, actions, measure=False):
+        '''
+        Returns the body of a Bulk API request of the actions, see
+        :meth:`_bulk_body`, and its size in bytes if ``measure`` is True, or
+        None. The size is summed over the serialized actions, so the body is
+        not encoded again to measure it.
+        '''
+
+        pooled = (self._serializer_pool is not None and
+                  self._serializer_pool.serialize(actions, self._serializer))
+        dumps = self._dumps
+        bulk_body = ''
+        size = 0 if measure else None
+        for start in range(0, len(actions), self.BODY_CHUNK_SIZE):
+            ops = [action.encode(dumps)
+                   for action in actions[start:start + self.BODY_CHUNK_SIZE]]
+            if measure:
+                size += sum([_byte_size(op) for op in ops])
+            # CPython grows the body in place, as nothing else references it
+            bulk_body += ''.join(ops)
+        if pooled and not self._sized:
+            # serialized by the pool only to be joined
+            for action in actions:
+                action._op = None
+        return bulk_body, size
+
+    def _reset(self):
+        '''
+        Forgets the recorded actions after they have been executed.
+        '''
 
-        resp = self._client.bulk(body=bulk_body, **bulk_kwargs)
         self._actions = []
-        return resp
+        self._positions = {}
+        self._size = 0
+        self._measured = 0
+        self._discard_spilled()
+        self._last_flush = time.time()
 
     @query_params('index', 'doc_type', 'consistency', 'parent', 'refresh',
                   'routing', 'timestamp', 'ttl',
@@ -349,8 +2237,8 @@ class BulkOperation(object):
 
         bulk_params.update(params)
 
-        self._actions.append(_BulkAction(type=action_type, params=bulk_params,
-                                         body=body))
+        self._add_action(_BulkAction(type=action_type, params=bulk_params,
+                                     body=body))
 
     def index(self, body, id=None, **kwargs):
         '''
@@ -425,8 +2313,8 @@ class BulkOperation(object):
 
         bulk_params.update(params)
 
-        self._actions.append(_BulkAction(type='update', params=bulk_params,
-                                         body=body))
+        self._add_action(_BulkAction(type='update', params=bulk_params,
+                                     body=body))
 
     @query_params('index', 'doc_type', 'consistency', 'parent', 'replication',
                   'routing', 'version', 'version_type')
@@ -457,4 +2345,4 @@ class BulkOperation(object):
 
         bulk_params.update(params)
 
-        self._actions.append(_BulkAction(type='delete', params=bulk_params))
+        self._add_action(_BulkAction(type='delete', params=bulk_params))
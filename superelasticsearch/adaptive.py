@@ -0,0 +1,97 @@
+'''
+    superelasticsearch.adaptive
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Controller that adapts the size of Bulk API requests to how the cluster
+    copes with them.
+'''
+
+import threading
+
+
+class AdaptiveBatchSize(object):
+    '''
+    Adapts the number of actions, and optionally bytes, per Bulk API request
+    with additive increase and multiplicative decrease (AIMD).
+
+    After every request, the batch size is cut by ``backoff`` times when the
+    request took longer than ``target_latency`` or more than
+    ``max_rejection_rate`` of its actions were rejected with status 429, and
+    grows by ``step`` actions when the request was full and fast enough.
+    Requests that were not full, e.g. the last one of a bulk operation, say
+    nothing about a larger size and don't make it grow.
+
+    .. Usage::
+    controller = AdaptiveBatchSize(target_latency=0.5, max_actions=5000)
+    bulk = es.bulk_operation(index='logs', adaptive=controller)
+    ...
+    print controller.actions
+    '''
+
+    def __init__(self, target_latency=1.0, max_rejection_rate=0.01,
+                 initial_actions=500, min_actions=10, max_actions=10000,
+                 step=None, backoff=0.5, max_bytes=None,
+                 min_bytes=64 * 1024):
+        '''
+        :arg target_latency: Seconds a Bulk API request should take at most.
+            Defaults to 1.
+        :arg max_rejection_rate: Fraction of the actions of a request that
+            can be rejected before the batch size is cut. Defaults to 0.01.
+        :arg initial_actions: Number of actions of the first request.
+            Defaults to 500.
+        :arg min_actions: Smallest number of actions per request. Defaults
+            to 10.
+        :arg max_actions: Largest number of actions per request. Defaults to
+            10000.
+        :arg step: Number of actions the batch size grows by. Defaults to a
+            tenth of ``initial_actions``.
+        :arg backoff: Factor the batch size is cut by. Defaults to 0.5.
+        :arg max_bytes: Largest size in bytes of a request. When given, the
+            size of requests in bytes is adapted as well, starting from this
+            size. Defaults to None i.e. only actions are counted.
+        :arg min_bytes: Smallest size in bytes that the size of requests is
+            cut to. Defaults to 64 KB.
+        '''
+
+        self.target_latency = target_latency
+        self.max_rejection_rate = max_rejection_rate
+        self.min_actions = min_actions
+        self.max_actions = max_actions
+        self.step = step or max(initial_actions // 10, 1)
+        self.backoff = backoff
+        self.max_bytes = max_bytes
+        self.min_bytes = min_bytes
+
+        self.actions = initial_actions
+        self.bytes = max_bytes
+        self.increases = 0
+        self.decreases = 0
+        self._lock = threading.Lock()
+
+    def update(self, actions, size, latency, rejected):
+        '''
+        Adapts the batch size to the outcome of a Bulk API request.
+
+        :arg actions: Number of actions of the request
+        :arg size: Size in bytes of the request
+        :arg latency: Seconds the request took
+        :arg rejected: Number of actions rejected with status 429
+        '''
+
+        with self._lock:
+            if (latency > self.target_latency or
+                    rejected > actions * self.max_rejection_rate):
+                self.actions = max(self.min_actions,
+                                   int(self.actions * self.backoff))
+                if self.bytes is not None:
+                    self.bytes = max(self.min_bytes,
+                                     int(self.bytes * self.backoff))
+                self.decreases += 1
+            # a request that hit the byte limit was within an action of it
+            elif (actions >= self.actions or
+                    (self.bytes is not None and size >= self.bytes * 0.75)):
+                self.actions = min(self.max_actions, self.actions + self.step)
+                if self.bytes is not None:
+                    self.bytes = min(self.max_bytes,
+                                     self.bytes + self.step * size // actions)
+                self.increases += 1
@@ -0,0 +1,445 @@
+'''
+    superelasticsearch.aio
+    ~~~~~~~~~~~~~~~~~~~~~~
+
+    Asyncio counterparts of :class:`SuperElasticsearch` and
+    :class:`BulkOperation` for Python 3.6 and newer.
+
+    :class:`AsyncSuperElasticsearch` sends requests through an asynchronous
+    transport. Any object with a ``perform_request(method, url, params=None,
+    body=None)`` coroutine, which returns the status and the decoded body of
+    the response like :class:`elasticsearch.Transport` does, can be used as
+    the transport. :class:`AsyncTransport`, a small HTTP/1.1 client built on
+    asyncio streams, is used by default.
+'''
+
+import asyncio
+
+from urllib.parse import urlencode, urlparse
+
+from elasticsearch.client.utils import _escape, _make_path, query_params
+from elasticsearch.exceptions import ConnectionError
+from elasticsearch.exceptions import ConnectionTimeout
+from elasticsearch.exceptions import HTTP_EXCEPTIONS
+from elasticsearch.exceptions import TransportError
+from elasticsearch.serializer import JSONSerializer
+
+from . import BulkOperation, _check_scroll_count, _decoded, _page_results
+
+__all__ = ['AsyncSuperElasticsearch', 'AsyncBulkOperation', 'AsyncTransport']
+
+
+def _parse_host(host):
+    '''
+    Returns ``(host, port)`` of a host given as ``host:port``, as a URL or as
+    a dict like the official client accepts.
+    '''
+
+    if isinstance(host, dict):
+        return host.get('host', 'localhost'), int(host.get('port', 9200))
+    if '://' not in host:
+        host = 'http://%s' % host
+    url = urlparse(host)
+    return url.hostname, url.port or 9200
+
+
+def _escape_params(params):
+    '''
+    Escapes query parameters like :func:`query_params` does, leaving
+    ``ignore`` and ``request_timeout`` as they are.
+    '''
+
+    return dict((name, value if name in ('ignore', 'request_timeout')
+                 else _escape(value)) for name, value in params.items())
+
+
+async def _read_response(reader, method):
+    '''
+    Reads an HTTP response and returns its status, headers and body.
+    '''
+
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError('N/A', 'Connection closed by the server.', None)
+    status = int(line.split()[1])
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    if method == 'HEAD' or status in (204, 304):
+        data = b''
+    elif 'content-length' in headers:
+        data = await reader.readexactly(int(headers['content-length']))
+    elif headers.get('transfer-encoding', '').lower() == 'chunked':
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            if not size:
+                # skip trailers
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readline()
+        data = b''.join(chunks)
+    else:
+        data = await reader.read()
+        headers['connection'] = 'close'
+
+    return status, headers, data
+
+
+class AsyncTransport(object):
+    '''
+    HTTP/1.1 transport on asyncio streams that keeps a pool of persistent
+    connections to every host and sends requests to the hosts in turns.
+    '''
+
+    def __init__(self, hosts=None, serializer=None, timeout=10, maxsize=10):
+        '''
+        :arg hosts: List of hosts as ``host:port``, URLs or dicts with
+            ``host`` and ``port``. Defaults to ``localhost:9200``.
+        :arg serializer: Serializer for request and response bodies. Defaults
+            to :class:`elasticsearch.serializer.JSONSerializer`.
+        :arg timeout: Default timeout of requests in seconds
+        :arg maxsize: Maximum number of idle connections kept per host
+        '''
+
+        self.hosts = [_parse_host(host) for host in hosts or ['localhost']]
+        self.serializer = serializer or JSONSerializer()
+        self.timeout = timeout
+        self.maxsize = maxsize
+        self._idle = dict((host, []) for host in self.hosts)
+        self._next = 0
+
+    async def perform_request(self, method, url, params=None, body=None):
+        '''
+        Sends a request and returns status and decoded body of the response.
+        Raises :class:`elasticsearch.TransportError` for error responses
+        unless their status is in the ``ignore`` parameter.
+        '''
+
+        params = dict(params or {})
+        ignore = params.pop('ignore', ())
+        if isinstance(ignore, int):
+            ignore = (ignore, )
+        timeout = params.pop('request_timeout', self.timeout)
+        if params:
+            url = '%s?%s' % (url, urlencode(params))
+
+        if body is not None:
+            body = self.serializer.dumps(body)
+            if not isinstance(body, bytes):
+                body = body.encode('utf-8')
+
+        host = self.hosts[self._next % len(self.hosts)]
+        self._next += 1
+
+        try:
+            status, headers, data = await asyncio.wait_for(
+                self._request(host, method, url, body), timeout)
+        except asyncio.TimeoutError:
+            raise ConnectionTimeout('TIMEOUT', 'Request timed out after %s '
+                                    'seconds.' % timeout, None)
+        except (OSError, asyncio.IncompleteReadError) as err:
+            raise ConnectionError('N/A', str(err), err)
+
+        data = data.decode('utf-8')
+        if not 200 <= status < 300 and status not in ignore:
+            error_message = data
+            additional_info = None
+            try:
+                additional_info = self.serializer.loads(data)
+                error_message = additional_info.get('error', error_message)
+            except Exception:
+                pass
+            raise HTTP_EXCEPTIONS.get(status, TransportError)(
+                status, error_message, additional_info)
+
+        if data:
+            data = self.serializer.loads(data)
+        return status, data
+
+    async def _request(self, host, method, url, body):
+        while True:
+            reused = bool(self._idle[host])
+            if reused:
+                reader, writer = self._idle[host].pop()
+            else:
+                reader, writer = await asyncio.open_connection(*host)
+
+            head = ['%s %s HTTP/1.1' % (method, url),
+                    'Host: %s:%s' % host,
+                    'Content-Type: application/json',
+                    'Content-Length: %d' % len(body or b'')]
+            try:
+                head = '\r\n'.join(head) + '\r\n\r\n'
+                writer.write(head.encode('latin-1'))
+                if body:
+                    writer.write(body)
+                await writer.drain()
+                status, headers, data = await _read_response(reader, method)
+            except (OSError, ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                if reused:
+                    # the server closed the idle connection, try a new one
+                    continue
+                raise
+            except BaseException:
+                writer.close()
+                raise
+
+            if (headers.get('connection', '').lower() == 'close' or
+                    len(self._idle[host]) >= self.maxsize):
+                writer.close()
+            else:
+                self._idle[host].append((reader, writer))
+            return status, headers, data
+
+    async def close(self):
+        '''
+        Closes all the idle connections.
+        '''
+
+        for connections in self._idle.values():
+            while connections:
+                connections.pop()[1].close()
+
+
+class AsyncSuperElasticsearch(object):
+    '''
+    Asyncio client providing :meth:`itersearch` and :meth:`bulk_operation`
+    of :class:`SuperElasticsearch`, along with the Elasticsearch APIs they
+    are built upon.
+
+    .. Usage::
+    es = AsyncSuperElasticsearch(hosts=['localhost:9200'])
+    async for doc in es.itersearch(index='tweets', scroll='10m',
+                                   chunked=False):
+        print(doc['_id'])
+    await es.close()
+    '''
+
+    def __init__(self, hosts=None, transport=None, **kwargs):
+        '''
+        :arg hosts: List of hosts, passed on to :class:`AsyncTransport`
+        :arg transport: Transport to use instead of :class:`AsyncTransport`
+        :arg kwargs: Other arguments of :class:`AsyncTransport`
+        '''
+
+        if transport is None:
+            transport = AsyncTransport(hosts, **kwargs)
+        self.transport = transport
+
+    async def close(self):
+        close = getattr(self.transport, 'close', None)
+        if close is not None:
+            await close()
+
+    async def search(self, index=None, doc_type=None, body=None, **params):
+        '''
+        Execute a search query, see :meth:`elasticsearch.Elasticsearch.search`.
+        '''
+
+        _, data = await self.transport.perform_request(
+            'GET', _make_path(index, doc_type, '_search'),
+            params=_escape_params(params), body=body)
+        return data
+
+    async def scroll(self, scroll_id=None, body=None, **params):
+        '''
+        Scroll a search request created by specifying the scroll parameter,
+        see :meth:`elasticsearch.Elasticsearch.scroll`.
+        '''
+
+        _, data = await self.transport.perform_request(
+            'GET', _make_path('_search', 'scroll', scroll_id),
+            params=_escape_params(params), body=body)
+        return data
+
+    async def clear_scroll(self, scroll_id=None, body=None, **params):
+        '''
+        Clear a scroll, see :meth:`elasticsearch.Elasticsearch.clear_scroll`.
+        '''
+
+        _, data = await self.transport.perform_request(
+            'DELETE', _make_path('_search', 'scroll', scroll_id),
+            params=_escape_params(params), body=body)
+        return data
+
+    async def bulk(self, body, index=None, doc_type=None, **params):
+        '''
+        Perform many index/delete operations in a single API call, see
+        :meth:`elasticsearch.Elasticsearch.bulk`. The body must be a string.
+        '''
+
+        _, data = await self.transport.perform_request(
+            'POST', _make_path(index, doc_type, '_bulk'),
+            params=_escape_params(params), body=body)
+        return data
+
+    async def itersearch(self, scroll, **kwargs):
+        '''
+        Asynchronous version of :meth:`SuperElasticsearch.itersearch`. Takes
+        the same arguments, except ``parallel``, ``prefetch`` and ``scan``,
+        and returns an asynchronous generator. Scans can be run by passing
+        ``search_type='scan'``.
+        '''
+
+        # add scroll
+        kwargs['scroll'] = scroll
+
+        chunked = kwargs.pop('chunked', True)
+        with_meta = kwargs.pop('with_meta', False)
+
+        resp = await self.search(**kwargs)
+        total = resp['hits']['total']
+        scroll_id = resp['_scroll_id']
+        counter = 0
+
+        if kwargs.get('search_type') == 'scan':
+            # the first response of a scan has no hits, just the scroll id
+            resp = await self.scroll(scroll_id=scroll_id, scroll=scroll)
+
+        while len(resp['hits']['hits']) > 0:
+            for result in _page_results(resp, chunked, with_meta):
+                yield result
+
+            # increment the counter
+            counter += len(resp['hits']['hits'])
+
+            # get the next set of results
+            scroll_id = resp['_scroll_id']
+            resp = await self.scroll(scroll_id=scroll_id, scroll=scroll)
+
+        # clear scroll
+        await self.clear_scroll(scroll_id=scroll_id)
+
+        # check if all the documents were scrolled or not
+        _check_scroll_count(total, counter, scroll_id, resp['_scroll_id'])
+
+    def bulk_operation(self, **kwargs):
+        '''
+        Creates a new :class:`AsyncBulkOperation`. Takes the same arguments
+        as :meth:`SuperElasticsearch.bulk_operation`, except those that make
+        it send requests on its own, like the limits for flushing
+        automatically, which raise :class:`TypeError`.
+        '''
+
+        return AsyncBulkOperation(self, **kwargs)
+
+
+class AsyncBulkOperation(BulkOperation):
+    '''
+    :class:`BulkOperation` which executes the recorded actions with
+    coroutines. Actions are recorded with the same methods.
+
+    .. Usage::
+    async with es.bulk_operation(index='bulk_index') as bulk:
+        bulk.index(doc_type='docs', body=dict(key1='val1'))
+    '''
+
+    @query_params('index', 'doc_type', 'consistency', 'refresh', 'routing',
+                  'replication', 'timeout')
+    def __init__(self, client, compact=False, serializer=None, params=None,
+                 **kwargs):
+        if kwargs:
+            raise TypeError('%s got unsupported arguments: %s' % (
+                type(self).__name__, ', '.join(sorted(kwargs))))
+        super(AsyncBulkOperation, self).__init__(
+            client, compact=compact, serializer=serializer, params=params)
+
+    def __enter__(self):
+        raise TypeError('Use "async with" with %s.' % type(self).__name__)
+
+    def execute_parallel(self, *args, **kwargs):
+        raise TypeError('Use execute_concurrent with %s.' %
+                        type(self).__name__)
+
+    def execute_with_retry(self, *args, **kwargs):
+        raise TypeError('%s can\'t retry executing actions, use execute.' %
+                        type(self).__name__)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            await self.flush()
+
+    async def flush(self, **kwargs):
+        '''
+        Executes the recorded actions, if any, and collects the response in
+        :attr:`responses`.
+        '''
+
+        if not self._actions:
+            return None
+
+        resp = await self.execute(**kwargs)
+        self.responses.append(resp)
+        return resp
+
+    @query_params('index', 'doc_type', 'consistency', 'refresh', 'routing',
+                  'replication', 'timeout')
+    async def execute(self, params=None, **kwargs):
+        '''
+        Executes all recorded actions using Elasticsearch's Bulk Query, see
+        :meth:`BulkOperation.execute`.
+        '''
+
+        bulk_kwargs = {}
+        bulk_kwargs.update(self._params)
+        bulk_kwargs.update(_decoded(params))
+
+        resp = await self._client.bulk(body=self._bulk_body(self._actions),
+                                       **bulk_kwargs)
+        self._reset()
+        return resp
+
+    @query_params('index', 'doc_type', 'consistency', 'refresh', 'routing',
+                  'replication', 'timeout')
+    async def execute_concurrent(self, max_in_flight=4, chunk_size=500,
+                                 params=None, **kwargs):
+        '''
+        Executes all recorded actions in chunks of ``chunk_size`` actions with
+        up to ``max_in_flight`` concurrent Bulk API requests. Actions on the
+        same document are sent in the order in which they were recorded.
+
+        :returns: the responses of all the requests merged into one, like
+            :meth:`BulkOperation.execute_parallel` does
+        '''
+
+        bulk_kwargs = {}
+        bulk_kwargs.update(self._params)
+        bulk_kwargs.update(_decoded(params))
+
+        actions = self._actions
+        lanes = self._lanes(max_in_flight, bulk_kwargs.get('index'),
+                            bulk_kwargs.get('doc_type'))
+        items = [None] * len(actions)
+        result = dict(took=0, errors=False)
+
+        async def send(positions):
+            for start in range(0, len(positions), chunk_size):
+                chunk = positions[start:start + chunk_size]
+                resp = await self._client.bulk(
+                    body=self._bulk_body([actions[i] for i in chunk]),
+                    **bulk_kwargs)
+                result['took'] = max(result['took'], resp.get('took', 0))
+                result['errors'] = (result['errors'] or
+                                    resp.get('errors', False))
+                for position, item in zip(chunk, resp['items']):
+                    items[position] = item
+
+        await asyncio.gather(*[send(positions) for positions in lanes
+                               if positions])
+
+        result['items'] = items
+        self._reset()
+        return result
@@ -0,0 +1,239 @@
+'''
+    superelasticsearch.batching
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Coalescing of searches made by concurrent callers into Multi Search API
+    requests.
+'''
+
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from elasticsearch import ElasticsearchException
+from elasticsearch import TransportError
+
+
+class SearchFuture(object):
+    '''
+    Result of a search that has been submitted to a :class:`SearchBatcher`
+    and is sent with the next batch.
+    '''
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._result = None
+        self._exception = None
+
+    def done(self):
+        '''
+        Returns True if the search has completed, successfully or not.
+        '''
+
+        return self._event.is_set()
+
+    def result(self, timeout=None):
+        '''
+        Waits for the search to complete and returns its response, or raises
+        the error of the search.
+
+        :arg timeout: Maximum number of seconds to wait. Defaults to None
+            i.e. wait until the search completes.
+        '''
+
+        if not self._event.wait(timeout):
+            raise ElasticsearchException('Search did not complete in %s '
+                                         'seconds.' % timeout)
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self, timeout=None):
+        '''
+        Waits for the search to complete and returns its error, or None if
+        it succeeded.
+        '''
+
+        if not self._event.wait(timeout):
+            raise ElasticsearchException('Search did not complete in %s '
+                                         'seconds.' % timeout)
+        return self._exception
+
+    def set_result(self, result):
+        self._result = result
+        self._event.set()
+
+    def set_exception(self, exception):
+        self._exception = exception
+        self._event.set()
+
+
+class SearchBatcher(object):
+    '''
+    Gathers searches from concurrent callers and sends them together as
+    Multi Search API requests, saving a round trip per search.
+
+    A batch is sent once ``max_batch_size`` searches have been gathered, or
+    ``window`` seconds after its first search, whichever comes first. While
+    a batch is being sent, further searches gather in the next one. Every
+    search gets its own response or its own error: a failed search raises
+    :class:`elasticsearch.TransportError` with the error the cluster
+    returned for it, and a failed Multi Search API request raises its error
+    for every search of the batch.
+
+    .. Usage::
+    with es.batched_search(window=0.002, max_batch_size=50) as batcher:
+        # from many threads
+        resp = batcher.search(index='tweets', body={'query': query})
+
+        future = batcher.submit(index='tweets', body={'query': query})
+        resp = future.result()
+    '''
+
+    def __init__(self, client, window=0.005, max_batch_size=100,
+                 concurrency=1):
+        '''
+        :arg client: Elasticsearch client to send the batches with
+        :arg window: Maximum number of seconds a search waits for others to
+            be sent with. Defaults to 0.005.
+        :arg max_batch_size: Maximum number of searches per batch. Defaults
+            to 100.
+        :arg concurrency: Number of batches that can be sent at the same
+            time. Defaults to 1.
+        '''
+
+        self._client = client
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.concurrency = concurrency
+
+        self._requests = queue.Queue()
+        self._senders = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def submit(self, index=None, doc_type=None, body=None, search_type=None,
+               preference=None, routing=None):
+        '''
+        Adds a search to the next batch and returns its
+        :class:`SearchFuture`. Any other search parameter, like ``size``,
+        must be given in the body.
+
+        :arg index: A comma-separated list of index names to search
+        :arg doc_type: A comma-separated list of document types to search
+        :arg body: The search definition using the Query DSL
+        :arg search_type: Search operation type
+        :arg preference: Specify the node or shard the operation should be
+            performed on
+        :arg routing: A comma-separated list of specific routing values
+        '''
+
+        header = {}
+        for name, value in (('index', index), ('type', doc_type),
+                            ('search_type', search_type),
+                            ('preference', preference),
+                            ('routing', routing)):
+            if value is not None:
+                header[name] = value
+
+        future = SearchFuture()
+        with self._lock:
+            if self._closed:
+                raise ElasticsearchException('Search batcher is closed.')
+            self._start()
+            self._requests.put((header, body or {}, future))
+        return future
+
+    def search(self, *args, **kwargs):
+        '''
+        Adds a search to the next batch and waits for its response. Accepts
+        the same arguments as :meth:`submit`.
+        '''
+
+        return self.submit(*args, **kwargs).result()
+
+    def close(self):
+        '''
+        Sends the searches that are waiting and stops the sending threads.
+        '''
+
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            for _ in self._senders:
+                self._requests.put(None)
+        for thread in self._senders:
+            thread.join()
+
+    def _start(self):
+        '''
+        Starts the sending threads when the first search is submitted.
+        '''
+
+        while len(self._senders) < self.concurrency:
+            thread = threading.Thread(target=self._send_batches)
+            thread.daemon = True
+            thread.start()
+            self._senders.append(thread)
+
+    def _send_batches(self):
+        while True:
+            request = self._requests.get()
+            if request is None:
+                return
+
+            batch = [request]
+            deadline = time.time() + self.window
+            stopping = False
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self._requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if request is None:
+                    stopping = True
+                    break
+                batch.append(request)
+
+            self._send(batch)
+            if stopping:
+                return
+
+    def _send(self, batch):
+        '''
+        Sends a batch of searches as a Multi Search API request and completes
+        their futures.
+        '''
+
+        body = []
+        for header, search_body, _ in batch:
+            body.append(header)
+            body.append(search_body)
+
+        try:
+            resp = self._client.msearch(body=body)
+        except Exception as err:
+            for _, _, future in batch:
+                future.set_exception(err)
+            return
+
+        for (_, _, future), result in zip(batch, resp['responses']):
+            if 'error' in result:
+                future.set_exception(TransportError(
+                    result.get('status', 'N/A'), result['error'], result))
+            else:
+                future.set_result(result)
@@ -0,0 +1,240 @@
+'''
+    superelasticsearch.cache
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Thread-safe least recently used cache with optional expiry of entries,
+    and the cache of search responses built on it.
+'''
+
+import threading
+import time
+
+from collections import OrderedDict
+from fnmatch import fnmatch
+from json import JSONEncoder
+
+from elasticsearch.compat import string_types
+from elasticsearch.serializer import JSONSerializer
+
+# returned by LRUCache.get for keys that are not cached
+MISSING = object()
+
+# encodes bodies and parameters of searches the same way whatever the order
+# of keys of their objects
+_key_encoder = JSONEncoder(sort_keys=True, default=JSONSerializer().default)
+
+
+class LRUCache(object):
+    '''
+    Cache of at most ``max_size`` entries that evicts the least recently used
+    entry when it is full, and expires entries ``ttl`` seconds after they
+    were set. Counts cache ``hits`` and ``misses``, and ``evictions`` of
+    entries because the cache was full or they expired.
+    '''
+
+    def __init__(self, max_size=1000, ttl=None):
+        '''
+        :arg max_size: Maximum number of entries. Defaults to 1000.
+        :arg ttl: Number of seconds after which entries expire. Defaults to
+            None i.e. entries don't expire.
+        '''
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key) is not MISSING
+
+    def get(self, key):
+        '''
+        Returns the value of the key, or :data:`MISSING` if it is not cached
+        or has expired.
+        '''
+
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            value, expires = entry
+            if expires is not None and expires <= time.time():
+                self.misses += 1
+                self.evictions += 1
+                return MISSING
+            # most recently used entries are at the end
+            self._entries[key] = entry
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        expires = None
+        if self.ttl is not None:
+            expires = time.time() + self.ttl
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, expires)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key):
+        '''
+        Removes the key from the cache, if it is cached.
+        '''
+
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def discard(self, predicate):
+        '''
+        Removes the entries whose keys the predicate returns True for, and
+        returns the number of removed entries.
+        '''
+
+        with self._lock:
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                del self._entries[key]
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SearchCache(object):
+    '''
+    Cache of search responses, keyed by the indices, document types, body
+    and parameters of the searches.
+
+    Responses of searches on an index are forgotten when a
+    :class:`BulkOperation` of the client writes to the index, as are
+    responses of searches on all indices or on index patterns matching the
+    index. Writes through aliases, or by other clients, are not noticed and
+    are only caught up with when the responses expire.
+
+    .. Usage::
+    es = SuperElasticsearch(hosts=['localhost:9200'],
+                            search_cache=SearchCache(max_size=500, ttl=60))
+    '''
+
+    def __init__(self, max_size=1000, ttl=None, serializer=None):
+        '''
+        :arg max_size: Maximum number of responses to cache. Defaults to
+            1000.
+        :arg ttl: Number of seconds after which cached responses expire.
+            Defaults to None i.e. they don't expire.
+        :arg serializer: Serializer to store responses with, so that every
+            hit gets its own copy of the response. Defaults to the serializer
+            of the client.
+        '''
+
+        self._cache = LRUCache(max_size, ttl)
+        self.serializer = serializer
+        self.invalidations = 0
+        # incremented by every invalidation, so that responses of searches
+        # that ran while their indices were written to are not cached
+        self.generation = 0
+        # makes checking the generation and storing a response atomic with
+        # invalidations
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._cache)
+
+    @property
+    def stats(self):
+        '''
+        Dict of the number of cached responses, and of cache hits, misses,
+        evictions and invalidated responses.
+        '''
+
+        return dict(size=len(self._cache), hits=self._cache.hits,
+                    misses=self._cache.misses,
+                    evictions=self._cache.evictions,
+                    invalidations=self.invalidations)
+
+    def key(self, index, doc_type, body, params):
+        '''
+        Returns the cache key of a search. Keys are equal for searches whose
+        indices and types are given in a different order, or whose bodies
+        and parameters only differ in the order of keys of objects.
+        '''
+
+        indices = _names(index) or ('_all',)
+        return (indices, _names(doc_type), _key_encoder.encode(body),
+                _key_encoder.encode(params))
+
+    def get(self, key):
+        '''
+        Returns a copy of the cached response of the search, or
+        :data:`MISSING` if it is not cached.
+        '''
+
+        data = self._cache.get(key)
+        if data is MISSING:
+            return MISSING
+        return self.serializer.loads(data)
+
+    def set(self, key, response, generation=None):
+        '''
+        Caches the response of the search, unless it was sent before the
+        given :attr:`generation` and something was invalidated since.
+        '''
+
+        data = self.serializer.dumps(response)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._cache.set(key, data)
+
+    def invalidate(self, index=None):
+        '''
+        Forgets the responses of searches on the index, or of all searches if
+        no index is given.
+        '''
+
+        with self._lock:
+            self.generation += 1
+            if index is None:
+                count = len(self._cache)
+                self._cache.clear()
+            else:
+                count = self._cache.discard(
+                    lambda key: any(pattern == '_all' or
+                                    fnmatch(index, pattern)
+                                    for pattern in key[0]))
+            self.invalidations += count
+
+    def _bulk_written(self, actions, index=None, doc_type=None):
+        '''
+        Forgets responses of searches on the indices that the bulk actions
+        wrote to.
+        '''
+
+        indices = set(action.params.get('_index', index)
+                      for action in actions)
+        for written in indices:
+            self.invalidate(written)
+
+
+def _names(names):
+    '''
+    Returns sorted tuple of the names in the list or comma-separated string.
+    '''
+
+    if not names:
+        return ()
+    if isinstance(names, string_types):
+        names = names.split(',')
+    return tuple(sorted(names))
@@ -0,0 +1,147 @@
+'''
+    superelasticsearch.columnar
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Conversion of search hits to columns of field values, as NumPy masked
+    arrays when NumPy is installed.
+'''
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from elasticsearch.exceptions import ImproperlyConfigured
+
+
+# fields of a hit that are not looked up in its _source
+META_FIELDS = ('_index', '_type', '_id', '_score', '_routing', '_parent')
+
+_empty = {}
+
+
+def _values(hits, sources, path):
+    '''
+    Returns list of values of the field path of the hits, with None for the
+    hits that don't have it.
+    '''
+
+    if path in META_FIELDS:
+        return [hit.get(path) for hit in hits]
+
+    keys = path.split('.')
+    values = sources
+    for depth, key in enumerate(keys, 1):
+        # objects are looked up in with a default that can be looked up in
+        default = None if depth == len(keys) else _empty
+        try:
+            values = [value.get(key, default) for value in values]
+        except AttributeError:
+            # a value on the path is not an object
+            values = [value.get(key, default) if isinstance(value, dict)
+                      else None for value in values]
+    return values
+
+
+class Columns(object):
+    '''
+    Collects values of field paths from search hits, column by column.
+
+    Values are looked up in the ``_source`` of hits, with dots separating the
+    keys of objects, except for meta fields like ``_id`` that are read from
+    the hits themselves. A field that a hit does not have, or has as null, is
+    a missing value.
+    '''
+
+    def __init__(self, fields, arrays=True, dtypes=None):
+        '''
+        :arg fields: List of field paths to collect
+        :arg arrays: True to return columns as NumPy masked arrays, False to
+            return lists with None for missing values. Defaults to True.
+        :arg dtypes: Dict of field path and NumPy dtype of its column. The
+            dtype of other columns is inferred from their values.
+        '''
+
+        if arrays and numpy is None:
+            raise ImproperlyConfigured('NumPy is required for columns as '
+                                       'arrays, pass arrays=False to get '
+                                       'lists instead.')
+        self.fields = list(fields)
+        self.arrays = arrays
+        self.dtypes = dtypes or {}
+        self._columns = [[] for _ in self.fields]
+
+    def __len__(self):
+        return len(self._columns[0]) if self._columns else 0
+
+    def add(self, hits):
+        '''
+        Appends values of the fields of the hits to the columns.
+        '''
+
+        sources = [hit.get('_source', _empty) for hit in hits]
+        for field, column in zip(self.fields, self._columns):
+            column.extend(_values(hits, sources, field))
+
+    def pop(self):
+        '''
+        Returns dict of field path and its column, and starts new columns.
+        '''
+
+        columns, self._columns = self._columns, [[] for _ in self.fields]
+        result = {}
+        for field, values in zip(self.fields, columns):
+            if self.arrays:
+                values = _masked_array(values, self.dtypes.get(field))
+            result[field] = values
+        return result
+
+
+def _masked_array(values, dtype=None):
+    '''
+    Returns NumPy masked array of the values, with None values masked.
+    '''
+
+    if None in values:
+        mask = numpy.equal(_objects(values), None)
+        present = [value for value in values if value is not None]
+    else:
+        mask = numpy.zeros(len(values), dtype=bool)
+        present = values
+
+    if dtype is None:
+        # arrays and objects in documents stay python objects, not dimensions
+        if not present or isinstance(present[0], (list, dict)):
+            dtype = object
+        else:
+            try:
+                array = numpy.asarray(present)
+            except ValueError:
+                # lists of different lengths mixed with other values
+                array = None
+            if array is None or array.ndim != 1:
+                dtype = object
+            else:
+                present = array
+                dtype = array.dtype
+
+    dtype = numpy.dtype(dtype)
+    if dtype == object:
+        present = _objects(present)
+    if not mask.any():
+        data = numpy.asarray(present, dtype=dtype)
+    else:
+        data = numpy.zeros(len(values), dtype=dtype)
+        data[~mask] = present
+    return numpy.ma.MaskedArray(data, mask=mask)
+
+
+def _objects(values):
+    '''
+    Returns 1-d object array of the values, without turning lists into
+    dimensions.
+    '''
+
+    array = numpy.empty(len(values), dtype=object)
+    array[:] = values
+    return array
@@ -0,0 +1,126 @@
+'''
+    superelasticsearch.compression
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    HTTP connection that compresses bodies of Bulk API requests and asks for
+    compressed responses of scroll requests.
+'''
+
+import threading
+import zlib
+
+from elasticsearch.connection import Urllib3HttpConnection
+from elasticsearch.exceptions import ImproperlyConfigured
+
+# window bits of the zlib stream of every content encoding
+_WBITS = {
+    'gzip': 16 + zlib.MAX_WBITS,
+    'deflate': zlib.MAX_WBITS,
+}
+
+
+def compress(data, encoding='gzip', level=6):
+    '''
+    Returns the data compressed in the given HTTP content encoding, i.e.
+    **gzip** or **deflate**, with the given zlib compression level.
+    '''
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, _WBITS[encoding])
+    return compressor.compress(data) + compressor.flush()
+
+
+def decompress(data, encoding='gzip'):
+    '''
+    Returns the data decompressed from the given HTTP content encoding.
+    '''
+
+    return zlib.decompress(data, _WBITS[encoding])
+
+
+class CompressedHttpConnection(Urllib3HttpConnection):
+    '''
+    Connection that compresses the bodies of Bulk API requests, and asks for
+    compressed responses of searches and scroll requests of scrolls, which
+    Elasticsearch only compresses when ``http.compression`` is enabled.
+    Responses are decompressed transparently.
+
+    :class:`SuperElasticsearch` uses this connection when it is created with
+    any of its arguments.
+
+    .. Usage::
+    es = SuperElasticsearch(hosts=['localhost:9200'], compression='gzip',
+                            compression_level=3, compress_responses=True)
+    '''
+
+    def __init__(self, compression=None, compression_level=6,
+                 compress_responses=False, **kwargs):
+        '''
+        :arg compression: Content encoding to compress bodies of Bulk API
+            requests with, **gzip** or **deflate**. Defaults to None i.e.
+            bodies are sent as they are.
+        :arg compression_level: zlib compression level, from 1 (fastest) to
+            9 (smallest). Defaults to 6.
+        :arg compress_responses: Ask for compressed responses of scroll
+            requests. Defaults to False.
+        '''
+
+        if compression is not None and compression not in _WBITS:
+            raise ImproperlyConfigured(
+                'Unknown compression %r, expected one of: %s' % (
+                    compression, ', '.join(sorted(_WBITS))))
+
+        self.compression = compression
+        self.compression_level = compression_level
+        self.compress_responses = compress_responses
+        self._local = threading.local()
+        super(CompressedHttpConnection, self).__init__(**kwargs)
+
+    @property
+    def headers(self):
+        # headers of the request being performed by the current thread, as
+        # the connection is shared by threads
+        return getattr(self._local, 'headers', None) or self._headers
+
+    @headers.setter
+    def headers(self, value):
+        self._headers = value
+
+    def perform_request(self, method, url, params=None, body=None,
+                        timeout=None, ignore=()):
+        headers = {}
+        self._local.body = None
+        path = url.split('?')[0]
+        # bodies streamed from files are sent as they are
+        if (self.compression is not None and isinstance(body, bytes) and
+                body and path.endswith('/_bulk')):
+            self._local.body = body
+            body = compress(body, self.compression, self.compression_level)
+            headers['content-encoding'] = self.compression
+        if self.compress_responses and (
+                '/_search/scroll' in path or 'scroll' in (params or {})):
+            headers['accept-encoding'] = 'gzip,deflate'
+
+        if headers:
+            self._local.headers = dict(self._headers, **headers)
+        try:
+            return super(CompressedHttpConnection, self).perform_request(
+                method, url, params, body, timeout, ignore)
+        finally:
+            self._local.headers = None
+            self._local.body = None
+
+    def _logged(self, body):
+        # compressed bodies are logged as they were before compression
+        return self._local.body if self._local.body is not None else body
+
+    def log_request_success(self, method, full_url, path, body, status_code,
+                            response, duration):
+        super(CompressedHttpConnection, self).log_request_success(
+            method, full_url, path, self._logged(body), status_code,
+            response, duration)
+
+    def log_request_fail(self, method, full_url, body, duration,
+                         status_code=None, exception=None):
+        super(CompressedHttpConnection, self).log_request_fail(
+            method, full_url, self._logged(body), duration, status_code,
+            exception)
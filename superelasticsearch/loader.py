@@ -0,0 +1,144 @@
+'''
+    superelasticsearch.loader
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Batched lookups of documents by id with the Multi Get API, with an
+    optional cache of the documents.
+'''
+
+import threading
+
+from collections import OrderedDict
+
+from .cache import LRUCache
+from .cache import MISSING
+
+
+class DocumentLoader(object):
+    '''
+    Looks up documents by id in as few Multi Get API requests as possible.
+
+    Ids are deduplicated and grouped by index and document type, and every
+    group is fetched in requests of at most ``chunk_size`` ids. Documents
+    that were looked up, and ids of documents that don't exist, can be kept
+    in a least recently used cache. Cached documents are forgotten when a
+    :class:`BulkOperation` of the same client writes to or deletes them.
+
+    .. Usage::
+    loader = es.loader(index='users', doc_type='user', cache_size=10000,
+                       ttl=60)
+    users = loader.get_many(user_ids)
+    user = loader.get(user_id)
+    '''
+
+    def __init__(self, client, index=None, doc_type=None, chunk_size=1000,
+                 cache_size=None, ttl=None, **params):
+        '''
+        :arg client: Elasticsearch client to look documents up with
+        :arg index: Default index of the documents
+        :arg doc_type: Default type of the documents
+        :arg chunk_size: Maximum number of ids per Multi Get API request.
+            Defaults to 1000.
+        :arg cache_size: Maximum number of documents to cache. Defaults to
+            None i.e. documents are not cached.
+        :arg ttl: Number of seconds after which cached documents expire.
+            Defaults to None i.e. they don't expire.
+
+        Any other argument, e.g. ``_source_include``, is passed on to every
+        Multi Get API request.
+        '''
+
+        self._client = client
+        self.index = index
+        self.doc_type = doc_type
+        self.chunk_size = chunk_size
+        self._params = params
+
+        self.cache = None
+        if cache_size:
+            self.cache = LRUCache(cache_size, ttl)
+        # incremented by every invalidation, so that documents fetched while
+        # they were being written are not cached
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, id, index=None, doc_type=None):
+        '''
+        Returns the document with the id as returned by the Multi Get API,
+        or None if it does not exist.
+        '''
+
+        return self.get_many([id], index, doc_type)[0]
+
+    def get_many(self, ids, index=None, doc_type=None):
+        '''
+        Returns list of the documents with the ids, in the order of the ids,
+        with None for every document that does not exist.
+
+        :arg ids: List of document ids, or of ``(index, doc_type, id)``
+            tuples of documents in other indices
+        :arg index: Index of the documents, instead of the default index
+        :arg doc_type: Type of the documents, instead of the default type
+        '''
+
+        index = index or self.index
+        doc_type = doc_type or self.doc_type
+        keys = [tuple(id) if isinstance(id, (tuple, list))
+                else (index, doc_type, id) for id in ids]
+        keys = [(key[0], key[1], '%s' % key[2]) for key in keys]
+
+        docs = {}
+        groups = OrderedDict()
+        for key in keys:
+            if key in docs or key[2] in groups.get(key[:2], ()):
+                continue
+            if self.cache is not None:
+                doc = self.cache.get(key)
+                if doc is not MISSING:
+                    docs[key] = doc
+                    continue
+            groups.setdefault(key[:2], OrderedDict())[key[2]] = None
+
+        generation = self._generation
+        fetched = {}
+        for (group_index, group_type), group_ids in groups.items():
+            group_ids = list(group_ids)
+            for start in range(0, len(group_ids), self.chunk_size):
+                resp = self._client.mget(
+                    body=dict(ids=group_ids[start:start + self.chunk_size]),
+                    index=group_index, doc_type=group_type, **self._params)
+                for doc in resp['docs']:
+                    key = (group_index, group_type, doc['_id'])
+                    docs[key] = doc if doc.get('found') else None
+                    # errors, e.g. of missing indices, are not cached
+                    if 'error' not in doc:
+                        fetched[key] = docs[key]
+
+        if self.cache is not None:
+            with self._lock:
+                if generation == self._generation:
+                    for key, doc in fetched.items():
+                        self.cache.set(key, doc)
+
+        return [docs.get(key) for key in keys]
+
+    def invalidate(self, index, doc_type, id):
+        '''
+        Forgets the cached document, under its type and under no type.
+        '''
+
+        with self._lock:
+            self._generation += 1
+            if self.cache is not None:
+                self.cache.pop((index, doc_type, '%s' % id))
+                self.cache.pop((index, None, '%s' % id))
+
+    def _bulk_written(self, actions, index=None, doc_type=None):
+        '''
+        Forgets cached documents that the bulk actions wrote to.
+        '''
+
+        for action in actions:
+            key = action.doc_key(index, doc_type)
+            if key is not None:
+                self.invalidate(*key)
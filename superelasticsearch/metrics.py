@@ -0,0 +1,187 @@
+'''
+    superelasticsearch.metrics
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Measurements of scroll and bulk requests, recorded to pluggable sinks.
+
+    Metrics recorded by :class:`SuperElasticsearch` and :class:`BulkOperation`:
+
+    ``scroll.latency``
+        Seconds taken by every search and scroll request of a scroll
+    ``scroll.response_bytes``
+        Size of the response of every search and scroll request of a scroll
+    ``scroll.hits``
+        Number of hits of every page of a scroll
+    ``bulk.latency``
+        Seconds taken by every Bulk API request
+    ``bulk.request_bytes``
+        Size of the body of every Bulk API request
+    ``bulk.response_bytes``
+        Size of the response of every Bulk API request
+    ``bulk.actions``
+        Number of actions sent with every Bulk API request
+    ``bulk.serialize_time``
+        Seconds taken to serialize the body of every Bulk API request
+    ``bulk.item_errors``
+        Number of actions of every Bulk API request that failed
+    ``bulk.batch_size``
+        Number of actions per request of an adaptive bulk operation, after
+        every request
+'''
+
+import bisect
+import threading
+
+
+class Metrics(object):
+    '''
+    Records metrics to all of its sinks. A sink is any object with a
+    ``record(name, value)`` method, like :class:`HistogramSink` and
+    :class:`CallbackSink`.
+
+    .. Usage::
+    histograms = HistogramSink()
+    es = SuperElasticsearch(hosts=['localhost:9200'],
+                            metrics=Metrics(histograms))
+    ...
+    print histograms.percentile('scroll.latency', 99)
+    '''
+
+    def __init__(self, *sinks):
+        self.sinks = list(sinks)
+        self._local = threading.local()
+
+    def record(self, name, value):
+        for sink in self.sinks:
+            sink.record(name, value)
+
+    def response_bytes(self):
+        '''
+        Returns the size of the last response decoded in the current thread
+        by a deserializer returned by :meth:`deserializer`, and forgets it.
+        '''
+
+        size = getattr(self._local, 'response_bytes', 0)
+        self._local.response_bytes = 0
+        return size
+
+    def deserializer(self, deserializer):
+        '''
+        Returns a deserializer that decodes responses with the given
+        deserializer of a transport, and notes their sizes.
+        '''
+
+        return _MeteredDeserializer(deserializer, self._local)
+
+
+class _MeteredDeserializer(object):
+
+    def __init__(self, deserializer, local):
+        self.deserializer = deserializer
+        self._local = local
+
+    def loads(self, s, mimetype=None):
+        self._local.response_bytes = len(s)
+        return self.deserializer.loads(s, mimetype)
+
+
+class CallbackSink(object):
+    '''
+    Sink that calls the function with the name and value of every metric.
+    '''
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def record(self, name, value):
+        self.callback(name, value)
+
+
+class HistogramSink(object):
+    '''
+    Sink that keeps an in-memory histogram of every metric. Values are
+    counted in buckets whose bounds grow by ``growth`` times, so that memory
+    stays constant however many values are recorded, and percentiles are
+    accurate to within a bucket.
+    '''
+
+    def __init__(self, smallest=1e-6, growth=1.1):
+        '''
+        :arg smallest: Upper bound of the first bucket. Defaults to 1e-6.
+        :arg growth: Ratio of the upper bounds of consecutive buckets.
+            Defaults to 1.1 i.e. percentiles are within 10%.
+        '''
+
+        self.smallest = smallest
+        self.growth = growth
+        self._bounds = [smallest]
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, value):
+        while self._bounds[-1] < value:
+            self._bounds.append(self._bounds[-1] * self.growth)
+        return bisect.bisect_left(self._bounds, value)
+
+    def record(self, name, value):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = dict(
+                    count=0, sum=0, min=value, max=value, buckets={})
+            histogram['count'] += 1
+            histogram['sum'] += value
+            histogram['min'] = min(histogram['min'], value)
+            histogram['max'] = max(histogram['max'], value)
+            bucket = self._bucket(value)
+            histogram['buckets'][bucket] = (
+                histogram['buckets'].get(bucket, 0) + 1)
+
+    @property
+    def names(self):
+        return sorted(self._histograms)
+
+    def count(self, name):
+        histogram = self._histograms.get(name)
+        return histogram['count'] if histogram else 0
+
+    def total(self, name):
+        histogram = self._histograms.get(name)
+        return histogram['sum'] if histogram else 0
+
+    def percentile(self, name, percent):
+        '''
+        Returns the upper bound of the bucket of the given percentile of the
+        values of the metric, or None if none were recorded.
+        '''
+
+        histogram = self._histograms.get(name)
+        if not histogram:
+            return None
+
+        with self._lock:
+            rank = histogram['count'] * percent / 100.0
+            seen = 0
+            for bucket in sorted(histogram['buckets']):
+                seen += histogram['buckets'][bucket]
+                if seen >= rank:
+                    return min(self._bounds[bucket], histogram['max'])
+            return histogram['max']
+
+    def summary(self):
+        '''
+        Returns dict of every metric and the count, sum, mean, min, max and
+        50th, 90th and 99th percentile of its values.
+        '''
+
+        result = {}
+        for name in self.names:
+            histogram = self._histograms[name]
+            result[name] = dict(
+                count=histogram['count'], sum=histogram['sum'],
+                mean=histogram['sum'] / float(histogram['count']),
+                min=histogram['min'], max=histogram['max'],
+                p50=self.percentile(name, 50),
+                p90=self.percentile(name, 90),
+                p99=self.percentile(name, 99))
+        return result
@@ -0,0 +1,154 @@
+'''
+    superelasticsearch.pool
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    Serialization of bulk actions in worker processes, for bulk operations
+    whose encoding is bound by a single core.
+'''
+
+import multiprocessing
+import threading
+
+# serializer of the worker process, set for every chunk by _encode
+_worker_dumps = None
+
+
+def _init_worker(serializer):
+    global _worker_dumps
+    if serializer is None:
+        from superelasticsearch import _dumps as dumps
+    else:
+        dumps = serializer.dumps
+    _worker_dumps = dumps
+
+
+def _join(ops):
+    '''
+    Returns the serialized actions joined in UTF-8 bytes, and the length of
+    every serialized action in bytes. Actions given already serialized in
+    bytes, like UTF-8 ``str`` bodies on Python 2, are kept as they are.
+    '''
+
+    data = [op if isinstance(op, bytes) else op.encode('utf-8')
+            for op in ops]
+    return b''.join(data), [len(op) for op in data]
+
+
+def _encode(task):
+    '''
+    Serializes a chunk of actions, given as tuples of their type, params and
+    body, with the serializer given along, in a worker process.
+
+    :returns: tuple of the serialized actions joined in UTF-8 bytes, and the
+        length of every serialized action in bytes
+    '''
+
+    from superelasticsearch import _BulkAction
+
+    serializer, chunk = task
+    _init_worker(serializer)
+    return _join([_BulkAction(type, params, body).serialize(_worker_dumps)
+                  for type, params, body in chunk])
+
+
+class SerializerPool(object):
+    '''
+    Pool of worker processes that serialize the actions of bulk operations,
+    so that encoding large numbers of actions, e.g. of large nested
+    documents, can use more than one core despite the GIL.
+
+    Actions are sent pickled to the workers in chunks, and come back
+    serialized as bytes, in the order in which they were recorded. Pickling
+    the actions and sending them takes about as long as serializing them, so
+    the pool can only pay off with several free cores; fewer than
+    ``min_actions`` actions are serialized in the calling process, as the
+    workers would take longer to be sent the actions than to serialize them.
+    The workers are started when first needed and live until the pool is
+    closed.
+
+    The pool can be shared by any number of bulk operations, including
+    from several threads.
+
+    .. Usage::
+    with SerializerPool(processes=4) as pool:
+        bulk = es.bulk_operation(index='docs', serializer_pool=pool)
+        ...
+        bulk.execute()
+    '''
+
+    def __init__(self, processes=None, serializer=None, min_actions=2000,
+                 chunk_size=500):
+        '''
+        :arg processes: Number of worker processes. Defaults to the number of
+            CPUs.
+        :arg serializer: Serializer to encode actions with in the workers,
+            e.g. :class:`FastJSONSerializer`; it must be picklable. Defaults
+            to the serializer of the bulk operation.
+        :arg min_actions: Smallest number of actions to serialize in the
+            workers. Defaults to 2000.
+        :arg chunk_size: Number of actions serialized by a worker at a time.
+            Defaults to 500.
+        '''
+
+        self.processes = processes
+        self.serializer = serializer
+        self.min_actions = min_actions
+        self.chunk_size = chunk_size
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def serialize(self, actions, serializer=None):
+        '''
+        Serializes the actions that are not serialized yet in the workers,
+        if there are at least ``min_actions`` of them.
+
+        :arg serializer: Serializer of the bulk operation, that the actions
+            are encoded with unless the pool has its own serializer; it must
+            be picklable. Defaults to encoding actions like
+            :class:`JSONSerializer` does.
+        :returns: True if the actions were serialized, or False if there
+            were too few of them and they have to be serialized in process
+        '''
+
+        pending = [action for action in actions if action._op is None]
+        if len(pending) < self.min_actions:
+            return False
+
+        if self.serializer is not None:
+            serializer = self.serializer
+        with self._lock:
+            if self._pool is None:
+                self._pool = multiprocessing.Pool(self.processes)
+            pool = self._pool
+
+        bounds = [(start, min(start + self.chunk_size, len(pending)))
+                  for start in range(0, len(pending), self.chunk_size)]
+        # the pool may be shared by operations of different serializers
+        results = pool.map(_encode, [
+            (serializer, [(action.type, action._params, action._body)
+                          for action in pending[start:end]])
+            for start, end in bounds])
+
+        for (start, end), (data, lengths) in zip(bounds, results):
+            offset = 0
+            for action, length in zip(pending[start:end], lengths):
+                action._op = data[offset:offset + length].decode('utf-8')
+                offset += length
+        return True
+
+    def close(self):
+        '''
+        Stops the worker processes, if any.
+        '''
+
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.close()
+            pool.join()
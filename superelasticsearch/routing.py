@@ -0,0 +1,283 @@
+'''
+    superelasticsearch.routing
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Cached routing table of a cluster, to find the shard that Elasticsearch
+    routes a document to, and the node that holds its primary.
+'''
+
+import re
+import threading
+import time
+
+from elasticsearch.exceptions import ConnectionError
+from elasticsearch.exceptions import ConnectionTimeout
+from elasticsearch.exceptions import ImproperlyConfigured
+
+_MASK = 0xffffffff
+
+# host and port of addresses like inet[/127.0.0.1:9200], in Elasticsearch
+# 1.x, or 127.0.0.1:9200
+_ADDRESS_RE = re.compile(r'(?P<host>[^/\[\]]+):(?P<port>[0-9]+)\]?$')
+
+
+def _signed(value):
+    '''
+    Returns the 32 bit unsigned integer as a signed one, like Java's int.
+    '''
+
+    return value - (1 << 32) if value & 0x80000000 else value
+
+
+def _utf16(value):
+    '''
+    Returns the UTF-16 code units of the string, i.e. the chars of a Java
+    string, in little endian bytes.
+    '''
+
+    if isinstance(value, bytes):
+        value = value.decode('utf-8')
+    return bytearray(value.encode('utf-16-le'))
+
+
+def djb_hash(value):
+    '''
+    Returns the DJB hash of the string that Elasticsearch 1.x routes
+    documents with by default.
+    '''
+
+    data = _utf16(value)
+    hash = 5381
+    for i in range(0, len(data), 2):
+        hash = (hash * 33 + (data[i] | data[i + 1] << 8)) & _MASK
+    return _signed(hash)
+
+
+def murmur3_hash(value):
+    '''
+    Returns the 32 bit MurmurHash3 hash of the string that Elasticsearch 2.0
+    and later route documents with, and 1.x with the ``murmur3`` routing
+    hash function.
+    '''
+
+    data = _utf16(value)
+    length = len(data)
+    c1 = 0xcc9e2d51
+    c2 = 0x1b873593
+    hash = 0
+
+    def mix(k):
+        k = (k * c1) & _MASK
+        k = ((k << 15) | (k >> 17)) & _MASK
+        return (k * c2) & _MASK
+
+    rounded = length & ~3
+    for i in range(0, rounded, 4):
+        hash ^= mix(data[i] | data[i + 1] << 8 | data[i + 2] << 16 |
+                    data[i + 3] << 24)
+        hash = ((hash << 13) | (hash >> 19)) & _MASK
+        hash = (hash * 5 + 0xe6546b64) & _MASK
+
+    # code units are 2 bytes long, so the tail is 0 or 2 bytes long
+    if length & 3:
+        hash ^= mix(data[rounded] | data[rounded + 1] << 8)
+
+    hash ^= length
+    hash ^= hash >> 16
+    hash = (hash * 0x85ebca6b) & _MASK
+    hash ^= hash >> 13
+    hash = (hash * 0xc2b2ae35) & _MASK
+    hash ^= hash >> 16
+    return _signed(hash)
+
+
+def shard_number(routing, shards, hash_function='djb', es_version=1):
+    '''
+    Returns the number of the shard that Elasticsearch routes a document to,
+    given its routing value, or id when it has none, and the number of
+    shards of its index.
+
+    :arg hash_function: **djb**, the default of Elasticsearch 1.x, or
+        **murmur3**, the hash function of Elasticsearch 2.0 and later
+    :arg es_version: Major version of Elasticsearch, which changed how the
+        shard is derived from the hash in 2.0. Defaults to 1.
+    '''
+
+    if hash_function == 'djb':
+        hash = djb_hash(routing)
+    else:
+        hash = murmur3_hash(routing)
+
+    if es_version < 2:
+        # Math.abs(hash % shards) of Elasticsearch 1.x, whatever the hash
+        # function. Java's remainder has the sign of the hash, so this is
+        # the remainder of the absolute hash.
+        return abs(hash) % shards
+    # Math.floorMod(hash, shards) of Elasticsearch 2.0 and later
+    return hash % shards
+
+
+class RoutingTable(object):
+    '''
+    Routing table of a cluster, i.e. the node that holds the primary of
+    every shard of every index, and the HTTP address of every node. It is
+    fetched when first needed, and fetched again when the version of the
+    cluster state has changed, which is checked at most every
+    ``refresh_interval`` seconds, or when a node could not be reached.
+
+    .. Usage::
+    table = es.routing_table()
+    node = table.node('tweets', 'tweet', '42')
+    '''
+
+    HASH_FUNCTIONS = ('djb', 'murmur3')
+
+    def __init__(self, client, hash_function='djb', refresh_interval=30,
+                 es_version=1):
+        '''
+        :arg client: Elasticsearch client to fetch the routing table with
+        :arg hash_function: Hash function the cluster routes documents with,
+            **djb** or **murmur3**. Defaults to **djb**, the default of
+            Elasticsearch 1.x.
+        :arg refresh_interval: Number of seconds after which the version of
+            the cluster state is checked before the table is used. Defaults
+            to 30.
+        :arg es_version: Major version of Elasticsearch the cluster runs,
+            which changed how documents are routed to shards in 2.0.
+            Defaults to 1.
+        '''
+
+        if hash_function not in self.HASH_FUNCTIONS:
+            raise ImproperlyConfigured(
+                'Unknown hash function %r, expected one of: %s' % (
+                    hash_function, ', '.join(self.HASH_FUNCTIONS)))
+
+        self._client = client
+        self.hash_function = hash_function
+        self.es_version = es_version
+        self.refresh_interval = refresh_interval
+        self.version = None
+        self.refreshes = 0
+        # primary node of every shard, by index
+        self._primaries = {}
+        self._addresses = {}
+        self._clients = {}
+        self._checked = None
+        self._lock = threading.RLock()
+
+    def refresh(self):
+        '''
+        Fetches the routing table and the addresses of the nodes.
+        '''
+
+        with self._lock:
+            state = self._client.cluster.state(metric='routing_table')
+            info = self._client.nodes.info(metric='http')
+
+            primaries = {}
+            indices = state.get('routing_table', {}).get('indices', {})
+            for index, table in indices.items():
+                shards = table['shards']
+                nodes = [None] * len(shards)
+                for number, copies in shards.items():
+                    for copy in copies:
+                        if copy.get('primary') and copy.get('state') in (
+                                'STARTED', 'RELOCATING'):
+                            nodes[int(number)] = copy['node']
+                primaries[index] = nodes
+
+            addresses = {}
+            for node, node_info in info.get('nodes', {}).items():
+                match = _ADDRESS_RE.search(node_info.get('http_address', ''))
+                if match:
+                    addresses[node] = '%s:%s' % (match.group('host'),
+                                                 match.group('port'))
+
+            self._primaries = primaries
+            self._addresses = addresses
+            self.version = state.get('version')
+            self._checked = time.time()
+            self.refreshes += 1
+
+    def invalidate(self):
+        '''
+        Makes the routing table be fetched again before it is used next.
+        '''
+
+        with self._lock:
+            self._checked = None
+            self.version = None
+
+    def _check(self):
+        with self._lock:
+            if self._checked is None:
+                self.refresh()
+            elif time.time() - self._checked >= self.refresh_interval:
+                state = self._client.cluster.state(metric='version')
+                if state.get('version') != self.version:
+                    self.refresh()
+                else:
+                    self._checked = time.time()
+
+    def node(self, index, doc_type, id, routing=None):
+        '''
+        Returns the id of the node that holds the primary of the shard that
+        the document is routed to, or None if it is not known, e.g. the index
+        is an alias or doesn't exist yet, or its primary is not assigned.
+        '''
+
+        self._check()
+        nodes = self._primaries.get(index)
+        if not nodes:
+            return None
+        shard = shard_number('%s' % (id if routing is None else routing),
+                             len(nodes), self.hash_function,
+                             self.es_version)
+        node = nodes[shard]
+        return node if node in self._addresses else None
+
+    def client(self, node):
+        '''
+        Returns the client that sends requests to the node only.
+        '''
+
+        with self._lock:
+            client = self._clients.get(node)
+            if client is None:
+                client = self._clients[node] = self._client._client_like(
+                    hosts=[self._addresses[node]], sniff_on_start=False,
+                    sniff_on_connection_fail=False, sniffer_timeout=None)
+            return client
+
+    def bulk_client(self, node, fallback):
+        '''
+        Returns an object with a ``bulk`` method that sends Bulk API requests
+        to the node, or with the fallback client if it can't be reached.
+        '''
+
+        if node is None:
+            return fallback
+        return _NodeBulk(self, node, fallback)
+
+
+class _NodeBulk(object):
+
+    def __init__(self, table, node, fallback):
+        self._table = table
+        self._node = node
+        self._fallback = fallback
+
+    def bulk(self, body, **params):
+        try:
+            return self._table.client(self._node).bulk(body=body, **params)
+        except ConnectionTimeout:
+            # the node may have applied the actions, so they are only sent
+            # again if the client retries requests that timed out
+            transport = getattr(self._fallback, 'transport', None)
+            if not getattr(transport, 'retry_on_timeout', False):
+                raise
+            return self._fallback.bulk(body=body, **params)
+        except ConnectionError:
+            # the node may have left the cluster
+            self._table.invalidate()
+            return self._fallback.bulk(body=body, **params)
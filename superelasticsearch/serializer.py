@@ -0,0 +1,122 @@
+'''
+    superelasticsearch.serializer
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    JSON serializer that uses a faster JSON library, when one is installed,
+    for encoding requests and decoding responses.
+'''
+
+from json import JSONEncoder
+
+from elasticsearch.compat import string_types
+from elasticsearch.exceptions import ImproperlyConfigured
+from elasticsearch.exceptions import SerializationError
+from elasticsearch.serializer import JSONSerializer
+
+
+def _orjson_backend(default):
+    import orjson
+
+    # datetimes go through default to be encoded exactly like JSONSerializer
+    # encodes them
+    option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+    def dumps(data):
+        return orjson.dumps(data, default=default, option=option).decode(
+            'utf-8')
+
+    return dumps, orjson.loads
+
+
+def _ujson_backend(default):
+    import ujson
+
+    def dumps(data):
+        return ujson.dumps(data, default=default, ensure_ascii=False)
+
+    return dumps, ujson.loads
+
+
+def _json_backend(default):
+    import json
+
+    encoder = JSONEncoder(default=default)
+    return encoder.encode, json.loads
+
+
+class FastJSONSerializer(JSONSerializer):
+    '''
+    Drop-in replacement of :class:`elasticsearch.serializer.JSONSerializer`
+    that encodes and decodes JSON using the fastest of the supported JSON
+    libraries that is installed. Dates, datetimes and decimals are encoded
+    the same way as :class:`JSONSerializer` encodes them.
+
+    When the fast library fails to encode some data, e.g. integers that are
+    too large for it, the data is encoded using :mod:`json` instead.
+
+    .. Usage::
+    from superelasticsearch import FastJSONSerializer, SuperElasticsearch
+    es = SuperElasticsearch(hosts=['localhost:9200'],
+                            serializer=FastJSONSerializer())
+    '''
+
+    # Supported JSON libraries in the order of preference
+    BACKENDS = (
+        ('orjson', _orjson_backend),
+        ('ujson', _ujson_backend),
+        ('json', _json_backend),
+    )
+
+    def __init__(self, backend=None):
+        '''
+        :arg backend: Name of the JSON library to use, one of ``orjson``,
+            ``ujson`` or ``json``. Defaults to the first of these that is
+            installed.
+        '''
+
+        backends = dict(self.BACKENDS)
+        if backend is not None and backend not in backends:
+            raise ImproperlyConfigured('Unknown JSON backend %r, expected one '
+                                       'of: %s' % (backend, ', '.join(
+                                           name for name, _ in self.BACKENDS)))
+
+        for name, create in self.BACKENDS:
+            if backend is not None and name != backend:
+                continue
+            try:
+                self._dumps, self._loads = create(self.default)
+            except ImportError:
+                if backend is not None:
+                    raise ImproperlyConfigured('JSON backend %r is not '
+                                               'installed.' % backend)
+                continue
+            self.backend = name
+            break
+
+        self._fallback = JSONEncoder(default=self.default)
+
+    def __reduce__(self):
+        # the functions of the backend can't be pickled, e.g. to be sent to
+        # the workers of a SerializerPool, but can be created again
+        return FastJSONSerializer, (self.backend,)
+
+    def loads(self, s):
+        try:
+            return self._loads(s)
+        except (ValueError, TypeError) as e:
+            raise SerializationError(s, e)
+
+    def dumps(self, data):
+        # don't serialize strings
+        if isinstance(data, string_types):
+            return data
+
+        try:
+            return self._dumps(data)
+        except (ValueError, TypeError, OverflowError):
+            pass
+
+        try:
+            return self._fallback.encode(data)
+        except (ValueError, TypeError) as e:
+            raise SerializationError(data, e)
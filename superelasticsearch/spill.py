@@ -0,0 +1,113 @@
+'''
+    superelasticsearch.spill
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Temporary NDJSON files that bulk operations spill serialized actions to
+    when they go over their memory budget.
+'''
+
+import json
+import tempfile
+
+
+class SpillFile(object):
+    '''
+    Anonymous temporary file of serialized bulk actions in the Bulk API
+    format. The file has no name, so it is removed by the operating system
+    as soon as it is closed, including when it is garbage collected or the
+    process dies.
+    '''
+
+    def __init__(self, dir=None):
+        '''
+        :arg dir: Directory to create the file in. Defaults to the default
+            temporary directory, see :func:`tempfile.gettempdir`.
+        '''
+
+        self._file = tempfile.TemporaryFile(
+            prefix='superelasticsearch-bulk-', suffix='.ndjson', dir=dir)
+        self.actions = 0
+        self.size = 0
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    def write(self, ops):
+        '''
+        Appends serialized actions, every one terminated by a newline.
+        Actions serialized in bytes, like UTF-8 ``str`` bodies on Python 2,
+        are written as they are.
+        '''
+
+        data = b''.join([op if isinstance(op, bytes) else op.encode('utf-8')
+                         for op in ops])
+        self._file.write(data)
+        self.actions += len(ops)
+        self.size += len(data)
+
+    def body(self, chunk_size=1024 * 1024):
+        '''
+        Returns file-like body of a Bulk API request, that is read from the
+        start of the file in chunks.
+        '''
+
+        self._file.flush()
+        self._file.seek(0)
+        return _StreamedBody(self._file, self.size, chunk_size)
+
+    def read_ops(self, has_body, batch_size=1000):
+        '''
+        Reads the serialized actions back in lists of at most ``batch_size``
+        tuples of their type and lines.
+
+        :arg has_body: Function that returns whether actions of a type have
+            a body line
+        '''
+
+        self._file.flush()
+        self._file.seek(0)
+        lines = iter(self._file)
+        batch = []
+        for line in lines:
+            op = line.decode('utf-8')
+            type = next(iter(json.loads(op)))
+            if has_body(type):
+                op += next(lines).decode('utf-8')
+            batch.append((type, op))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def close(self):
+        '''
+        Closes, and so removes, the file.
+        '''
+
+        self._file.close()
+
+
+class _StreamedBody(object):
+    '''
+    Body of a request that the HTTP client reads in chunks, with a length,
+    so that Python 2 sends its Content-Length, and which is logged as a
+    placeholder instead of its content.
+    '''
+
+    def __init__(self, file, size, chunk_size):
+        self._file = file
+        self._size = size
+        self._chunk_size = chunk_size
+
+    def __len__(self):
+        return self._size
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self._chunk_size
+        return self._file.read(min(size, self._chunk_size))
+
+    def decode(self, encoding='utf-8'):
+        return '<%d bytes streamed from a spill file>' % self._size
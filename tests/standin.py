@@ -0,0 +1,163 @@
+'''
+    Local HTTP server standing in for an Elasticsearch node, for the tests
+    of both the synchronous and the asyncio clients.
+'''
+
+import json
+import threading
+import time
+
+from superelasticsearch.compression import compress, decompress
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlparse
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlparse
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = dict((name, values[0])
+                      for name, values in parse_qs(url.query).items())
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            body = self.read_chunked()
+        else:
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length) if length else b''
+        encoding = self.headers.get('Content-Encoding')
+        if encoding:
+            body = decompress(body, encoding)
+
+        status, resp = self.server.respond(self.command, url.path, params,
+                                           body.decode('utf-8'))
+        data = json.dumps(resp).encode('utf-8')
+        # like Elasticsearch with http.compression enabled
+        accepted = self.headers.get('Accept-Encoding') or ''
+        response_encoding = None
+        if self.server.compression and 'gzip' in accepted:
+            response_encoding = 'gzip'
+            data = compress(data, 'gzip')
+        with self.server.lock:
+            self.server.encodings.append(
+                (url.path, encoding, response_encoding))
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        if response_encoding:
+            self.send_header('Content-Encoding', response_encoding)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_POST = do_DELETE = do_PUT = do_GET
+
+    def read_chunked(self):
+        chunks = []
+        while True:
+            size = int(self.rfile.readline().split(b';')[0], 16)
+            if not size:
+                # the empty trailer
+                self.rfile.readline()
+                return b''.join(chunks)
+            chunks.append(self.rfile.read(size))
+            self.rfile.readline()
+
+
+class StandInElasticsearch(ThreadingMixIn, HTTPServer):
+    '''
+    Local HTTP server standing in for an Elasticsearch node. Serves scrolled
+    searches over ``docs`` and Bulk API requests, and records every request.
+    Compressed requests are decompressed, and responses are compressed when
+    asked for if ``compression`` is True.
+    '''
+
+    daemon_threads = True
+
+    def __init__(self, docs=(), total=None, bulk_latency=0,
+                 compression=False):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StandInHandler)
+        self.docs = list(docs)
+        self.total = total
+        self.bulk_latency = bulk_latency
+        self.compression = compression
+        self.requests = []
+        # content encodings of every request and its response
+        self.encodings = []
+        self.cleared_scrolls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    @property
+    def host(self):
+        return '%s:%s' % self.server_address
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def page(self, offset, size):
+        return {
+            '_scroll_id': '%s-%s' % (offset + size, size),
+            'took': 1,
+            'hits': {
+                'total': (len(self.docs) if self.total is None
+                          else self.total),
+                'max_score': None,
+                'hits': self.docs[offset:offset + size],
+            },
+        }
+
+    def respond(self, method, path, params, body):
+        parts = [part for part in path.split('/') if part]
+        with self.lock:
+            self.requests.append((method, path, params, body))
+
+        if parts[:2] == ['_search', 'scroll']:
+            # the scroll id is sent in the path or in the body
+            scroll_id = parts[2] if len(parts) > 2 else body
+            if method == 'DELETE':
+                self.cleared_scrolls.append(scroll_id)
+                return 200, {}
+            offset, size = [int(part) for part in scroll_id.split('-')]
+            return 200, self.page(offset, size)
+        if parts[-1] == '_search':
+            return 200, self.page(0, int(params.get('size', 10)))
+        if parts[-1] == '_bulk':
+            return 200, self.bulk(body)
+        return 404, {'error': 'IndexMissingException[no such index]'}
+
+    def bulk(self, body):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.bulk_latency)
+
+        items = []
+        lines = iter(body.splitlines())
+        for line in lines:
+            action = json.loads(line)
+            op_type = list(action.keys())[0]
+            if op_type != 'delete':
+                next(lines)
+            items.append({op_type: dict(action[op_type], status=200)})
+
+        with self.lock:
+            self.in_flight -= 1
+        return dict(took=1, errors=False, items=items)
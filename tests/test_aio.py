@@ -0,0 +1,123 @@
+from elasticsearch import ElasticsearchException
+from mock import patch
+
+from superelasticsearch import _BulkAction
+from tests.standin import StandInElasticsearch
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+try:
+    import asyncio
+    from superelasticsearch.aio import AsyncSuperElasticsearch
+except (ImportError, SyntaxError):
+    # asyncio client needs Python 3.6+
+    AsyncSuperElasticsearch = None
+
+
+@unittest.skipIf(AsyncSuperElasticsearch is None, 'needs Python 3.6+')
+class TestAsyncSuperElasticsearch(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StandInElasticsearch(
+            docs=[dict(_id=str(i), _source=dict(count=i))
+                  for i in range(25)],
+            bulk_latency=0.02).start()
+        self.loop = asyncio.new_event_loop()
+        self.es = AsyncSuperElasticsearch(hosts=[self.server.host])
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.es.close())
+        self.loop.close()
+        self.server.stop()
+
+    def collect(self, generator):
+        results = []
+        while True:
+            try:
+                results.append(
+                    self.loop.run_until_complete(generator.__anext__()))
+            except StopAsyncIteration:
+                return results
+
+    def test_async_itersearch_returns_all_docs(self):
+        docs = self.collect(self.es.itersearch(
+            index='test', scroll='1m', size=10, chunked=False))
+
+        self.assertEquals([doc['_id'] for doc in docs],
+                          [str(i) for i in range(25)])
+        self.assertEquals(self.server.cleared_scrolls, ['30-10'])
+
+    def test_chunked_async_itersearch_with_meta_returns_meta(self):
+        pages = self.collect(self.es.itersearch(
+            index='test', scroll='1m', size=10, with_meta=True))
+
+        self.assertEquals([len(docs) for docs, meta in pages], [10, 10, 5])
+        for docs, meta in pages:
+            self.assertEquals(meta['hits']['total'], 25)
+            self.assertTrue('hits' not in meta['hits'])
+
+    def test_async_itersearch_raises_when_less_docs_fetched(self):
+        self.server.total = 30
+        generator = self.es.itersearch(index='test', scroll='1m', size=10)
+
+        self.assertRaises(ElasticsearchException, self.collect, generator)
+        self.assertEquals(len(self.server.cleared_scrolls), 1)
+
+    def test_async_bulk_operation_executes_actions(self):
+        bulk = self.es.bulk_operation(index='test', doc_type='docs')
+        bulk.index(id=1, body=dict(key1='val1'))
+        bulk.delete(id=2)
+
+        resp = self.loop.run_until_complete(bulk.execute())
+
+        self.assertEquals(len(resp['items']), 2)
+        self.assertEquals(len(bulk._actions), 0)
+        method, path, params, body = self.server.requests[-1]
+        self.assertEquals((method, path), ('POST', '/test/docs/_bulk'))
+        self.assertEquals(body, bulk._bulk_body([
+            _BulkAction('index', params=dict(_id=1), body=dict(key1='val1')),
+            _BulkAction('delete', params=dict(_id=2))]))
+
+    def test_async_bulk_operation_decodes_escaped_params(self):
+        # elasticsearch-py encodes query parameters to bytes on Python 3
+        def escape(value):
+            return ('%s' % value).encode('utf-8')
+
+        with patch('elasticsearch.client.utils._escape', escape):
+            bulk = self.es.bulk_operation(index='test', doc_type='docs')
+            bulk.index(id=1, routing='a', body=dict(key1='val1'))
+            bulk.delete(index='other', id=2)
+            resp = self.loop.run_until_complete(bulk.execute())
+
+        self.assertEquals(len(resp['items']), 2)
+        method, path, params, body = self.server.requests[-1]
+        self.assertEquals(path, '/test/docs/_bulk')
+        self.assertEquals(body, bulk._bulk_body([
+            _BulkAction('index', params=dict(_id=1, routing='a'),
+                        body=dict(key1='val1')),
+            _BulkAction('delete', params=dict(_index='other', _id=2))]))
+
+    def test_async_bulk_operation_rejects_unsupported_arguments(self):
+        for name in ('max_actions', 'max_bytes', 'memory_budget'):
+            self.assertRaises(TypeError, self.es.bulk_operation,
+                              index='test', **{name: 10})
+
+    def test_async_bulk_operation_rejects_synchronous_execution(self):
+        bulk = self.es.bulk_operation(index='test', doc_type='docs')
+        bulk.delete(id=1)
+        self.assertRaises(TypeError, bulk.execute_parallel)
+        self.assertRaises(TypeError, bulk.execute_with_retry)
+        self.assertEquals(len(bulk._actions), 1)
+
+    def test_async_bulk_operation_sends_requests_concurrently(self):
+        bulk = self.es.bulk_operation(index='test', doc_type='docs')
+        for i in range(40):
+            bulk.delete(id=i)
+
+        resp = self.loop.run_until_complete(
+            bulk.execute_concurrent(max_in_flight=4, chunk_size=5))
+
+        self.assertEquals([item['delete']['_id'] for item in resp['items']],
+                          list(range(40)))
+        self.assertTrue(1 < self.server.max_in_flight <= 4)
@@ -1,18 +1,40 @@
 import functools
+import gc
 import json
 import logging
 import os
+import pickle
+import shutil
+import tempfile
+import threading
 import time
+import weakref
 
 from copy import deepcopy
 from datadiff.tools import assert_equal as assertDictEquals
+from datetime import date, datetime
+from decimal import Decimal
 from elasticsearch import Elasticsearch, ElasticsearchException, TransportError
-from mock import Mock
+from elasticsearch.exceptions import ConnectionError, ConnectionTimeout
+from elasticsearch.exceptions import ImproperlyConfigured
+from elasticsearch.serializer import JSONSerializer
+from mock import Mock, patch
 from random import randint
 
 from superelasticsearch import SuperElasticsearch
 from superelasticsearch import BulkOperation
 from superelasticsearch import _BulkAction
+from superelasticsearch import _byte_size
+from superelasticsearch import FastJSONSerializer
+from superelasticsearch import SerializerPool
+from superelasticsearch import SearchCache
+from superelasticsearch import CallbackSink, HistogramSink, Metrics
+from superelasticsearch import AdaptiveBatchSize
+from superelasticsearch.columnar import numpy
+from superelasticsearch.compression import compress, decompress
+from superelasticsearch.compression import CompressedHttpConnection
+from superelasticsearch.routing import djb_hash, murmur3_hash, shard_number
+from tests.standin import StandInElasticsearch
 try:
     import unittest2 as unittest
 except ImportError:
@@ -25,6 +47,57 @@ elasticsearch_logger.setLevel(logging.ERROR)
 local_path = lambda x: os.path.join(os.path.dirname(__file__), x)
 
 
+class CompactSerializer(JSONSerializer):
+    '''
+    Serializer that encodes JSON without spaces, which worker processes can
+    unpickle.
+    '''
+
+    def dumps(self, data):
+        return json.dumps(data, separators=(',', ':'), default=self.default)
+
+
+def mock_scroll(client, shard_pages, total=None):
+    '''
+    Mocks search, scroll and clear_scroll methods of the client so that the
+    scroll of every shard returns given pages of hits followed by an empty
+    page. ``shard_pages`` maps shard numbers to lists of pages. A search
+    without a shard preference scrolls over the pages of shard 0. Like in
+    Elasticsearch, the search of a scan returns no hits.
+    '''
+
+    def response(shard, page, scroll_total):
+        pages = shard_pages[shard]
+        hits = pages[page] if 0 <= page < len(pages) else []
+        return {
+            '_scroll_id': '%s:%s' % (shard, page),
+            '_shards': dict(total=1, successful=1, failed=0),
+            'hits': dict(total=scroll_total, max_score=None, hits=hits),
+        }
+
+    def search(**kwargs):
+        shard = int(kwargs.get('preference', '_shards:0').split(':')[1])
+        scroll_total = total
+        if scroll_total is None:
+            scroll_total = sum(len(page) for page in shard_pages[shard])
+        totals[shard] = scroll_total
+        if kwargs.get('search_type') == 'scan':
+            return response(shard, -1, scroll_total)
+        return response(shard, 0, scroll_total)
+
+    def scroll(scroll_id, **kwargs):
+        shard, page = [int(part) for part in scroll_id.split(':')]
+        return response(shard, page + 1, totals[shard])
+
+    totals = {}
+    client.search_shards = Mock(return_value=dict(
+        shards=[[dict(shard=shard, index='test')]
+                for shard in shard_pages]))
+    client.search = Mock(side_effect=search)
+    client.scroll = Mock(side_effect=scroll)
+    client.clear_scroll = Mock()
+
+
 class TestItersearch(unittest.TestCase):
 
     # create a common Elasticsearch object
@@ -194,6 +267,818 @@ class TestItersearch(unittest.TestCase):
         cls.es.indices.delete(index=cls._index)
 
 
+class TestParallelItersearch(unittest.TestCase):
+
+    def setUp(self):
+        self.ss = SuperElasticsearch(hosts=['localhost:9200'])
+        self.shard_pages = {
+            0: [[dict(_id='0-%s' % i) for i in range(10)],
+                [dict(_id='0-%s' % i) for i in range(10, 15)]],
+            1: [[dict(_id='1-%s' % i) for i in range(10)]],
+            2: [],
+        }
+        mock_scroll(self.ss, self.shard_pages)
+
+    def test_parallel_itersearch_scrolls_every_shard(self):
+        ids = [doc['_id'] for doc in self.ss.itersearch(
+            index='test', scroll='1m', chunked=False, parallel=2)]
+
+        self.assertEquals(len(ids), 25)
+        self.assertEquals(set(ids), set(
+            doc['_id'] for pages in self.shard_pages.values()
+            for page in pages for doc in page))
+        preferences = sorted(call[1]['preference']
+                             for call in self.ss.search.call_args_list)
+        self.assertEquals(preferences,
+                          ['_shards:0', '_shards:1', '_shards:2'])
+        self.assertEquals(self.ss.clear_scroll.call_count, 3)
+
+    def test_chunked_parallel_itersearch_with_meta_returns_pages(self):
+        pages = list(self.ss.itersearch(index='test', scroll='1m',
+                                        with_meta=True, parallel=3))
+
+        self.assertEquals(sorted(len(docs) for docs, meta in pages),
+                          [5, 10, 10])
+        for docs, meta in pages:
+            self.assertTrue('hits' not in meta['hits'])
+
+    def test_parallel_itersearch_raises_when_a_shard_misses_docs(self):
+        mock_scroll(self.ss, self.shard_pages, total=12)
+        generator = self.ss.itersearch(index='test', scroll='1m',
+                                       parallel=2)
+        self.assertRaises(ElasticsearchException, list, generator)
+
+    def test_parallel_itersearch_does_not_accept_preference(self):
+        generator = self.ss.itersearch(index='test', scroll='1m',
+                                       parallel=2, preference='_local')
+        self.assertRaises(ValueError, list, generator)
+
+
+class TestPrefetchedItersearch(unittest.TestCase):
+
+    def setUp(self):
+        self.ss = SuperElasticsearch(hosts=['localhost:9200'])
+        mock_scroll(self.ss, {
+            0: [[dict(_id='%s-%s' % (page, i)) for i in range(10)]
+                for page in range(5)],
+        })
+
+    def test_prefetched_itersearch_returns_all_docs_in_order(self):
+        ids = [doc['_id'] for doc in self.ss.itersearch(
+            scroll='1m', chunked=False, prefetch=2)]
+
+        self.assertEquals(ids, ['%s-%s' % (page, i) for page in range(5)
+                                for i in range(10)])
+        self.assertEquals(self.ss.clear_scroll.call_count, 1)
+
+    def test_prefetched_itersearch_fetches_next_page_in_background(self):
+        generator = self.ss.itersearch(scroll='1m', prefetch=1)
+        next(generator)
+
+        # the next page is fetched while the first one is being consumed
+        for _ in range(50):
+            if self.ss.scroll.called:
+                break
+            time.sleep(0.01)
+        self.assertTrue(self.ss.scroll.called)
+        generator.close()
+
+    def test_prefetched_itersearch_clears_scroll_and_raises(self):
+        mock_scroll(self.ss, {0: [[dict(_id=1)] * 10, [dict(_id=2)] * 2]},
+                    total=13)
+        generator = self.ss.itersearch(scroll='1m', prefetch=2)
+
+        self.assertRaises(ElasticsearchException, list, generator)
+        self.ss.clear_scroll.assert_called_once_with(scroll_id='0:1')
+
+
+class TestScanItersearch(unittest.TestCase):
+
+    def setUp(self):
+        self.ss = SuperElasticsearch(hosts=['localhost:9200'])
+        mock_scroll(self.ss, {
+            0: [[dict(_id='%s-%s' % (page, i)) for i in range(10)]
+                for page in range(3)],
+        })
+        self.ss.search_shards = Mock(return_value=dict(
+            shards=[[dict(shard=shard, index='test')] for shard in range(4)]))
+
+    def test_scan_itersearch_scrolls_past_first_empty_page(self):
+        docs = list(self.ss.itersearch(index='test', scroll='1m', scan=True,
+                                       chunked=False))
+
+        self.assertEquals(len(docs), 30)
+        self.assertEquals(self.ss.search.call_args[1]['search_type'], 'scan')
+        self.assertEquals(self.ss.scroll.call_args_list[0][1]['scroll_id'],
+                          '0:-1')
+        self.ss.clear_scroll.assert_called_once_with(scroll_id='0:2')
+
+    def test_scan_itersearch_divides_size_among_shards(self):
+        list(self.ss.itersearch(index='test', scroll='1m', scan=True,
+                                size=10))
+        self.assertEquals(self.ss.search.call_args[1]['size'], 3)
+
+        list(self.ss.itersearch(index='test', scroll='1m', scan=True,
+                                size=2))
+        self.assertEquals(self.ss.search.call_args[1]['size'], 1)
+
+    def test_scan_itersearch_raises_when_less_docs_fetched(self):
+        mock_scroll(self.ss, {0: [[dict(_id=1)] * 10]}, total=11)
+        generator = self.ss.itersearch(index='test', scroll='1m', scan=True)
+
+        self.assertRaises(ElasticsearchException, list, generator)
+
+
+class TestItersort(unittest.TestCase):
+
+    def setUp(self):
+        self.ss = SuperElasticsearch(hosts=['localhost:9200'])
+        # few distinct values, so that pages end in ties
+        self.docs = [dict(_type='docs', _id=str(i), _source=dict(value=i // 4))
+                     for i in range(23)]
+        # matching documents that the filters can't reach
+        self.missing = 0
+        # pages are searched past the search cache of the client
+        patcher = patch.object(Elasticsearch, 'search',
+                               side_effect=self.search)
+        self.es_search = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def search(self, body, size=10, **kwargs):
+        '''
+        Applies range and ids filters of the query to the documents, like
+        Elasticsearch does.
+        '''
+
+        field, order = list(body['sort'][0].items())[0]
+        docs = self.docs
+        query = body['query']
+        if 'filtered' in query:
+            filters = query['filtered']['filter']['bool']
+            bound = filters['must'][0]['range'][field]
+            if 'gte' in bound:
+                docs = [doc for doc in docs
+                        if doc['_source'][field] >= bound['gte']]
+            else:
+                docs = [doc for doc in docs
+                        if doc['_source'][field] <= bound['lte']]
+            for ids_filter in filters['must_not']:
+                ids = ids_filter['ids']
+                docs = [doc for doc in docs
+                        if doc['_type'] != ids['type'] or
+                        doc['_id'] not in ids['values']]
+        docs = sorted(docs, key=lambda doc: doc['_source'][field],
+                      reverse=order == 'desc')[:size]
+        return dict(hits=dict(total=len(self.docs) + self.missing, hits=[
+            dict(doc, sort=[doc['_source'][field]]) for doc in docs]))
+
+    def test_itersort_returns_every_doc_once_in_order(self):
+        docs = list(self.ss.itersort('value', index='test', size=5,
+                                     chunked=False))
+
+        self.assertEquals(sorted(doc['_id'] for doc in docs),
+                          sorted(doc['_id'] for doc in self.docs))
+        values = [doc['sort'][0] for doc in docs]
+        self.assertEquals(values, sorted(values))
+        self.assertFalse('scroll' in self.es_search.call_args[1])
+
+    def test_itersort_pages_in_descending_order_with_meta(self):
+        pages = list(self.ss.itersort('value', order='desc', size=3,
+                                      with_meta=True))
+
+        values = [doc['sort'][0] for docs, meta in pages for doc in docs]
+        self.assertEquals(len(values), 23)
+        self.assertEquals(values, sorted(values, reverse=True))
+        self.assertEquals(pages[0][1]['hits']['total'], 23)
+
+    def test_itersort_pages_are_not_cached(self):
+        ss = SuperElasticsearch(hosts=['localhost:9200'],
+                                search_cache=SearchCache())
+        list(ss.itersort('value', size=5))
+        list(ss.itersort('value', size=5))
+
+        self.assertEquals(len(ss.search_cache), 0)
+        self.assertEquals(self.es_search.call_count, 12)
+
+    def test_itersort_raises_when_less_docs_fetched(self):
+        self.missing = 1
+        generator = self.ss.itersort('value', size=5)
+
+        self.assertRaises(ElasticsearchException, list, generator)
+
+    def test_itersort_takes_checkpoints_after_consumed_pages(self):
+        checkpoints = []
+        generator = self.ss.itersort('value', size=5, checkpoint_every=2,
+                                     checkpoint=checkpoints.append)
+        next(generator)
+        next(generator)
+        self.assertEquals(checkpoints, [])
+        next(generator)
+        self.assertEquals(len(checkpoints), 1)
+        list(generator)
+
+        self.assertEquals([c['counter'] for c in checkpoints], [10, 20])
+        self.assertEquals(checkpoints[0]['last'], 2)
+        self.assertEquals(checkpoints[0]['tied'], [('docs', '8'),
+                                                   ('docs', '9')])
+        self.assertEquals(checkpoints[0]['total'], 23)
+
+    def test_itersort_resumes_from_checkpoint_file(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'itersort.checkpoint')
+
+        generator = self.ss.itersort('value', size=5, chunked=False,
+                                     checkpoint=path, resume=path)
+        docs = [next(generator) for _ in range(12)]
+        generator.close()
+        # the last checkpoint is of the second page
+        docs = docs[:10]
+        docs.extend(self.ss.itersort('value', size=5, chunked=False,
+                                     checkpoint=path, resume=path))
+
+        self.assertEquals([doc['_id'] for doc in docs],
+                          [doc['_id'] for doc in self.docs])
+        # a finished iteration starts again from the beginning
+        self.assertFalse(os.path.exists(path))
+        self.assertEquals(len(list(self.ss.itersort(
+            'value', size=5, chunked=False, checkpoint=path,
+            resume=path))), 23)
+
+    def test_itersort_counts_resumed_docs(self):
+        checkpoints = []
+        list(self.ss.itersort('value', size=5,
+                              checkpoint=checkpoints.append))
+        self.assertEquals(len(list(self.ss.itersort(
+            'value', size=5, chunked=False, resume=checkpoints[0]))), 18)
+
+        # the documents returned before the checkpoint are counted too
+        checkpoints[0]['counter'] -= 1
+        self.assertRaises(ElasticsearchException, list,
+                          self.ss.itersort('value', size=5,
+                                           resume=checkpoints[0]))
+
+
+class TestItercolumns(unittest.TestCase):
+
+    def setUp(self):
+        self.ss = SuperElasticsearch(hosts=['localhost:9200'])
+        pages = [[dict(_id=str(page * 3 + i), _source=dict(
+            price=page * 3 + i, name=u'doc', user=dict(age=20 + i)))
+            for i in range(3)] for page in range(2)]
+        # missing, null and non-object values
+        pages[0][1]['_source'].pop('price')
+        pages[1][0]['_source']['price'] = None
+        pages[1][2]['_source']['user'] = 'anonymous'
+        mock_scroll(self.ss, {0: pages})
+
+    def test_itercolumns_returns_lists_per_page(self):
+        pages = list(self.ss.itercolumns('1m', ['_id', 'price', 'user.age'],
+                                         arrays=False))
+
+        self.assertEquals(pages, [
+            {'_id': ['0', '1', '2'], 'price': [0, None, 2],
+             'user.age': [20, 21, 22]},
+            {'_id': ['3', '4', '5'], 'price': [None, 4, 5],
+             'user.age': [20, 21, None]},
+        ])
+        self.assertEquals(self.ss.search.call_args[1]['_source_include'],
+                          ['price', 'user.age'])
+
+    @unittest.skipIf(numpy is None, 'NumPy is not installed')
+    def test_itercolumns_returns_masked_arrays(self):
+        pages = list(self.ss.itercolumns('1m', ['price', 'name', 'user']))
+
+        price = pages[0]['price']
+        self.assertEquals(price.dtype.kind, 'i')
+        self.assertEquals(list(price.mask), [False, True, False])
+        self.assertEquals(price.sum(), 2)
+        self.assertEquals(pages[0]['name'].dtype.kind, 'U')
+        # objects stay objects
+        self.assertEquals(pages[1]['user'].dtype, object)
+        self.assertEquals(pages[1]['user'][2], 'anonymous')
+
+    @unittest.skipIf(numpy is None, 'NumPy is not installed')
+    def test_itercolumns_concatenates_pages(self):
+        pages = list(self.ss.itercolumns('1m', ['price'], concatenate=True,
+                                         dtypes=dict(price='float32')))
+
+        self.assertEquals(len(pages), 1)
+        price = pages[0]['price']
+        self.assertEquals(price.dtype, numpy.float32)
+        self.assertEquals(list(price.mask),
+                          [False, True, False, True, False, False])
+        self.assertEquals(price.sum(), 11)
+
+    @unittest.skipIf(numpy is not None, 'NumPy is installed')
+    def test_itercolumns_requires_numpy_for_arrays(self):
+        self.assertRaises(ImproperlyConfigured, list,
+                          self.ss.itercolumns('1m', ['price']))
+
+
+class TestReindex(unittest.TestCase):
+
+    def setUp(self):
+        docs = [dict(_index='source', _type='docs', _id=str(i),
+                     _source=dict(value=i)) for i in range(25)]
+        self.source = StandInElasticsearch(docs).start()
+        self.target = StandInElasticsearch(bulk_latency=0.1).start()
+        self.addCleanup(self.source.stop)
+        self.addCleanup(self.target.stop)
+        self.ss = SuperElasticsearch(hosts=[self.source.host])
+
+    def written(self, server):
+        docs = {}
+        for method, path, params, body in server.requests:
+            self.assertEquals(path, '/target/_bulk')
+            lines = [json.loads(line) for line in body.splitlines()]
+            for action, source in zip(lines[::2], lines[1::2]):
+                docs[action['index']['_id']] = source
+        return docs
+
+    def test_reindex_transforms_and_writes_to_other_cluster(self):
+        def transform(hit):
+            if hit['_source']['value'] % 5 == 0:
+                return None
+            hit['_source']['value'] *= 10
+            return hit
+
+        stats = self.ss.reindex('source', 'target', transform, scan=False,
+                                size=4, writers=3, chunk_size=3,
+                                target_hosts=[self.target.host])
+
+        docs = self.written(self.target)
+        self.assertEquals(sorted(docs, key=int),
+                          [str(i) for i in range(25) if i % 5])
+        self.assertEquals(docs['7'], dict(value=70))
+        self.assertEquals(stats['read'], 25)
+        self.assertEquals(stats['skipped'], 5)
+        self.assertEquals(stats['written'], 20)
+        self.assertEquals(stats['failed'], 0)
+        self.assertEquals(stats['requests'], 7)
+        self.assertTrue(stats['rate'] > 0)
+        self.assertTrue(1 < self.target.max_in_flight <= 3)
+        # the source cluster is only read from
+        self.assertFalse([request for request in self.source.requests
+                          if request[1].endswith('_bulk')])
+
+    def test_reindex_invalidates_cached_searches_on_target(self):
+        ss = SuperElasticsearch(hosts=[self.source.host],
+                                search_cache=SearchCache())
+        ss.search(index='target')
+        ss.search(index='source')
+        ss.reindex('source', 'target', scan=False, chunk_size=10)
+        ss.search(index='target')
+        ss.search(index='source')
+
+        searched = [request[1] for request in self.source.requests
+                    if request[1].endswith('/_search')]
+        self.assertEquals(searched, ['/target/_search', '/source/_search',
+                                     '/source/_search', '/target/_search'])
+
+    def test_reindex_raises_errors_of_writers(self):
+        client = Elasticsearch(hosts=[self.target.host])
+        client.bulk = Mock(side_effect=TransportError(400, 'error'))
+        target = Mock()
+        target._bulk_clients = Mock(return_value=[client, client])
+
+        self.assertRaises(TransportError, self.ss.reindex, 'source',
+                          'target', scan=False, target_client=target)
+
+    def test_reindex_does_not_accept_two_targets(self):
+        self.assertRaises(ValueError, self.ss.reindex, 'source', 'target',
+                          target_client=self.ss,
+                          target_hosts=[self.target.host])
+
+
+class TestBatchedSearch(unittest.TestCase):
+
+    def setUp(self):
+        self.ss = SuperElasticsearch(hosts=['localhost:9200'])
+        self.batches = []
+
+        def msearch(body):
+            self.batches.append(body)
+            responses = []
+            for header, search in zip(body[::2], body[1::2]):
+                if header.get('index') == 'missing':
+                    responses.append(dict(error='IndexMissingException'))
+                else:
+                    responses.append(dict(hits=dict(
+                        total=1, hits=[dict(_id=search['query'])])))
+            return dict(responses=responses)
+
+        self.ss.msearch = Mock(side_effect=msearch)
+
+    def search_concurrently(self, batcher, count, index='test'):
+        results = [None] * count
+
+        def search(i):
+            try:
+                results[i] = batcher.search(index=index, body=dict(query=i))
+            except Exception as err:
+                results[i] = err
+
+        threads = [threading.Thread(target=search, args=(i,))
+                   for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_batched_search_coalesces_concurrent_searches(self):
+        with self.ss.batched_search(window=0.2) as batcher:
+            results = self.search_concurrently(batcher, 10)
+
+        self.assertEquals(len(self.batches), 1)
+        self.assertEquals(self.batches[0][0], dict(index='test'))
+        self.assertEquals([resp['hits']['hits'][0]['_id']
+                           for resp in results], list(range(10)))
+
+    def test_batched_search_limits_batch_size(self):
+        with self.ss.batched_search(window=0.2, max_batch_size=4) as batcher:
+            futures = [batcher.submit(index='test', body=dict(query=i))
+                       for i in range(10)]
+            results = [future.result(timeout=1) for future in futures]
+
+        self.assertEquals([len(batch) // 2 for batch in self.batches],
+                          [4, 4, 2])
+        self.assertEquals([resp['hits']['hits'][0]['_id']
+                           for resp in results], list(range(10)))
+
+    def test_batched_search_keeps_errors_per_search(self):
+        with self.ss.batched_search(window=0.2) as batcher:
+            failed = batcher.submit(index='missing', body=dict(query=0))
+            succeeded = batcher.submit(index='test', doc_type='docs',
+                                       routing='1', body=dict(query=1))
+
+            self.assertRaises(TransportError, failed.result)
+            self.assertEquals(failed.exception().error,
+                              'IndexMissingException')
+            self.assertEquals(succeeded.result()['hits']['total'], 1)
+            self.assertEquals(succeeded.exception(), None)
+        self.assertEquals(self.batches[0][2],
+                          dict(index='test', type='docs', routing='1'))
+
+    def test_batched_search_fails_every_search_of_failed_batch(self):
+        self.ss.msearch.side_effect = TransportError(503, 'unavailable')
+        with self.ss.batched_search(window=0.2) as batcher:
+            results = self.search_concurrently(batcher, 3)
+
+        self.assertTrue(all(isinstance(result, TransportError)
+                            for result in results))
+
+    def test_closed_batched_search_sends_waiting_searches(self):
+        batcher = self.ss.batched_search(window=10)
+        future = batcher.submit(index='test', body=dict(query=1))
+        batcher.close()
+
+        self.assertTrue(future.done())
+        self.assertRaises(ElasticsearchException, batcher.submit,
+                          index='test')
+
+
+class TestDocumentLoader(unittest.TestCase):
+
+    def setUp(self):
+        self.ss = SuperElasticsearch(hosts=['localhost:9200'])
+        self.version = 1
+
+        def mget(body, index=None, doc_type=None, **kwargs):
+            return dict(docs=[
+                dict(_index=index, _type=doc_type or 'docs', _id=doc_id,
+                     found=doc_id != 'missing',
+                     _source=dict(id=doc_id, version=self.version))
+                for doc_id in body['ids']])
+
+        self.ss.mget = Mock(side_effect=mget)
+        self.ss.bulk = Mock(return_value=dict(took=1, errors=False,
+                                              items=[]))
+
+    def requested(self):
+        return [(kwargs['index'], kwargs['doc_type'], kwargs['body']['ids'])
+                for args, kwargs in self.ss.mget.call_args_list]
+
+    def test_get_many_dedupes_groups_and_chunks_ids(self):
+        docs = self.ss.get_many([1, 2, '1', ('other', 'docs', 1), 3, 4,
+                                 'missing'], index='test', chunk_size=3)
+
+        self.assertEquals(self.requested(), [
+            ('test', None, ['1', '2', '3']),
+            ('test', None, ['4', 'missing']),
+            ('other', 'docs', ['1']),
+        ])
+        self.assertEquals([doc and doc['_source']['id'] for doc in docs],
+                          ['1', '2', '1', '1', '3', '4', None])
+        self.assertEquals(docs[3]['_index'], 'other')
+
+    def test_loader_caches_docs_and_missing_docs(self):
+        loader = self.ss.loader(index='test', doc_type='docs',
+                                cache_size=10)
+        loader.get_many([1, 'missing'])
+        docs = loader.get_many([1, 2, 'missing'])
+
+        self.assertEquals(self.requested(), [
+            ('test', 'docs', ['1', 'missing']),
+            ('test', 'docs', ['2']),
+        ])
+        self.assertEquals(docs[0]['_source']['id'], '1')
+        self.assertEquals(docs[2], None)
+
+    def test_loader_evicts_least_recently_used_and_expired_docs(self):
+        loader = self.ss.loader(index='test', cache_size=2, ttl=0.05)
+        loader.get_many([1, 2])
+        loader.get(1)
+        loader.get(3)
+        self.assertEquals(self.ss.mget.call_count, 2)
+        loader.get(2)
+        self.assertEquals(self.ss.mget.call_count, 3)
+
+        time.sleep(0.1)
+        loader.get(3)
+        self.assertEquals(self.ss.mget.call_count, 4)
+
+    def test_loader_forgets_docs_written_by_bulk_operations(self):
+        loader = self.ss.loader(index='test', doc_type='docs',
+                                cache_size=10)
+        loader.get_many([1, 2, 3])
+
+        self.version = 2
+        bulk = self.ss.bulk_operation(index='test', doc_type='docs')
+        bulk.index(id=1, body=dict(version=2))
+        bulk.delete(id=2)
+        bulk.index(index='other', id=3, body=dict(version=2))
+        bulk.execute()
+
+        docs = loader.get_many([1, 2, 3])
+        self.assertEquals([doc['_source']['version'] for doc in docs],
+                          [2, 2, 1])
+        self.assertEquals(self.requested()[-1], ('test', 'docs', ['1', '2']))
+
+    def test_loader_does_not_cache_docs_written_while_fetched(self):
+        loader = self.ss.loader(index='test', doc_type='docs',
+                                cache_size=10)
+        mget = self.ss.mget.side_effect
+
+        def write_while_fetching(**kwargs):
+            resp = mget(**kwargs)
+            bulk = self.ss.bulk_operation(index='test', doc_type='docs')
+            bulk.delete(id=1)
+            bulk.execute()
+            return resp
+
+        self.ss.mget.side_effect = write_while_fetching
+        loader.get(1)
+        self.ss.mget.side_effect = mget
+        loader.get(1)
+
+        self.assertEquals(self.ss.mget.call_count, 2)
+
+
+class TestSearchCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = SearchCache(max_size=3)
+        self.ss = SuperElasticsearch(hosts=['localhost:9200'],
+                                     search_cache=self.cache)
+        self.ss.bulk = Mock(return_value=dict(took=1, errors=False,
+                                              items=[]))
+
+        # responses tell how many searches were sent
+        patcher = patch.object(Elasticsearch, 'search', Mock(
+            side_effect=lambda **kwargs: dict(
+                hits=dict(total=self.search.call_count, hits=[]))))
+        self.search = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_search_returns_cached_copies_of_responses(self):
+        body = dict(query=dict(match_all={}), size=0)
+        resp = self.ss.search(index='a,b', body=body)
+        resp['hits']['total'] = 100
+        same = self.ss.search(index='b,a',
+                              body=dict(size=0, query=dict(match_all={})))
+        other = self.ss.search(index='a,b', body=body, size=0)
+
+        self.assertEquals(same['hits']['total'], 1)
+        self.assertEquals(other['hits']['total'], 2)
+        self.assertEquals(self.search.call_count, 2)
+        self.assertEquals(self.cache.stats, dict(size=2, hits=1, misses=2,
+                                                 evictions=0,
+                                                 invalidations=0))
+
+    def test_search_cache_evicts_least_recently_used_responses(self):
+        for size in (1, 2, 3, 1, 4, 2):
+            self.ss.search(index='a', size=size)
+
+        self.assertEquals(self.search.call_count, 5)
+        self.assertEquals(self.cache.stats['evictions'], 2)
+        self.assertEquals(len(self.cache), 3)
+
+    def test_search_cache_expires_responses(self):
+        self.cache._cache.ttl = 0.05
+        self.ss.search(index='a')
+        self.ss.search(index='a')
+        time.sleep(0.1)
+        self.ss.search(index='a')
+
+        self.assertEquals(self.search.call_count, 2)
+        self.assertEquals(self.cache.stats['evictions'], 1)
+
+    def test_scrolled_searches_are_not_cached(self):
+        self.ss.search(index='a', scroll='1m')
+        self.ss.search(index='a', scroll='1m')
+        self.ss.search(index='a', search_type='scan')
+
+        self.assertEquals(self.search.call_count, 3)
+        self.assertEquals(len(self.cache), 0)
+
+    def test_invalidation_during_set_is_not_lost(self):
+        cache_set = self.cache._cache.set
+        thread = threading.Thread(target=self.cache.invalidate, args=('a',))
+
+        def set_during_invalidation(key, data):
+            # a write invalidates the index while the response is stored
+            thread.start()
+            thread.join(0.1)
+            cache_set(key, data)
+
+        self.cache._cache.set = set_during_invalidation
+        self.ss.search(index='a')
+        thread.join()
+
+        self.assertEquals(len(self.cache), 0)
+        self.assertEquals(self.cache.generation, 1)
+
+    def test_bulk_operations_invalidate_searches_on_their_indices(self):
+        self.ss.search(index='a')
+        self.ss.search(index='b')
+        self.ss.search(index='b*')
+        bulk = self.ss.bulk_operation(index='b')
+        bulk.delete(doc_type='docs', id=1)
+        bulk.execute()
+
+        self.ss.search(index='a')
+        self.assertEquals(self.search.call_count, 3)
+        self.ss.search(index='b')
+        self.ss.search(index='b*')
+        self.assertEquals(self.search.call_count, 5)
+        self.assertEquals(self.cache.stats['invalidations'], 2)
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        docs = [dict(_index='test', _type='docs', _id=str(i),
+                     _source=dict(value=i)) for i in range(25)]
+        self.server = StandInElasticsearch(docs).start()
+        self.addCleanup(self.server.stop)
+        self.histograms = HistogramSink()
+        self.recorded = []
+        self.ss = SuperElasticsearch(
+            hosts=[self.server.host],
+            metrics=Metrics(self.histograms, CallbackSink(
+                lambda name, value: self.recorded.append((name, value)))))
+
+    def values(self, name):
+        return [value for recorded, value in self.recorded
+                if recorded == name]
+
+    def test_scroll_metrics(self):
+        list(self.ss.itersearch(index='test', scroll='1m', size=10))
+
+        self.assertEquals(self.values('scroll.hits'), [10, 10, 5])
+        self.assertEquals(self.histograms.count('scroll.latency'), 4)
+        self.assertEquals(self.histograms.total('scroll.hits'), 25)
+        sizes = self.values('scroll.response_bytes')
+        self.assertEquals(len(sizes), 4)
+        self.assertTrue(sizes[0] > sizes[2] > sizes[3] > 0)
+
+    def test_bulk_metrics(self):
+        bulk = self.ss.bulk_operation(index='test', doc_type='docs')
+        for i in range(10):
+            bulk.index(id=i, body=dict(value=i))
+        bulk_body = bulk._bulk_body(bulk._actions)
+        bulk.execute()
+        for i in range(4):
+            bulk.delete(id=i)
+        bulk.execute_parallel(workers=2, chunk_size=1)
+
+        self.assertEquals(self.values('bulk.actions'), [10, 1, 1, 1, 1])
+        self.assertEquals(self.values('bulk.request_bytes')[0],
+                          len(bulk_body))
+        self.assertEquals(self.values('bulk.item_errors'), [0] * 5)
+        self.assertEquals(self.histograms.count('bulk.latency'), 5)
+        self.assertEquals(self.histograms.count('bulk.serialize_time'), 5)
+        self.assertTrue(all(size > 0 for size in
+                            self.values('bulk.response_bytes')))
+
+    def test_bulk_request_bytes_of_pre_serialized_bodies(self):
+        self.ss.bulk = Mock(return_value=dict(took=1, errors=False,
+                                              items=[]))
+        bulk = self.ss.bulk_operation(index='test', doc_type='docs')
+        # UTF-8 encoded on Python 2
+        bulk.index(id=1, body='{"name": "\xc3\xa9t\xc3\xa9"}')
+        bulk.delete(id=2)
+        bulk_body = bulk._bulk_body(bulk._actions)
+        bulk.execute()
+
+        if not isinstance(bulk_body, bytes):
+            bulk_body = bulk_body.encode('utf-8')
+        self.assertEquals(self.values('bulk.request_bytes'),
+                          [len(bulk_body)])
+
+    def test_histogram_percentiles(self):
+        histograms = HistogramSink()
+        for value in range(1, 1001):
+            histograms.record('latency', value / 1000.0)
+
+        self.assertTrue(0.5 <= histograms.percentile('latency', 50) < 0.55)
+        self.assertTrue(0.99 <= histograms.percentile('latency', 99) <= 1)
+        self.assertEquals(histograms.percentile('latency', 100), 1)
+        summary = histograms.summary()['latency']
+        self.assertEquals(summary['count'], 1000)
+        self.assertEquals(summary['min'], 0.001)
+        self.assertEquals(histograms.percentile('other', 50), None)
+
+    def test_metrics_are_disabled_by_default(self):
+        ss = SuperElasticsearch(hosts=[self.server.host])
+        self.assertEquals(ss.metrics, None)
+        self.assertFalse(hasattr(ss.transport.deserializer, 'deserializer'))
+
+
+class TestCompression(unittest.TestCase):
+
+    def setUp(self):
+        docs = [dict(_index='test', _type='docs', _id=str(i),
+                     _source=dict(text='document %s' % i)) for i in range(25)]
+        self.server = StandInElasticsearch(docs, compression=True).start()
+        self.addCleanup(self.server.stop)
+
+    def bulk(self, ss):
+        bulk = ss.bulk_operation(index='test', doc_type='docs')
+        for i in range(100):
+            bulk.index(id=i, body=dict(text='document %s' % i))
+        return bulk.execute()
+
+    def test_compress_round_trip(self):
+        data = b'{"index": {}}\n{"text": "document"}\n' * 100
+        for encoding in ('gzip', 'deflate'):
+            compressed = compress(data, encoding, level=9)
+            self.assertTrue(len(compressed) < len(data) / 10)
+            self.assertEquals(decompress(compressed, encoding), data)
+
+    def test_bulk_bodies_are_compressed(self):
+        for encoding in ('gzip', 'deflate'):
+            ss = SuperElasticsearch(hosts=[self.server.host],
+                                    compression=encoding, compression_level=1)
+            self.assertTrue(isinstance(ss.transport.get_connection(),
+                                       CompressedHttpConnection))
+            resp = self.bulk(ss)
+
+            self.assertEquals(len(resp['items']), 100)
+            self.assertEquals(resp['items'][99]['index']['_id'], 99)
+            self.assertEquals(self.server.encodings[-1],
+                              ('/test/docs/_bulk', encoding, None))
+            # the server got the same body as without compression
+            self.assertEquals(len(self.server.requests[-1][3].splitlines()),
+                              200)
+
+    def test_scroll_responses_are_compressed(self):
+        ss = SuperElasticsearch(hosts=[self.server.host],
+                                compress_responses=True)
+        docs = list(ss.itersearch(index='test', scroll='1m', size=10,
+                                  chunked=False))
+        self.bulk(ss)
+
+        self.assertEquals([doc['_id'] for doc in docs],
+                          [str(i) for i in range(25)])
+        self.assertEquals(
+            [encodings[2] for encodings in self.server.encodings],
+            ['gzip', 'gzip', 'gzip', 'gzip', 'gzip', None])
+        self.assertEquals(self.server.encodings[-1],
+                          ('/test/docs/_bulk', None, None))
+
+    def test_parallel_bulk_clients_compress_bodies(self):
+        ss = SuperElasticsearch(hosts=[self.server.host], compression='gzip')
+        bulk = ss.bulk_operation(index='test', doc_type='docs')
+        for i in range(10):
+            bulk.delete(id=i)
+        bulk.execute_parallel(workers=2, chunk_size=5)
+
+        self.assertEquals(set(self.server.encodings),
+                          set([('/test/docs/_bulk', 'gzip', None)]))
+
+    def test_unknown_compression_is_rejected(self):
+        self.assertRaises(ImproperlyConfigured, SuperElasticsearch,
+                          hosts=[self.server.host], compression='brotli')
+
+    def test_bodies_are_not_compressed_by_default(self):
+        self.bulk(SuperElasticsearch(hosts=[self.server.host]))
+        self.assertEquals(self.server.encodings,
+                          [('/test/docs/_bulk', None, None)])
+
+
 class TestBulkAction(unittest.TestCase):
 
     def test_bulk_action_must_not_accept_invalid_action(self):
@@ -231,6 +1116,34 @@ class TestBulkAction(unittest.TestCase):
                           (json.dumps({ 'delete': dict(routing='123',
                                                        refresh=True) })))
 
+    def test_bulk_action_must_serialize_only_once(self):
+        body = dict(key1='val1')
+        action = _BulkAction('index', params=dict(_id=1), body=body)
+        self.assertEquals(action.op, action.es_op + '\n')
+        # encoded without being kept until serialized
+        self.assertEquals(action._op, None)
+
+        action.serialize()
+        body['key1'] = 'val2'
+        self.assertTrue('val1' in action.op)
+
+    def test_compact_bulk_action_must_free_params_and_body(self):
+        body = dict(key1='val1')
+        action = _BulkAction('index', params=dict(_id=1), body=body)
+        es_op = action.es_op
+        action.compact()
+
+        self.assertEquals(action._params, None)
+        self.assertEquals(action._body, None)
+        self.assertEquals(action.es_op, es_op)
+        assertDictEquals(action.params, dict(_id=1))
+        assertDictEquals(action.body, body)
+        self.assertRaises(AttributeError, setattr, action, 'other', 1)
+
+        action = _BulkAction('delete', params=dict(_id=1))
+        action.compact()
+        self.assertEquals(action.body, None)
+
 
 class TestBulkOperation(unittest.TestCase):
 
@@ -462,3 +1375,978 @@ class TestBulkOperation(unittest.TestCase):
         self.assertEquals(action.type, 'delete')
         assertDictEquals(action.body, None)
         assertDictEquals(action.params, dict(_id=123))
+
+    def test_bulk_operation_decodes_escaped_params(self):
+        # elasticsearch-py encodes query parameters to bytes on Python 3
+        def escape(value):
+            return ('%s' % value).encode('utf-8')
+
+        self.ss.bulk = Mock(return_value=dict(items=[]))
+        with patch('elasticsearch.client.utils._escape', escape):
+            bulk = self.ss.bulk_operation(index='test', doc_type='docs')
+            bulk.index(id=1, routing='a', body=dict(key1='val1'))
+            bulk.delete(index='other', id=2)
+            bulk.execute(refresh='true')
+
+        self.assertEquals(bulk._params, dict(index='test', doc_type='docs'))
+        kwargs = self.ss.bulk.call_args[1]
+        self.assertEquals(kwargs['index'], 'test')
+        self.assertEquals(kwargs['refresh'], 'true')
+        self.assertEquals(kwargs['body'], bulk._bulk_body([
+            _BulkAction('index', params=dict(_id=1, routing='a'),
+                        body=dict(key1='val1')),
+            _BulkAction('delete', params=dict(_index='other', _id=2))]))
+
+
+class TestAutoFlushingBulkOperation(unittest.TestCase):
+
+    def setUp(self):
+        self.ss = SuperElasticsearch(hosts=['localhost:9200'])
+        self.ss.bulk = Mock(side_effect=lambda body, **kwargs: dict(
+            items=body.splitlines()))
+
+    def test_bulk_operation_flushes_after_max_actions(self):
+        bulk = self.ss.bulk_operation(max_actions=3)
+        for i in range(7):
+            bulk.delete(index='test', doc_type='docs', id=i)
+
+        self.assertEquals(self.ss.bulk.call_count, 2)
+        self.assertEquals(len(bulk._actions), 1)
+        self.assertEquals(len(bulk.responses), 2)
+
+    def test_bulk_operation_keeps_requests_under_max_bytes(self):
+        body = dict(key1='val1')
+        action_size = len(_BulkAction(
+            'index', params=dict(_id=1), body=body).es_op) + 1
+
+        bulk = self.ss.bulk_operation(max_bytes=action_size * 2 + 1)
+        for i in range(5):
+            bulk.index(id=i, body=body)
+        bulk.flush()
+
+        for call in self.ss.bulk.call_args_list:
+            self.assertTrue(len(call[1]['body']) <= action_size * 2 + 1)
+        self.assertEquals(self.ss.bulk.call_count, 3)
+        self.assertEquals(bulk.size, 0)
+
+    def test_max_bytes_counts_bytes_of_non_ascii_actions(self):
+        # 2 bytes per char in UTF-8
+        body = u'{"name": "%s"}' % (u'\u00e9' * 50)
+        bulk = self.ss.bulk_operation(max_bytes=320)
+        for i in range(6):
+            bulk.index(index='test', id=i, body=body)
+        self.assertEquals(bulk.size, 306)
+        bulk.flush()
+
+        self.assertEquals(self.ss.bulk.call_count, 3)
+        for call in self.ss.bulk.call_args_list:
+            self.assertTrue(len(call[1]['body'].encode('utf-8')) <= 320)
+
+    def test_bulk_operation_flushes_after_flush_interval(self):
+        bulk = self.ss.bulk_operation(flush_interval=60)
+        bulk.delete(id=1)
+        self.assertFalse(self.ss.bulk.called)
+
+        bulk._last_flush -= 61
+        bulk.delete(id=2)
+        self.assertEquals(self.ss.bulk.call_count, 1)
+
+    def test_bulk_operation_flushes_on_exiting_context(self):
+        with self.ss.bulk_operation(max_actions=10) as bulk:
+            bulk.delete(id=1)
+            bulk.delete(id=2)
+            self.assertFalse(self.ss.bulk.called)
+
+        self.assertEquals(self.ss.bulk.call_count, 1)
+        self.assertEquals(len(bulk.responses), 1)
+        self.assertEquals(len(bulk.responses[0]['items']), 2)
+
+    def test_flush_does_not_execute_without_actions(self):
+        bulk = self.ss.bulk_operation()
+        self.assertEquals(bulk.flush(), None)
+        self.assertFalse(self.ss.bulk.called)
+
+
+class TestAdaptiveBulkOperation(unittest.TestCase):
+
+    def setUp(self):
+        self.ss = SuperElasticsearch(hosts=['localhost:9200'])
+        self.rejected = 0
+
+        def bulk(body, **kwargs):
+            items = []
+            for i, line in enumerate(body.splitlines()):
+                if i < self.rejected:
+                    result = dict(status=429, error='EsRejectedExecution')
+                else:
+                    result = dict(status=200)
+                items.append(dict(delete=result))
+            return dict(errors=self.rejected > 0, items=items)
+        self.ss.bulk = Mock(side_effect=bulk)
+
+    def test_batch_size_grows_after_full_fast_requests(self):
+        controller = AdaptiveBatchSize(initial_actions=10, step=5)
+        controller.update(10, 1000, 0.1, 0)
+        self.assertEquals(controller.actions, 15)
+        controller.update(15, 1500, 0.1, 0)
+        self.assertEquals(controller.actions, 20)
+        self.assertEquals(controller.increases, 2)
+
+    def test_batch_size_does_not_grow_after_partial_requests(self):
+        controller = AdaptiveBatchSize(initial_actions=10)
+        controller.update(3, 300, 0.1, 0)
+        self.assertEquals(controller.actions, 10)
+
+    def test_batch_size_is_cut_after_slow_requests(self):
+        controller = AdaptiveBatchSize(target_latency=1, initial_actions=100,
+                                       min_actions=30)
+        controller.update(100, 1000, 2, 0)
+        self.assertEquals(controller.actions, 50)
+        controller.update(50, 500, 2, 0)
+        self.assertEquals(controller.actions, 30)
+        self.assertEquals(controller.decreases, 2)
+
+    def test_batch_size_is_cut_after_rejections(self):
+        controller = AdaptiveBatchSize(initial_actions=100,
+                                       max_rejection_rate=0.05)
+        controller.update(100, 1000, 0.1, 5)
+        self.assertEquals(controller.actions, 110)
+        controller.update(110, 1000, 0.1, 6)
+        self.assertEquals(controller.actions, 55)
+
+    def test_batch_bytes_adapt_between_limits(self):
+        controller = AdaptiveBatchSize(initial_actions=100, step=10,
+                                       max_bytes=10000, min_bytes=4000)
+        controller.update(100, 9000, 2, 0)
+        self.assertEquals(controller.bytes, 5000)
+        controller.update(100, 5000, 2, 0)
+        self.assertEquals(controller.bytes, 4000)
+        controller.update(50, 3900, 0.1, 0)
+        self.assertEquals(controller.bytes, 4780)
+
+    def test_bulk_operation_flushes_at_adapted_batch_size(self):
+        bulk = self.ss.bulk_operation(index='test', doc_type='docs',
+                                      max_actions=40, adaptive=True)
+        self.assertEquals(bulk.batch_size, 40)
+        for i in range(40):
+            bulk.delete(id=i)
+        self.assertEquals(self.ss.bulk.call_count, 1)
+        self.assertEquals(bulk.batch_size, 44)
+
+        self.rejected = 2
+        for i in range(44):
+            bulk.delete(id=i)
+        self.assertEquals(self.ss.bulk.call_count, 2)
+        self.assertEquals(bulk.batch_size, 22)
+        self.assertEquals(bulk.adaptive.decreases, 1)
+
+    def test_bulk_operation_adapts_to_rejected_requests(self):
+        self.ss.bulk = Mock(side_effect=TransportError(429, 'rejected'))
+        bulk = self.ss.bulk_operation(index='test', doc_type='docs',
+                                      max_actions=100, adaptive=True)
+        for i in range(5):
+            bulk.delete(id=i)
+        self.assertRaises(TransportError, bulk.execute)
+        self.assertEquals(bulk.batch_size, 50)
+
+    def test_bulk_operation_records_batch_size(self):
+        histograms = HistogramSink()
+        ss = SuperElasticsearch(hosts=['localhost:9200'],
+                                metrics=Metrics(histograms))
+        ss.bulk = self.ss.bulk
+        bulk = ss.bulk_operation(index='test', doc_type='docs',
+                                 max_actions=10, adaptive=True)
+        for i in range(10):
+            bulk.delete(id=i)
+        self.assertEquals(histograms.count('bulk.batch_size'), 1)
+        self.assertEquals(histograms.total('bulk.batch_size'), 11)
+
+
+class TestCoalescingBulkOperation(unittest.TestCase):
+
+    def setUp(self):
+        self.ss = SuperElasticsearch(hosts=['localhost:9200'])
+        self.ss.bulk = Mock(return_value=dict(items=[]))
+
+    def sent(self):
+        lines = self.ss.bulk.call_args[1]['body'].splitlines()
+        return [json.loads(line) for line in lines]
+
+    def test_index_replaces_earlier_actions(self):
+        bulk = self.ss.bulk_operation(index='test', doc_type='docs',
+                                      coalesce=True)
+        bulk.index(id=1, body=dict(count=1))
+        bulk.index(id=2, body=dict(count=1))
+        bulk.update(id=1, body=dict(script='ctx._source.count += 1'))
+        bulk.index(id=1, body=dict(count=3))
+        bulk.execute()
+
+        self.assertEquals(self.sent(), [
+            dict(index=dict(_id=2)), dict(count=1),
+            dict(index=dict(_id=1)), dict(count=3)])
+        self.assertEquals(bulk.coalesced, 2)
+
+    def test_delete_replaces_earlier_actions(self):
+        bulk = self.ss.bulk_operation(index='test', doc_type='docs',
+                                      coalesce=True)
+        bulk.index(id=1, body=dict(count=1))
+        bulk.update(id=1, body=dict(doc=dict(count=2)))
+        bulk.delete(id=1)
+        bulk.execute()
+
+        self.assertEquals(self.sent(), [dict(delete=dict(_id=1))])
+        self.assertEquals(bulk.coalesced, 2)
+
+    def test_partial_updates_are_merged(self):
+        bulk = self.ss.bulk_operation(index='test', doc_type='docs',
+                                      coalesce=True)
+        bulk.update(id=1, body=dict(doc=dict(a=1, user=dict(name='x'))))
+        bulk.update(id=1, body=dict(doc=dict(b=2, user=dict(age=3))))
+        bulk.update(id=2, body=dict(doc=dict(a=1)))
+        bulk.index(id=3, body=dict(a=1))
+        bulk.update(id=3, body=dict(doc=dict(b=2)))
+        bulk.execute()
+
+        self.assertEquals(self.sent(), [
+            dict(update=dict(_id=1)),
+            dict(doc=dict(a=1, b=2, user=dict(name='x', age=3))),
+            dict(update=dict(_id=2)), dict(doc=dict(a=1)),
+            dict(index=dict(_id=3)), dict(a=1, b=2)])
+        self.assertEquals(bulk.coalesced, 2)
+
+    def test_partial_updates_are_not_merged_into_serialized_documents(self):
+        bulk = self.ss.bulk_operation(index='test', doc_type='docs',
+                                      coalesce=True)
+        bulk.index(id=1, body='{"a": 1}')
+        bulk.update(id=1, body=dict(doc=dict(b=2)))
+        bulk.execute()
+
+        self.assertEquals(self.sent(), [
+            dict(index=dict(_id=1)), dict(a=1),
+            dict(update=dict(_id=1)), dict(doc=dict(b=2))])
+        self.assertEquals(bulk.coalesced, 0)
+
+    def test_scripted_and_versioned_actions_are_kept_in_order(self):
+        bulk = self.ss.bulk_operation(index='test', doc_type='docs',
+                                      coalesce=True)
+        bulk.update(id=1, body=dict(script='ctx._source.count += 1'))
+        bulk.update(id=1, body=dict(script='ctx._source.count += 1'))
+        bulk.update(id=1, body=dict(doc=dict(a=1)))
+        bulk.index(id=2, body=dict(a=1), version=3)
+        bulk.index(id=2, body=dict(a=2))
+        bulk.execute()
+
+        self.assertEquals(len(self.sent()), 10)
+        self.assertEquals(bulk.coalesced, 0)
+
+    def test_scripted_updates_are_merged_by_merge_function(self):
+        def merge_updates(earlier, later):
+            if earlier.get('script') == later.get('script'):
+                params = dict(count=earlier['params']['count'] +
+                              later['params']['count'])
+                return dict(script=earlier['script'], params=params)
+
+        bulk = self.ss.bulk_operation(index='test', doc_type='docs',
+                                      coalesce=True,
+                                      merge_updates=merge_updates)
+        for i in range(3):
+            bulk.update(id=1, body=dict(script='ctx._source.count += count',
+                                        params=dict(count=1)))
+        bulk.update(id=1, body=dict(script='ctx._source.tags += tag',
+                                    params=dict(tag='a')))
+        bulk.execute()
+
+        self.assertEquals(self.sent(), [
+            dict(update=dict(_id=1)),
+            dict(script='ctx._source.count += count', params=dict(count=3)),
+            dict(update=dict(_id=1)),
+            dict(script='ctx._source.tags += tag', params=dict(tag='a'))])
+        self.assertEquals(bulk.coalesced, 2)
+
+    def test_coalesced_actions_are_counted_towards_max_bytes(self):
+        bulk = self.ss.bulk_operation(index='test', doc_type='docs',
+                                      coalesce=True, compact=True)
+        bulk.index(id=1, body=dict(text='x' * 100))
+        bulk.index(id=1, body=dict(text='x'))
+        self.assertEquals(bulk.size, len(bulk._bulk_body(bulk._actions)))
+
+    def test_coalesced_actions_keep_measured_size_in_step(self):
+        bulk = self.ss.bulk_operation(index='test', doc_type='docs',
+                                      coalesce=True)
+        bulk.index(id=1, body=dict(text='x' * 100))
+        bulk.update(id=2, body=dict(script='ctx._source.count += 1'))
+        bulk.update(id=2, body=dict(script='ctx._source.count += 1'))
+        self.assertEquals(bulk.size, len(bulk._bulk_body(bulk._actions)))
+
+        bulk.index(id=1, body=dict(text='x'))
+        bulk.update(id=1, body=dict(doc=dict(count=1)))
+        bulk.index(id=2, body=dict(count=2))
+        self.assertEquals(len(bulk._actions), 2)
+        self.assertEquals(bulk.size, len(bulk._bulk_body(bulk._actions)))
+
+    def test_actions_are_not_coalesced_by_default(self):
+        bulk = self.ss.bulk_operation(index='test', doc_type='docs')
+        bulk.index(id=1, body=dict(count=1))
+        bulk.index(id=1, body=dict(count=2))
+        bulk.execute()
+        self.assertEquals(len(self.sent()), 4)
+
+
+class TestShardAwareBulkOperation(unittest.TestCase):
+
+    def setUp(self):
+        self.ss = SuperElasticsearch(hosts=['localhost:9200'])
+        self.version = 1
+        # ids 1, 3 and 5 are routed to shard 0, ids 2, 4 and 6 to shard 1
+        self.shards = {'0': 'node1', '1': 'node2'}
+
+        def state(metric=None, **kwargs):
+            if metric == 'version':
+                return dict(version=self.version)
+            shards = dict((number, [
+                dict(shard=int(number), index='test', primary=True,
+                     node=node, state='STARTED'),
+                dict(shard=int(number), index='test', primary=False,
+                     node='node3', state='STARTED')])
+                for number, node in self.shards.items())
+            return dict(version=self.version, routing_table=dict(
+                indices=dict(test=dict(shards=shards))))
+        self.ss.cluster.state = Mock(side_effect=state)
+        self.ss.nodes.info = Mock(return_value=dict(nodes=dict(
+            node1=dict(http_address='inet[/10.0.0.1:9200]'),
+            node2=dict(http_address='10.0.0.2:9200'),
+            node3=dict(http_address='inet[es3/10.0.0.3:9200]'))))
+
+        self.sent = {}
+
+        def bulk_to(host):
+            def bulk(body, **kwargs):
+                lines = [json.loads(line) for line in body.splitlines()]
+                ids = [line['index'].get('_id') for line in lines
+                       if 'index' in line]
+                self.sent.setdefault(host, []).extend(ids)
+                return dict(took=1, errors=False, items=[
+                    dict(index=dict(_id=id, status=201)) for id in ids])
+            return bulk
+
+        self.ss.bulk = Mock(side_effect=bulk_to('localhost:9200'))
+        self.ss._client_like = Mock(side_effect=lambda hosts, **kwargs: Mock(
+            bulk=Mock(side_effect=bulk_to(hosts[0]))))
+
+    def execute(self, ids, **kwargs):
+        bulk = self.ss.bulk_operation(index='test', doc_type='docs',
+                                      shard_aware=True)
+        for id in ids:
+            bulk.index(id=id, body=dict(value=id), **kwargs)
+        return bulk.execute()
+
+    def test_hash_functions_match_elasticsearch(self):
+        self.assertEquals(djb_hash('a'), 177670)
+        self.assertEquals(djb_hash('hello'), 261238937)
+        self.assertEquals(murmur3_hash('hello') & 0xffffffff, 0xd7c31989)
+        self.assertEquals(
+            murmur3_hash('The quick brown fox jumps over the lazy dog') &
+            0xffffffff, 0xe07db09c)
+        # Math.abs(hash % shards) of a negative hash
+        self.assertEquals(djb_hash('The quick brown fox'), -1748763400)
+        self.assertEquals(shard_number('The quick brown fox', 3), 1)
+
+    def test_shard_numbers_of_murmur3_depend_on_version(self):
+        self.assertEquals(murmur3_hash('hello'), -675079799)
+        # Math.abs(hash % shards) of Elasticsearch 1.x
+        self.assertEquals(shard_number('hello', 5, 'murmur3'), 4)
+        # Math.floorMod(hash, shards) of Elasticsearch 2.0 and later
+        self.assertEquals(shard_number('hello', 5, 'murmur3', 2), 1)
+
+    def test_actions_are_sent_to_primary_nodes(self):
+        resp = self.execute(['1', '2', '3', '4', '5', '6'])
+
+        self.assertEquals(self.sent, {'10.0.0.1:9200': ['1', '3', '5'],
+                                      '10.0.0.2:9200': ['2', '4', '6']})
+        self.assertEquals([item['index']['_id'] for item in resp['items']],
+                          ['1', '2', '3', '4', '5', '6'])
+        self.assertEquals(self.ss.cluster.state.call_count, 1)
+        self.assertEquals(self.ss._client_like.call_count, 2)
+
+    def test_routing_is_honored(self):
+        self.execute(['1', '2', '3'], routing='2')
+        self.assertEquals(self.sent, {'10.0.0.2:9200': ['1', '2', '3']})
+
+    def test_unknown_indices_are_sent_to_any_node(self):
+        bulk = self.ss.bulk_operation(doc_type='docs', shard_aware=True)
+        bulk.index(index='test', id='1', body={})
+        bulk.index(index='other', id='2', body={})
+        bulk.index(index='test', body={})
+        bulk.execute()
+
+        self.assertEquals(self.sent, {'10.0.0.1:9200': ['1'],
+                                      'localhost:9200': ['2', None]})
+
+    def test_routing_table_is_refreshed_when_shards_move(self):
+        self.execute(['1', '2'])
+        table = self.ss.routing_table()
+        table._checked -= table.refresh_interval
+        self.execute(['1'])
+        self.assertEquals(table.refreshes, 1)
+
+        self.version = 2
+        self.shards = {'0': 'node2', '1': 'node1'}
+        table._checked -= table.refresh_interval
+        self.execute(['1'])
+
+        self.assertEquals(table.refreshes, 2)
+        self.assertEquals(self.sent['10.0.0.2:9200'], ['2', '1'])
+
+    def test_unreachable_nodes_fall_back_to_the_client(self):
+        self.execute(['1'])
+        table = self.ss.routing_table()
+        table.client('node1').bulk.side_effect = ConnectionError(
+            'N/A', 'connection refused', None)
+        self.execute(['1', '3'])
+
+        self.assertEquals(self.sent['localhost:9200'], ['1', '3'])
+        self.assertEquals(table.version, None)
+        self.execute(['2'])
+        self.assertEquals(table.refreshes, 2)
+
+    def test_timed_out_nodes_are_not_sent_actions_again(self):
+        self.execute(['1'])
+        table = self.ss.routing_table()
+        table.client('node1').bulk.side_effect = ConnectionTimeout(
+            'TIMEOUT', 'read timed out', None)
+        self.assertRaises(ConnectionTimeout, self.execute, ['1'])
+        self.assertFalse('localhost:9200' in self.sent)
+
+        self.ss.transport.retry_on_timeout = True
+        self.execute(['1'])
+        self.assertEquals(self.sent['localhost:9200'], ['1'])
+
+    def test_routing_table_is_created_once(self):
+        table = self.ss.routing_table(hash_function='murmur3', es_version=2)
+        self.assertTrue(self.ss.routing_table() is table)
+        self.assertTrue(self.ss.routing_table(es_version=2) is table)
+        self.assertRaises(ImproperlyConfigured, self.ss.routing_table,
+                          hash_function='djb')
+
+    def test_shard_aware_needs_superelasticsearch_client(self):
+        self.assertRaises(ValueError, BulkOperation,
+                          Elasticsearch(hosts=['localhost:9200']),
+                          shard_aware=True)
+
+
+class TestParallelBulkExecute(unittest.TestCase):
+
+    def setUp(self):
+        self.ss = SuperElasticsearch(hosts=['localhost:9200'])
+        self.requests = []
+        self.in_flight = [0, 0]
+        lock = threading.Lock()
+
+        def bulk(body, **kwargs):
+            with lock:
+                self.in_flight[0] += 1
+                self.in_flight[1] = max(self.in_flight)
+            time.sleep(0.01)
+            lines = [json.loads(line) for line in body.splitlines()]
+            with lock:
+                self.in_flight[0] -= 1
+                self.requests.append(lines)
+            return dict(took=len(lines), errors=False, items=[
+                line for line in lines if 'delete' in line or 'index' in line
+            ])
+
+        self.client = Mock()
+        self.client.bulk = Mock(side_effect=bulk)
+        self.ss._bulk_clients = Mock(
+            side_effect=lambda count: [self.client] * count)
+
+    def test_execute_parallel_returns_items_in_recorded_order(self):
+        bulk = self.ss.bulk_operation(index='test', doc_type='docs')
+        for i in range(50):
+            bulk.delete(id=i)
+
+        resp = bulk.execute_parallel(workers=3, chunk_size=4)
+
+        self.ss._bulk_clients.assert_called_once_with(3)
+        self.assertEquals([item['delete']['_id'] for item in resp['items']],
+                          list(range(50)))
+        self.assertFalse(resp['errors'])
+        self.assertTrue(self.in_flight[1] <= 3)
+        self.assertTrue(max(len(lines) for lines in self.requests) <= 4)
+        self.assertEquals(len(bulk._actions), 0)
+
+    def test_execute_parallel_keeps_order_of_actions_on_same_doc(self):
+        bulk = self.ss.bulk_operation(index='test', doc_type='docs')
+        for i in range(20):
+            bulk.index(id=i % 2, body=dict(version=i))
+            bulk.index(body=dict(version=i))
+
+        bulk.execute_parallel(workers=4, chunk_size=3)
+
+        versions = {}
+        for lines in self.requests:
+            for action, body in zip(lines[::2], lines[1::2]):
+                if '_id' in action['index']:
+                    versions.setdefault(action['index']['_id'], []).append(
+                        body['version'])
+        # every document's actions were sent by one worker, in order
+        for doc_versions in versions.values():
+            self.assertEquals(doc_versions, sorted(doc_versions))
+
+    def test_execute_parallel_raises_and_keeps_actions_on_failure(self):
+        self.client.bulk = Mock(side_effect=TransportError(500, 'error'))
+        bulk = self.ss.bulk_operation()
+        for i in range(10):
+            bulk.delete(id=i)
+
+        self.assertRaises(TransportError, bulk.execute_parallel, workers=2,
+                          chunk_size=2)
+        self.assertEquals(len(bulk._actions), 10)
+
+
+class TestCompactBulkOperation(unittest.TestCase):
+
+    def setUp(self):
+        self.ss = SuperElasticsearch(hosts=['localhost:9200'])
+        self.ss.bulk = Mock(return_value=dict(items=[]))
+
+    def test_compact_bulk_operation_serializes_on_record(self):
+        bulk = self.ss.bulk_operation(compact=True)
+        bulk.index(index='test', id=1, body=dict(key1='val1'))
+        bulk.delete(index='test', id=2)
+
+        self.assertEquals(bulk._actions[0]._body, None)
+        expected_body = ''.join(action.es_op + '\n'
+                                for action in bulk._actions)
+        self.assertEquals(bulk.size, len(expected_body))
+
+        bulk.execute()
+        self.assertEquals(self.ss.bulk.call_args[1]['body'], expected_body)
+        self.assertEquals(bulk.size, 0)
+
+    def test_bulk_operation_reports_size_of_recorded_actions(self):
+        bulk = self.ss.bulk_operation()
+        bulk.index(index='test', id=1, body=dict(key1='val1'))
+        bulk.update(index='test', id=1, body=dict(doc=dict(key1='val2')))
+
+        self.assertEquals(bulk.size, len(bulk._bulk_body(bulk._actions)))
+
+    def test_size_only_measures_actions_recorded_since_last_asked(self):
+        bulk = self.ss.bulk_operation()
+        bulk.index(index='test', id=1, body=dict(key1='val1'))
+        self.assertEquals(bulk.size, len(bulk._bulk_body(bulk._actions)))
+
+        bulk.index(index='test', id=2, body=dict(key1='val2'))
+        with patch('superelasticsearch._byte_size',
+                   side_effect=_byte_size) as byte_size:
+            self.assertEquals(bulk.size,
+                              len(bulk._bulk_body(bulk._actions)))
+        self.assertEquals(byte_size.call_count, 1)
+
+        bulk.execute()
+        self.assertEquals(bulk.size, 0)
+
+    def test_bulk_body_does_not_keep_serialized_actions(self):
+        bulk = self.ss.bulk_operation()
+        bulk.BODY_CHUNK_SIZE = 2
+        for i in range(5):
+            bulk.index(index='test', id=i, body=dict(key1='val%s' % i))
+        expected_body = ''.join(action.es_op + '\n'
+                                for action in bulk._actions)
+
+        self.assertEquals(bulk._bulk_body(bulk._actions), expected_body)
+        self.assertEquals([action._op for action in bulk._actions],
+                          [None] * 5)
+
+
+class TestSpillingBulkOperation(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StandInElasticsearch().start()
+        self.addCleanup(self.server.stop)
+        self.ss = SuperElasticsearch(hosts=[self.server.host])
+
+    def record(self, bulk, count=20):
+        for i in range(count):
+            bulk.index(id=i, body=dict(text='document %s' % i))
+            bulk.delete(id='gone-%s' % i)
+
+    def test_actions_over_the_memory_budget_are_spilled(self):
+        bulk = self.ss.bulk_operation(index='test', doc_type='docs',
+                                      memory_budget=500)
+        self.record(bulk)
+
+        self.assertEquals((bulk.spilled, len(bulk._actions)), (27, 13))
+        self.assertTrue(sum(len(action.op) for action in bulk._actions)
+                        <= 500)
+        self.assertEquals(bulk.size, bulk.spilled_bytes + bulk._size)
+
+    def test_spilled_actions_are_streamed_in_order(self):
+        bulk = self.ss.bulk_operation(index='test', doc_type='docs',
+                                      memory_budget=500)
+        self.record(bulk)
+        in_memory = BulkOperation(None)
+        self.record(in_memory)
+        spill = bulk._spill_file
+        resp = bulk.execute()
+
+        self.assertEquals(len(self.server.requests), 1)
+        method, path, params, body = self.server.requests[0]
+        self.assertEquals(path, '/test/docs/_bulk')
+        self.assertEquals(body, in_memory._bulk_body(in_memory._actions))
+        self.assertEquals([list(item.values())[0]['_id']
+                           for item in resp['items'][:4]],
+                          [0, 'gone-0', 1, 'gone-1'])
+        self.assertTrue(spill.closed)
+        self.assertEquals((bulk.spilled, bulk.size), (0, 0))
+
+    def test_serialized_bodies_are_spilled_as_bytes(self):
+        body = u'{"text": "d\xe9j\xe0 vu"}'
+        if str is bytes:
+            # given as UTF-8 str on Python 2
+            body = body.encode('utf-8')
+        bulk = self.ss.bulk_operation(index='test', doc_type='docs',
+                                      memory_budget=100)
+        for i in range(3):
+            bulk.index(id=i, body=body)
+        self.assertTrue(bulk.spilled)
+        bulk.execute()
+
+        method, path, params, sent = self.server.requests[0]
+        lines = [json.loads(line) for line in sent.splitlines()]
+        self.assertEquals(lines[::2], [dict(index=dict(_id=i))
+                                       for i in range(3)])
+        self.assertEquals(lines[1::2], [dict(text=u'd\xe9j\xe0 vu')] * 3)
+
+    def test_timed_out_spilled_bodies_are_not_sent_again(self):
+        connection = Mock()
+        connection.perform_request.side_effect = ConnectionTimeout(
+            'TIMEOUT', 'read timed out', None)
+        self.ss.transport.get_connection = Mock(return_value=connection)
+        bulk = self.ss.bulk_operation(index='test', memory_budget=100)
+        self.record(bulk, 3)
+        self.assertRaises(ConnectionTimeout, bulk.execute)
+        self.assertEquals(connection.perform_request.call_count, 1)
+
+        self.ss.transport.retry_on_timeout = True
+        self.record(bulk, 3)
+        self.assertRaises(ConnectionTimeout, bulk.execute)
+        self.assertEquals(connection.perform_request.call_count,
+                          2 + self.ss.transport.max_retries)
+
+    def test_spill_file_is_removed_when_the_request_fails(self):
+        self.server.stop()
+        bulk = self.ss.bulk_operation(index='test', memory_budget=100)
+        self.record(bulk, 5)
+        spill = bulk._spill_file
+
+        self.assertRaises(ConnectionError, bulk.execute)
+        self.assertTrue(spill.closed)
+        self.assertEquals(bulk.spilled, 0)
+        self.assertEquals(bulk.flush(), None)
+
+    def test_spill_file_is_removed_when_the_operation_is_collected(self):
+        bulk = self.ss.bulk_operation(index='test', memory_budget=100)
+        self.record(bulk, 5)
+        spill = weakref.ref(bulk._spill_file._file)
+
+        del bulk
+        gc.collect()
+        self.assertEquals(spill(), None)
+
+    def test_spilled_actions_invalidate_cached_documents(self):
+        ss = SuperElasticsearch(hosts=[self.server.host],
+                                search_cache=SearchCache())
+        ss.search_cache._bulk_written = Mock()
+        bulk = ss.bulk_operation(index='test', doc_type='docs',
+                                 memory_budget=100)
+        self.record(bulk, 3)
+        bulk.execute()
+
+        keys = [action.doc_key('test', 'docs')
+                for call in ss.search_cache._bulk_written.call_args_list
+                for action in call[0][0]]
+        self.assertEquals(keys, [('test', 'docs', '0'),
+                                 ('test', 'docs', 'gone-0'),
+                                 ('test', 'docs', '1'),
+                                 ('test', 'docs', 'gone-1'),
+                                 ('test', 'docs', '2'),
+                                 ('test', 'docs', 'gone-2')])
+
+    def test_spill_file_is_not_read_back_without_caches(self):
+        bulk = self.ss.bulk_operation(index='test', doc_type='docs',
+                                      memory_budget=100)
+        self.record(bulk, 3)
+        spill = bulk._spill_file
+        spill.read_ops = Mock()
+        resp = bulk.execute()
+
+        self.assertEquals(len(resp['items']), 6)
+        self.assertFalse(spill.read_ops.called)
+
+    def test_spilled_bodies_are_not_compressed(self):
+        ss = SuperElasticsearch(hosts=[self.server.host], compression='gzip')
+        bulk = ss.bulk_operation(index='test', doc_type='docs',
+                                 memory_budget=100)
+        self.record(bulk, 5)
+        resp = bulk.execute()
+
+        self.assertEquals(len(resp['items']), 10)
+        self.assertEquals(self.server.encodings,
+                          [('/test/docs/_bulk', None, None)])
+
+    def test_spilled_actions_are_only_sent_by_execute(self):
+        bulk = self.ss.bulk_operation(index='test', memory_budget=100)
+        self.record(bulk, 5)
+
+        self.assertRaises(ValueError, bulk.execute_parallel)
+        self.assertRaises(ValueError, bulk.execute_with_retry)
+        self.assertEquals(len(bulk.flush()['items']), 10)
+
+
+class TestFastJSONSerializer(unittest.TestCase):
+
+    doc = {
+        'title': 'document',
+        'count': 10,
+        'price': Decimal('10.5'),
+        'day': date(2015, 10, 6),
+        'time': datetime(2015, 10, 6, 10, 30, 5, 123),
+        'tags': ['a', 'b'],
+        'flag': True,
+        'empty': None,
+    }
+
+    def serializers(self):
+        for name, _ in FastJSONSerializer.BACKENDS:
+            try:
+                yield FastJSONSerializer(backend=name)
+            except ImproperlyConfigured:
+                pass
+
+    def test_fast_json_serializer_encodes_like_json_serializer(self):
+        expected = JSONSerializer().loads(JSONSerializer().dumps(self.doc))
+        for serializer in self.serializers():
+            assertDictEquals(serializer.loads(serializer.dumps(self.doc)),
+                             expected)
+            self.assertEquals(serializer.dumps('{"a": 1}'), '{"a": 1}')
+            # too large for some of the fast libraries
+            self.assertEquals(serializer.loads(serializer.dumps(2 ** 70)),
+                              2 ** 70)
+
+    def test_fast_json_serializer_uses_available_backend(self):
+        self.assertTrue(FastJSONSerializer().backend in
+                        dict(FastJSONSerializer.BACKENDS))
+        self.assertEquals(FastJSONSerializer(backend='json').backend, 'json')
+        self.assertRaises(ImproperlyConfigured, FastJSONSerializer,
+                          backend='unknown')
+
+    def test_bulk_operation_uses_serializer_of_client(self):
+        serializer = FastJSONSerializer()
+        ss = SuperElasticsearch(hosts=['localhost:9200'],
+                                serializer=serializer)
+        ss.bulk = Mock(return_value=dict(items=[]))
+        bulk = ss.bulk_operation()
+        bulk.index(index='test', id=1, body=self.doc)
+        bulk.execute()
+
+        self.assertEquals(ss.bulk.call_args[1]['body'],
+                          serializer.dumps({'index': {'_index': 'test',
+                                                      '_id': 1}}) + '\n' +
+                          serializer.dumps(self.doc) + '\n')
+
+
+class TestSerializerPool(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = SerializerPool(processes=2, min_actions=10, chunk_size=7)
+        self.addCleanup(self.pool.close)
+
+    def record(self, bulk, count):
+        for i in range(count):
+            bulk.index(id=i, body=dict(text=u'd\xe9j\xe0 vu %s' % i,
+                                       nested=dict(values=[i, i + 1]),
+                                       created=date(2015, 10, 6)))
+            if i % 10 == 0:
+                bulk.delete(id=i)
+
+    def lines(self, body):
+        # keys of pickled dicts can come out in another order on Python 2
+        return [json.loads(line) for line in body.splitlines()]
+
+    def test_actions_are_serialized_in_workers_in_order(self):
+        bulk = BulkOperation(None, index='test', doc_type='docs',
+                             serializer_pool=self.pool)
+        expected = BulkOperation(None, index='test', doc_type='docs')
+        self.record(bulk, 50)
+        self.record(expected, 50)
+        # serialized before, e.g. when retried, and kept as they are
+        bulk._actions[0].serialize()
+
+        self.assertTrue(self.pool.serialize(bulk._actions))
+        self.assertEquals(self.lines(bulk._bulk_body(bulk._actions)),
+                          self.lines(expected._bulk_body(expected._actions)))
+
+    def test_workers_are_started_once(self):
+        pools = []
+        for _ in range(2):
+            bulk = BulkOperation(None, index='test', doc_type='docs',
+                                 serializer_pool=self.pool)
+            self.record(bulk, 30)
+            self.assertTrue(self.pool.serialize(bulk._actions))
+            pools.append(self.pool._pool)
+
+        self.assertTrue(pools[0] is not None and pools[0] is pools[1])
+        self.pool.close()
+        self.assertEquals(self.pool._pool, None)
+
+    def test_serialized_bodies_are_split_at_byte_offsets(self):
+        body = u'{"text": "d\xe9j\xe0 vu"}'
+        if str is bytes:
+            # given as UTF-8 str on Python 2
+            body = body.encode('utf-8')
+        bulk = BulkOperation(None, index='test', doc_type='docs',
+                             serializer_pool=self.pool)
+        expected = BulkOperation(None, index='test', doc_type='docs')
+        for each in (bulk, expected):
+            for i in range(20):
+                each.index(id=i, body=body)
+
+        self.assertTrue(self.pool.serialize(bulk._actions))
+        self.assertEquals(bulk._actions[1]._op,
+                          u'{"index": {"_id": 1}}\n'
+                          u'{"text": "d\xe9j\xe0 vu"}\n')
+        self.assertEquals(self.lines(bulk._bulk_body(bulk._actions)),
+                          self.lines(expected._bulk_body(expected._actions)))
+
+    def test_fast_json_serializer_can_be_pickled(self):
+        serializer = pickle.loads(pickle.dumps(FastJSONSerializer('json')))
+        self.assertEquals(serializer.backend, 'json')
+        self.assertEquals(serializer.dumps(dict(a=Decimal('1.5'))),
+                          '{"a": 1.5}')
+
+    def test_few_actions_are_serialized_in_process(self):
+        bulk = BulkOperation(None, index='test', doc_type='docs',
+                             serializer_pool=self.pool)
+        self.record(bulk, 5)
+
+        self.assertFalse(self.pool.serialize(bulk._actions))
+        self.assertEquals(len(bulk._bulk_body(bulk._actions).splitlines()),
+                          11)
+        self.assertEquals(self.pool._pool, None)
+
+    def test_actions_are_serialized_with_serializer_of_pool(self):
+        pool = SerializerPool(processes=1, min_actions=1,
+                              serializer=FastJSONSerializer('json'))
+        self.addCleanup(pool.close)
+        bulk = BulkOperation(None, index='test', doc_type='docs',
+                             serializer_pool=pool)
+        bulk.index(id=1, body=dict(price=Decimal('1.5')))
+
+        self.assertTrue(pool.serialize(bulk._actions))
+        self.assertEquals(bulk._actions[0]._op,
+                          '{"index": {"_id": 1}}\n{"price": 1.5}\n')
+
+    def test_actions_are_serialized_with_serializer_of_operation(self):
+        bulk = BulkOperation(None, index='test', doc_type='docs',
+                             serializer=CompactSerializer(),
+                             serializer_pool=self.pool)
+        for i in range(10):
+            bulk.index(id=i, body=dict(price=Decimal('1.5')))
+
+        self.assertEquals(bulk._bulk_body(bulk._actions).splitlines()[1],
+                          '{"price":1.5}')
+
+
+class TestBulkExecuteWithRetry(unittest.TestCase):
+
+    def setUp(self):
+        self.ss = SuperElasticsearch(hosts=['localhost:9200'])
+        self.bodies = []
+        self.responses = []
+
+        def bulk(body, **kwargs):
+            self.bodies.append([json.loads(line)['delete']['_id']
+                                for line in body.splitlines()])
+            resp = self.responses.pop(0)
+            if isinstance(resp, Exception):
+                raise resp
+            return resp
+
+        self.ss.bulk = Mock(side_effect=bulk)
+        self.bulk = self.ss.bulk_operation(index='test', doc_type='docs')
+        for i in range(4):
+            self.bulk.delete(id=i)
+
+    def item(self, id, status, error=None):
+        item = dict(_index='test', _type='docs', _id=id, status=status)
+        if error is not None:
+            item['error'] = error
+        return dict(delete=item)
+
+    @patch('superelasticsearch.time.sleep')
+    def test_execute_with_retry_retries_only_rejected_items(self, sleep):
+        rejected = 'EsRejectedExecutionException[rejected execution]'
+        self.responses = [
+            dict(took=5, errors=True, items=[
+                self.item(0, 200), self.item(1, 429, rejected),
+                self.item(2, 400, 'MapperParsingException[failed]'),
+                self.item(3, 429, rejected)]),
+            dict(took=3, errors=True, items=[
+                self.item(1, 200), self.item(3, 429, rejected)]),
+            dict(took=1, errors=False, items=[self.item(3, 200)]),
+        ]
+
+        resp = self.bulk.execute_with_retry(max_retries=3, backoff=1)
+
+        self.assertEquals(self.bodies, [[0, 1, 2, 3], [1, 3], [3]])
+        self.assertEquals([_item['delete']['status']
+                           for _item in resp['items']], [200, 200, 400, 200])
+        self.assertEquals(resp['succeeded'], 3)
+        self.assertEquals(resp['failed'], 1)
+        self.assertEquals(resp['retried'], 3)
+        self.assertEquals(resp['took'], 9)
+        self.assertTrue(resp['errors'])
+        self.assertEquals(sleep.call_count, 2)
+        self.assertTrue(0 <= sleep.call_args_list[1][0][0] <= 2)
+        self.assertEquals(len(self.bulk._actions), 0)
+
+    @patch('superelasticsearch.time.sleep')
+    def test_execute_with_retry_gives_up_after_max_retries(self, sleep):
+        self.responses = [dict(took=1, errors=True, items=[
+            self.item(i, 429, 'EsRejectedExecutionException[rejected]')
+            for i in ids]) for ids in ([0, 1, 2, 3], [0, 1, 2, 3])]
+
+        resp = self.bulk.execute_with_retry(max_retries=1)
+
+        self.assertEquals(self.ss.bulk.call_count, 2)
+        self.assertEquals(resp['failed'], 4)
+        self.assertEquals(resp['retried'], 4)
+
+    @patch('superelasticsearch.time.sleep')
+    def test_execute_with_retry_retries_rejected_requests(self, sleep):
+        self.responses = [
+            TransportError(429, 'rejected'),
+            dict(took=1, errors=False,
+                 items=[self.item(i, 200) for i in range(4)]),
+        ]
+
+        resp = self.bulk.execute_with_retry()
+
+        self.assertEquals(self.bodies, [[0, 1, 2, 3], [0, 1, 2, 3]])
+        self.assertEquals(resp['succeeded'], 4)
+        self.assertFalse(resp['errors'])
+
+        self.responses = [TransportError(400, 'bad request')]
+        self.bulk.delete(id=1)
+        self.assertRaises(TransportError, self.bulk.execute_with_retry)
+
+    @patch('superelasticsearch._item_failed')
+    def test_items_are_not_checked_without_errors(self, item_failed):
+        self.responses = [dict(took=1, errors=False,
+                               items=[self.item(i, 200) for i in range(4)])]
+
+        resp = self.bulk.execute_with_retry()
+
+        self.assertEquals((resp['succeeded'], resp['failed']), (4, 0))
+        self.assertFalse(item_failed.called)